@@ -1,29 +1,48 @@
+import logging
 import os
+import sys
 import jwt
 import datetime
-import bcrypt
-import psycopg2
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import jwt_auth, serving, tracing
+from common.db_pool import ConnectionPool
+from passwords import Overloaded, PasswordVerifier
+
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
+tracing.init_app(app, 'auth_service')
+
+# Helper function to get a (pooled) database connection
+db_pool = ConnectionPool.from_env('auth')
 
-# Helper function to get a database connection
 def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database='postgres',
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASS')
-    )
+    return db_pool.connection()
+
+# Tokens are signed with the active key of the shared key set and carry its
+# kid, so verifiers can pick the right key while keys rotate
+signing_keys = jwt_auth.KeySet.from_env()
+
+# bcrypt runs in a process pool with a cap on checks in flight; see passwords.py
+password_verifier = PasswordVerifier.from_env()
+
+# Each gunicorn worker gets its own connections and pool (see gunicorn.conf.py)
+serving.on_worker_start(db_pool.after_fork)
+serving.on_worker_start(password_verifier.reset)
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "service": "Auth Service"}), 200
+    return jsonify({
+        "status": "healthy",
+        "service": "Auth Service",
+        "db_pool": db_pool.stats(),
+        "password_verifier": password_verifier.stats()
+    }), 200
 
 @app.route('/login', methods=['POST'])
 def login():
@@ -32,33 +51,54 @@ def login():
     password = data.get('password')
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # 1. Find the user in the database
-        cur.execute("SELECT id, password FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-        
-        cur.close()
-        conn.close()
+        with get_db_connection() as conn, conn.cursor() as cur:
+            # 1. Find the user in the database
+            cur.execute("SELECT id, password FROM users WHERE username = %s", (username,))
+            user = cur.fetchone()
 
-        # 2. Check if user exists AND password matches
-        if user and bcrypt.checkpw(password.encode('utf-8'), user[1].encode('utf-8')):
+        # 2. Check if user exists AND password matches (off the request thread)
+        valid = False
+        if user:
+            with tracing.span('crypto', 'bcrypt.checkpw'):
+                valid, new_hash = password_verifier.verify(password, user[1])
+            if new_hash:
+                upgrade_password_hash(user[0], user[1], new_hash)
+        if valid:
             # 3. Create the Key (JWT Token)
+            kid, secret = signing_keys.signing_key()
             token = jwt.encode({
                 'user_id': user[0],
                 'username': username,
                 'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=1) # Expires in 1 hour
-            }, os.getenv('JWT_SECRET'), algorithm='HS256')
+            }, secret, algorithm=jwt_auth.ALGORITHM, headers={'kid': kid})
 
             return jsonify({"token": token})
         
         else:
             return jsonify({"error": "Invalid credentials"}), 401
 
+    except Overloaded:
+        response = jsonify({"error": "Too many logins in progress, retry shortly"})
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def upgrade_password_hash(user_id, old_hash, new_hash):
+    """Store a hash with the configured cost; a failure only delays the upgrade."""
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            # Guard on the old hash so a concurrent password change wins
+            cur.execute(
+                "UPDATE users SET password = %s WHERE id = %s AND password = %s",
+                (new_hash, user_id, old_hash)
+            )
+            conn.commit()
+    except Exception as e:
+        tracing.log_event('rehash_failed', logging.WARNING, user_id=user_id, error=str(e))
+
 if __name__ == '__main__':
     # Run on port 5001 to avoid clashing with Weather Service (5000)
     app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,141 @@
+"""Password verification off the request threads.
+
+bcrypt is deliberately slow, so checks run in a small process pool that
+spreads across cores and leaves the web threads free for everything else.
+At most ``max_pending`` checks may be queued or running; past that callers
+get ``Overloaded`` straight away instead of waiting behind the backlog.
+
+Each web worker process has its own pool. By default it gets an equal share
+of the cores (cores / WEB_CONCURRENCY, at least one), so however many
+gunicorn workers run there are about as many bcrypt processes as cores. The
+Dockerfile runs a single web worker, which then owns one process per core and
+makes the limits below per host.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+
+
+class Overloaded(Exception):
+    """Raised when too many password checks are already in flight."""
+
+
+def hash_cost(hashed):
+    """Cost factor of a bcrypt hash ($2b$<cost>$...), or None if unparseable."""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def check_password(password, hashed, rounds=BCRYPT_ROUNDS):
+    """Verify ``password``; returns (valid, new_hash).
+
+    ``new_hash`` is set when the password is valid but the stored hash uses a
+    different cost factor than ``rounds``, so the caller can upgrade it.
+    Runs inside the pool processes (it must stay a module-level function).
+    """
+    if not bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8')):
+        return False, None
+    if hash_cost(hashed) != rounds:
+        return True, bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+    return True, None
+
+
+def default_workers():
+    """This web worker's share of the cores (gunicorn.conf.py exports WEB_CONCURRENCY)."""
+    web_workers = max(1, int(os.getenv('WEB_CONCURRENCY', 1)))
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+
+class PasswordVerifier:
+    """Bounded process pool for bcrypt checks with fail-fast admission."""
+
+    def __init__(self, workers=None, max_pending=None, timeout=10.0, rounds=BCRYPT_ROUNDS):
+        self.workers = workers or default_workers()
+        self.max_pending = max_pending or self.workers * 4
+        self.timeout = timeout
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+
+        self._verified = 0
+        self._rejected = 0
+        self._rehashed = 0
+
+    @classmethod
+    def from_env(cls):
+        """Read BCRYPT_WORKERS, LOGIN_MAX_CONCURRENT and LOGIN_VERIFY_TIMEOUT."""
+        return cls(
+            workers=int(os.getenv('BCRYPT_WORKERS', 0)) or None,
+            max_pending=int(os.getenv('LOGIN_MAX_CONCURRENT', 0)) or None,
+            timeout=float(os.getenv('LOGIN_VERIFY_TIMEOUT', 10)),
+        )
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # spawn, not fork: the web process is multi-threaded
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def reset(self):
+        """Forget the pool inherited from a parent process; a new one starts on demand."""
+        self._executor = None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def verify(self, password, hashed):
+        """Check a password in the pool; returns (valid, new_hash) like ``check_password``.
+
+        Raises ``Overloaded`` when ``max_pending`` checks are already in flight
+        and ``TimeoutError`` if the pool does not answer within ``timeout``.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise Overloaded(f"more than {self.max_pending} password checks in flight")
+        try:
+            future = self._pool().submit(check_password, password, hashed, self.rounds)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until bcrypt is done, not until we stop waiting:
+        # a check that timed out keeps its pool process busy all the same
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            valid, new_hash = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise TimeoutError("password check timed out")
+
+        with self._lock:
+            self._verified += 1
+            if new_hash:
+                self._rehashed += 1
+        return valid, new_hash
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "rounds": self.rounds,
+                "verified": self._verified,
+                "rejected": self._rejected,
+                "rehashed": self._rehashed,
+            }
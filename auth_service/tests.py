@@ -0,0 +1,126 @@
+import os
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+import bcrypt
+import jwt
+
+import app as auth_app
+from app import app, password_verifier
+from common.jwt_auth import KeySet
+from passwords import Overloaded, PasswordVerifier, check_password, hash_cost
+
+
+class FakeConnection:
+    """Stands in for a pooled connection + cursor; returns one canned user."""
+
+    def __init__(self, user=None):
+        self.user = user
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        pass
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return self.user
+
+
+class PasswordTestCase(unittest.TestCase):
+    def test_rehash_when_cost_differs(self):
+        """A valid password stored with another cost factor gets a new hash"""
+        old = bcrypt.hashpw(b'secret', bcrypt.gensalt(5)).decode('utf-8')
+        self.assertEqual(check_password('wrong', old, rounds=4), (False, None))
+        self.assertEqual(check_password('secret', old, rounds=5), (True, None))
+
+        valid, new_hash = check_password('secret', old, rounds=4)
+        self.assertTrue(valid)
+        self.assertEqual(hash_cost(new_hash), 4)
+        self.assertTrue(bcrypt.checkpw(b'secret', new_hash.encode('utf-8')))
+
+    def test_verifier_runs_in_process_pool(self):
+        """Checks run in the pool and come back with the same answer"""
+        verifier = PasswordVerifier(workers=1, rounds=4)
+        hashed = bcrypt.hashpw(b'secret', bcrypt.gensalt(4)).decode('utf-8')
+        try:
+            self.assertEqual(verifier.verify('secret', hashed), (True, None))
+            self.assertEqual(verifier.verify('nope', hashed), (False, None))
+        finally:
+            verifier.shutdown()
+        self.assertEqual(verifier.stats()['verified'], 2)
+
+    def test_pool_shares_cores_between_web_workers(self):
+        """Each gunicorn worker's bcrypt pool gets cores / WEB_CONCURRENCY processes"""
+        with mock.patch('os.cpu_count', return_value=8):
+            with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+                self.assertEqual(PasswordVerifier().workers, 2)
+            with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '17'}):
+                self.assertEqual(PasswordVerifier().workers, 1)
+            with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+                self.assertEqual(PasswordVerifier().workers, 8)
+
+    def test_timed_out_check_keeps_its_slot_until_done(self):
+        """A check still running after the timeout counts against max_pending"""
+        verifier = PasswordVerifier(workers=1, max_pending=1, timeout=0.01)
+        running = Future()
+        running.set_running_or_notify_cancel()      # too late to cancel, as in the pool
+        with mock.patch.object(verifier, '_pool') as pool:
+            pool.return_value.submit.return_value = running
+            with self.assertRaises(TimeoutError):
+                verifier.verify('secret', 'hash')
+            with self.assertRaises(Overloaded):
+                verifier.verify('secret', 'hash')
+
+            running.set_result((True, None))
+            done = Future()
+            done.set_result((False, None))
+            pool.return_value.submit.return_value = done
+            self.assertEqual(verifier.verify('secret', 'hash'), (False, None))
+
+
+class AuthServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+
+    def test_overloaded_login_returns_429(self):
+        """Past the in-flight limit logins are refused at once with Retry-After"""
+        db = FakeConnection(user=(1, 'hash'))
+        with mock.patch.object(auth_app, 'get_db_connection', return_value=db), \
+             mock.patch.object(password_verifier, 'verify', side_effect=Overloaded('busy')):
+            response = self.app.post('/login', json={"username": "admin", "password": "admin"})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+    def test_login_upgrades_hash(self):
+        """A successful login with an outdated cost factor stores the new hash"""
+        db = FakeConnection(user=(1, 'old-hash'))
+        with mock.patch.object(auth_app, 'get_db_connection', return_value=db), \
+             mock.patch.object(password_verifier, 'verify', return_value=(True, 'new-hash')), \
+             mock.patch.object(auth_app, 'signing_keys', KeySet({'k2': 'test-secret'}, active_kid='k2')):
+            response = self.app.post('/login', json={"username": "admin", "password": "admin"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(jwt.get_unverified_header(response.get_json()['token'])['kid'], 'k2')
+        self.assertEqual(db.executed[-1][1], ('new-hash', 1, 'old-hash'))
+
+    def test_health_stays_up(self):
+        """Health reports the verifier without touching bcrypt"""
+        response = self.app.get('/health')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max_pending', response.get_json()['password_verifier'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+"""Logins/second of bcrypt verification: inline vs the process pool, per core count.
+
+Runs the same password check auth_service does for every login, from many
+concurrent "request" threads, first inline on the calling thread and then
+through PasswordVerifier with 1..N pool processes:
+
+    python benchmarks/bench_auth.py --seconds 5 --clients 32 --rounds 12
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import bcrypt
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'auth_service'))
+from passwords import Overloaded, PasswordVerifier, check_password
+
+
+def drive(check, seconds, clients):
+    counts = {"ok": 0, "rejected": 0}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def client():
+        ok = rejected = 0
+        while time.monotonic() < stop_at:
+            try:
+                check()
+                ok += 1
+            except Overloaded:
+                rejected += 1
+                time.sleep(0.01)
+        with lock:
+            counts["ok"] += ok
+            counts["rejected"] += rejected
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    hashed = bcrypt.hashpw(b'password123', bcrypt.gensalt(args.rounds)).decode('utf-8')
+    print(f"bcrypt cost {args.rounds}, {args.clients} clients, {os.cpu_count()} cores")
+
+    counts = drive(lambda: check_password('password123', hashed, args.rounds), args.seconds, args.clients)
+    print(f"  inline          {counts['ok'] / args.seconds:8.1f} logins/s")
+
+    for workers in range(1, args.max_workers + 1):
+        verifier = PasswordVerifier(workers=workers, rounds=args.rounds)
+        verifier.verify('password123', hashed)      # start the pool outside the timing
+        counts = drive(lambda: verifier.verify('password123', hashed), args.seconds, args.clients)
+        verifier.shutdown()
+        print(f"  pool x{workers:<2}        {counts['ok'] / args.seconds:8.1f} logins/s"
+              f"  ({counts['rejected']} rejected with 429)")
+
+
+if __name__ == '__main__':
+    main()
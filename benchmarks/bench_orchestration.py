@@ -0,0 +1,100 @@
+"""Compare sequential vs parallel room/weather lookups on POST /bookings (preview).
+
+Runs booking_service in-process against stub room and weather services that
+answer after a fixed delay, so the numbers show orchestration overhead only:
+
+    python benchmarks/bench_orchestration.py --requests 200 --delay-ms 20
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'booking_service'))
+
+
+def start_stub(app, port):
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def stub_services(delay):
+    rooms = Flask('stub_rooms')
+    weather = Flask('stub_weather')
+
+    @rooms.route('/rooms/<int:room_id>')
+    def room(room_id):
+        time.sleep(delay)
+        return jsonify({"id": room_id, "name": "Louvre Room", "location": "Paris", "price_per_hour": 200.0})
+
+    @weather.route('/weather')
+    def forecast():
+        time.sleep(delay)
+        return jsonify({"location": request.args['location'], "temperature": 26})
+
+    return rooms, weather
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(client, count, parallel, booking_app):
+    booking_app.PARALLEL_LOOKUPS = parallel
+    booking_app.room_locations.clear()
+    payload = {
+        "user_id": 1, "room_id": 5, "room_name": "Louvre Room",
+        "date": (date.today() + timedelta(days=7)).isoformat(), "preview": True
+    }
+    client.post('/bookings', json=payload)   # warm-up (also learns the location)
+
+    samples = []
+    for _ in range(count):
+        started = time.perf_counter()
+        response = client.post('/bookings', json=payload)
+        samples.append((time.perf_counter() - started) * 1000)
+        assert response.status_code == 200, response.get_json()
+    return {
+        "p50_ms": round(statistics.median(samples), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "mean_ms": round(statistics.mean(samples), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--delay-ms', type=float, default=20)
+    parser.add_argument('--room-port', type=int, default=15002)
+    parser.add_argument('--weather-port', type=int, default=15000)
+    args = parser.parse_args()
+
+    os.environ['ROOM_SERVICE_URL'] = f'http://127.0.0.1:{args.room_port}'
+    os.environ['WEATHER_SERVICE_URL'] = f'http://127.0.0.1:{args.weather_port}'
+    import app as booking_app
+
+    rooms, weather = stub_services(args.delay_ms / 1000)
+    servers = [start_stub(rooms, args.room_port), start_stub(weather, args.weather_port)]
+    client = booking_app.app.test_client()
+
+    try:
+        for label, parallel in (("sequential", False), ("parallel", True)):
+            print(f"{label:>10}: {run(client, args.requests, parallel, booking_app)}")
+    finally:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
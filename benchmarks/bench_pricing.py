@@ -0,0 +1,55 @@
+"""Per-quote cost of the pricing engine.
+
+Times the single-quote path used by POST /bookings and the bulk path used by
+POST /quotes, with and without NumPy (installed or not, the pure-Python path
+is always measured):
+
+    python benchmarks/bench_pricing.py --cells 3000
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'booking_service'))
+import pricing
+
+
+def per_call_ns(fn, number):
+    best = min(timeit.repeat(fn, number=number, repeat=5))
+    return best / number * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cells', type=int, default=3000, help="quotes per bulk call (50 rooms x 60 days)")
+    args = parser.parse_args()
+
+    engine = pricing.engine
+    bases = [random.choice([100.0, 150.0, 200.0, 249.99]) for _ in range(args.cells)]
+    temps = [random.randint(5, 35) for _ in range(args.cells)]
+    base_cents = [pricing.to_cents(b) for b in bases]
+
+    print(f"{'rate lookup (table)':32} {per_call_ns(lambda: engine.rate_bp(27), 200000):8.0f} ns")
+    print(f"{'rate lookup (bisect)':32} {per_call_ns(lambda: engine.rate_bp(27.3), 200000):8.0f} ns")
+    print(f"{'quote_cents':32} {per_call_ns(lambda: engine.quote_cents(20000, 27), 200000):8.0f} ns")
+    print(f"{'quote -> Decimal':32} {per_call_ns(lambda: engine.quote(200.0, 27), 50000):8.0f} ns")
+
+    def bulk_cents():
+        engine.price_many_cents(base_cents, temps)
+
+    with mock.patch.object(pricing, 'np', None):
+        ns = per_call_ns(bulk_cents, 20) / args.cells
+    print(f"{'price_many_cents (python)':32} {ns:8.0f} ns/quote")
+    if pricing.np is not None:
+        ns = per_call_ns(bulk_cents, 20) / args.cells
+        print(f"{'price_many_cents (numpy)':32} {ns:8.0f} ns/quote")
+    else:
+        print("numpy not installed: vectorized path skipped")
+
+
+if __name__ == '__main__':
+    main()
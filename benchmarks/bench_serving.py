@@ -0,0 +1,101 @@
+"""Compare requests/second of a service under the Werkzeug dev server vs gunicorn.
+
+Boots weather_service (in-memory DynamoDB stand-in, so no AWS needed) both
+ways and hammers GET /weather from concurrent client threads:
+
+    python benchmarks/bench_serving.py --seconds 10 --clients 32
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_until_up(url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=0.5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def drive(url, seconds, clients):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def client(i):
+        session = requests.Session()
+        local = []
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            try:
+                ok = session.get(url, params={"location": "Paris", "date": f"2030-01-{i % 28 + 1:02d}"},
+                                 timeout=5).status_code == 200
+            except requests.RequestException:
+                ok = False
+            local.append((time.perf_counter() - started) * 1000)
+            if not ok:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "req_per_s": round(len(latencies) / seconds, 1),
+        "p50_ms": round(statistics.median(latencies), 2),
+        "p99_ms": round(latencies[int(0.99 * (len(latencies) - 1))], 2),
+        "errors": errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--port', type=int, default=15100)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() * 2 + 1)
+    args = parser.parse_args()
+
+    env = dict(os.environ, WEATHER_BACKEND='memory', PORT=str(args.port),
+               WEB_CONCURRENCY=str(args.workers), GUNICORN_ACCESS_LOG='/dev/null')
+    service = os.path.join(ROOT, 'weather_service')
+    modes = {
+        "werkzeug dev server": [sys.executable, '-c',
+                                f"import app; app.app.run(host='127.0.0.1', port={args.port})"],
+        f"gunicorn ({args.workers} workers)": [
+            sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+            '--bind', f'127.0.0.1:{args.port}', 'app:app'],
+    }
+    url = f'http://127.0.0.1:{args.port}/weather'
+    for label, command in modes.items():
+        proc = subprocess.Popen(command, cwd=service, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_until_up(f'http://127.0.0.1:{args.port}/health')
+            print(f"{label:>28}: {drive(url, args.seconds, args.clients)}", flush=True)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == '__main__':
+    main()
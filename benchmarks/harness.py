@@ -0,0 +1,284 @@
+"""Reproducible load test for the booking flow.
+
+Boots weather, room, auth and booking services as local processes, seeds a
+Postgres database and drives a workload mix against them, then writes
+per-endpoint throughput, latency percentiles and error rates to JSON.
+
+DynamoDB is replaced by the in-memory stand-in (WEATHER_BACKEND=memory).
+Postgres comes from the usual DB_* variables, or use ``--pg embedded`` to
+start a throwaway server from the `pgserver` package (pip install pgserver),
+which needs no container or system install.
+
+    python benchmarks/harness.py --pg embedded --mix mixed --seconds 20
+    python benchmarks/harness.py --compare results/old.json results/new.json
+
+The embedded server is seeded with rooms, users and the bookings schema.
+A database from DB_* is used as it is, unless ``--seed`` is given: seeding
+drops and recreates the rooms and users tables, so only ask for it on a
+scratch database.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(ROOT, 'benchmarks', 'results')
+
+SERVICES = {
+    # name: (directory, port)
+    'weather': ('weather_service', 15200),
+    'room': ('room_service', 15202),
+    'auth': ('auth_service', 15201),
+    'booking': ('booking_service', 15204),
+}
+
+# Workload mixes: operation -> relative weight
+MIXES = {
+    'preview-heavy': {'preview': 80, 'rooms': 15, 'book': 5},
+    'booking-rush': {'book': 70, 'preview': 20, 'dashboard': 10},
+    'dashboard': {'dashboard': 85, 'rooms': 10, 'delete': 5},
+    'deletes': {'book': 50, 'delete': 50},
+    'mixed': {'preview': 40, 'rooms': 20, 'book': 15, 'dashboard': 20, 'delete': 5},
+}
+
+
+# --- ENVIRONMENT ---
+def start_embedded_postgres():
+    try:
+        import pgserver
+    except ImportError:
+        sys.exit("--pg embedded needs the pgserver package: pip install pgserver")
+    data_dir = tempfile.mkdtemp(prefix='bench-pg-')
+    server = pgserver.get_server(data_dir, cleanup_mode='stop')
+    return server, {'DB_HOST': data_dir, 'DB_USER': 'postgres', 'DB_PASS': '', 'DB_NAME': 'postgres'}
+
+
+def seed_database(env):
+    for script in ('room_service/init_db.py', 'setup_users.py', 'booking_service/init_db.py'):
+        subprocess.run([sys.executable, os.path.join(ROOT, script)], env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+
+
+def start_services(env, server):
+    processes = []
+    for name, (directory, port) in SERVICES.items():
+        if server == 'gunicorn':
+            command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                       '--bind', f'127.0.0.1:{port}', 'app:app']
+        else:
+            command = [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port})"]
+        processes.append(subprocess.Popen(
+            command, cwd=os.path.join(ROOT, directory), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        ))
+    for name, (_, port) in SERVICES.items():
+        wait_until_up(f'http://127.0.0.1:{port}/health')
+    return processes
+
+
+def wait_until_up(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=0.5).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+# --- WORKLOAD ---
+class Workload:
+    """Issues one weighted-random operation at a time and records the outcome."""
+
+    # Status codes that are a correct answer rather than a failure
+    EXPECTED = {'book': {201, 409}, 'delete': {200, 404}}
+
+    def __init__(self, mix, days_ahead=60):
+        self.booking_url = f"http://127.0.0.1:{SERVICES['booking'][1]}"
+        self.room_url = f"http://127.0.0.1:{SERVICES['room'][1]}"
+        self.operations, self.weights = zip(*MIXES[mix].items())
+        self.days_ahead = days_ahead
+        self.samples = defaultdict(list)     # endpoint -> [(latency_ms, ok)]
+        self.lock = threading.Lock()
+        self.created = []                    # booking ids available for deletion
+
+        session = requests.Session()
+        self.rooms = session.get(f"{self.room_url}/rooms").json()
+        login = session.post(f"{self.booking_url}/login",
+                             json={"email": "john@nexus.com", "password": "password123"}).json()
+        self.user_id = login['user_id']
+
+    def _payload(self, preview):
+        room = random.choice(self.rooms)
+        day = date.today() + timedelta(days=random.randint(1, self.days_ahead))
+        return {"user_id": self.user_id, "room_id": room['id'], "room_name": room['name'],
+                "date": day.isoformat(), "preview": preview}
+
+    def run_one(self, session):
+        operation = random.choices(self.operations, self.weights)[0]
+        if operation == 'preview':
+            endpoint, call = 'POST /bookings (preview)', lambda: session.post(
+                f"{self.booking_url}/bookings", json=self._payload(True))
+        elif operation == 'book':
+            endpoint, call = 'POST /bookings', lambda: session.post(
+                f"{self.booking_url}/bookings", json=self._payload(False))
+        elif operation == 'rooms':
+            endpoint, call = 'GET /rooms', lambda: session.get(f"{self.room_url}/rooms")
+        elif operation == 'dashboard':
+            endpoint, call = 'GET /bookings/user/<id>', lambda: session.get(
+                f"{self.booking_url}/bookings/user/{self.user_id}", params={"limit": 50})
+        else:
+            with self.lock:
+                booking_id = self.created.pop() if self.created else 0
+            endpoint, call = 'DELETE /bookings/<id>', lambda: session.delete(
+                f"{self.booking_url}/bookings/{booking_id}")
+
+        started = time.perf_counter()
+        try:
+            response = call()
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, None
+        elapsed = (time.perf_counter() - started) * 1000
+
+        ok = status in self.EXPECTED.get(operation, {200})
+        with self.lock:
+            self.samples[endpoint].append((elapsed, ok))
+            if operation == 'book' and status == 201:
+                self.created.append(response.json()['id'])
+
+    def drive(self, seconds, clients):
+        stop_at = time.monotonic() + seconds
+
+        def client():
+            session = requests.Session()
+            while time.monotonic() < stop_at:
+                self.run_one(session)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def report(self, seconds):
+        endpoints = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = sorted(ms for ms, _ in samples)
+            errors = sum(1 for _, ok in samples if not ok)
+            endpoints[endpoint] = {
+                "requests": len(samples),
+                "throughput_rps": round(len(samples) / seconds, 2),
+                "p50_ms": round(statistics.median(latencies), 2),
+                "p95_ms": round(percentile(latencies, 95), 2),
+                "p99_ms": round(percentile(latencies, 99), 2),
+                "error_rate": round(errors / len(samples), 4),
+            }
+        return endpoints
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+# --- RESULTS ---
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old['commit']} ({old['mix']}) -> {new['commit']} ({new['mix']})")
+    for endpoint in sorted(set(old['endpoints']) | set(new['endpoints'])):
+        before, after = old['endpoints'].get(endpoint), new['endpoints'].get(endpoint)
+        if not before or not after:
+            print(f"  {endpoint}: only in {'new' if after else 'old'} run")
+            continue
+        deltas = []
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms', 'error_rate'):
+            a, b = before[metric], after[metric]
+            change = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+            deltas.append(f"{metric} {a} -> {b} ({change})")
+        print(f"  {endpoint}:\n    " + "\n    ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--seconds', type=float, default=20)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--server', choices=('gunicorn', 'dev'), default='gunicorn')
+    parser.add_argument('--pg', choices=('env', 'embedded'), default='env',
+                        help="use DB_* from the environment or start an embedded Postgres")
+    parser.add_argument('--seed', action='store_true',
+                        help="drop and recreate the tables of the DB_* database (always done with --pg embedded)")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/<commit>-<mix>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="diff two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    env = dict(os.environ, WEATHER_BACKEND='memory', GUNICORN_ACCESS_LOG='/dev/null',
+               ROOM_SERVICE_URL=f"http://127.0.0.1:{SERVICES['room'][1]}",
+               WEATHER_SERVICE_URL=f"http://127.0.0.1:{SERVICES['weather'][1]}",
+               JWT_SECRET=os.getenv('JWT_SECRET', 'benchmark-secret'))
+    pg_server = None
+    if args.pg == 'embedded':
+        pg_server, db_env = start_embedded_postgres()
+        env.update(db_env)
+    if args.pg == 'embedded' or args.seed:
+        seed_database(env)
+
+    processes = start_services(env, args.server)
+    try:
+        workload = Workload(args.mix)
+        workload.drive(args.seconds, args.clients)
+        result = {
+            "commit": git_commit(),
+            "mix": args.mix,
+            "server": args.server,
+            "clients": args.clients,
+            "seconds": args.seconds,
+            "recorded_at": time.strftime('%Y-%m-%dT%H:%M:%S'),
+            "endpoints": workload.report(args.seconds),
+        }
+    finally:
+        for proc in processes:
+            proc.terminate()
+        for proc in processes:
+            proc.wait()
+        if pg_server is not None:
+            pg_server.cleanup()
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{result['commit']}-{args.mix}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result['endpoints'], indent=2))
+    print(f"Saved to {output}")
+
+
+if __name__ == '__main__':
+    main()
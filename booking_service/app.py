@@ -1,10 +1,26 @@
 import os
-import requests
+import sys
+import json
+import logging
+import threading
+import time
 import psycopg2
-from flask import Flask, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
-from datetime import datetime, date
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import jwt_auth, responses, serving, tracing
+from common.db_pool import ConnectionPool, ReplicaRouter
+from common.http_client import ServiceClient, ServiceUnavailable
+from common.idempotency import IdempotencyStore, idempotent
+from common.room_catalog import RoomCatalog
+import change_feed
+import contract
+import pricing
+import slots
 
 load_dotenv()
 
@@ -12,20 +28,118 @@ app = Flask(__name__)
 
 # --- ☢️ THE NUCLEAR CORS FIX ☢️ ---
 # This explicitly allows ALL origins, ALL headers, and supports credentials.
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True,
+     expose_headers=["X-Next-Cursor", "X-Changes-Cursor", "X-Read-After", "Idempotent-Replayed",
+                     tracing.TRACE_HEADER])
+# Trace IDs, per-request span logs and GET /metrics
+tracing.init_app(app, 'booking_service')
+# gzip/brotli (streamed lists too) and bytes-on-wire metrics for every response
+responses.init_app(app)
+# Bearer tokens from auth_service are verified locally; see common/jwt_auth.py
+token_verifier = jwt_auth.TokenVerifier.from_env()
+jwt_auth.init_app(app, token_verifier)
+
+def forbidden_unless_self(user_id):
+    """403 response if an authenticated caller acts for another user, else None."""
+    caller = jwt_auth.current_user_id()
+    if caller is not None and str(caller) != str(user_id):
+        return jsonify({"error": "You can only act on your own bookings"}), 403
+    return None
 
 # --- CONFIGURATION ---
-ROOM_SERVICE_URL = os.getenv('ROOM_SERVICE_URL', 'http://localhost:5002')
-WEATHER_SERVICE_URL = os.getenv('WEATHER_SERVICE_URL', 'http://localhost:5000')
+# Keep-alive clients with timeouts, retries and a circuit breaker per dependency.
+# Each one reads <PREFIX>_URL, <PREFIX>_CONNECT_TIMEOUT, <PREFIX>_READ_TIMEOUT, ...
+room_client = ServiceClient.from_env('room_service', 'ROOM_SERVICE', 'http://localhost:5002')
+weather_client = ServiceClient.from_env('weather_service', 'WEATHER_SERVICE', 'http://localhost:5000')
+DEFAULT_TEMP = 20
+
+# Room and weather lookups run side by side when we already know the room's
+# location (rooms practically never move, so it is cached after the first fetch)
+PARALLEL_LOOKUPS = os.getenv('PARALLEL_LOOKUPS', '1') == '1'
+orchestration_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ORCHESTRATION_THREADS', 16)),
+    thread_name_prefix='orchestration'
+)
+room_locations = {}
+room_locations_lock = threading.Lock()
+
+# Connections are shared between requests instead of reconnecting every time
+db_pool = ConnectionPool.from_env(
+    'booking', host='localhost', database='postgres', user='postgres', password='postgres'
+)
 
 def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv('DB_HOST', 'localhost'),
-        database=os.getenv('DB_NAME', 'postgres'),
-        user=os.getenv('DB_USER', 'postgres'),
-        password=os.getenv('DB_PASS', 'postgres'),
-        port=os.getenv('DB_PORT', 5432)
-    )
+    return db_pool.connection()
+
+# Read-only endpoints may be served by the replicas listed in DB_REPLICAS.
+# After a user's write, their reads stay on the primary until replicas have
+# caught up (see common/db_pool.py); everything else uses get_db_connection().
+# Another worker does not know about the write, so write responses carry its
+# time in X-Read-After and clients send it back on their next reads.
+db_router = ReplicaRouter.from_env(db_pool)
+READ_AFTER_HEADER = 'X-Read-After'
+
+def get_read_connection(key=None):
+    try:
+        wrote_at = float(request.headers[READ_AFTER_HEADER])
+    except (KeyError, ValueError):
+        wrote_at = None
+    return db_router.read_connection(key, wrote_at=wrote_at)
+
+def mark_written(*user_ids):
+    """Call after committing a write: its users and this client read from the primary."""
+    for user_id in user_ids:
+        db_router.wrote(user_id)
+    g.wrote_at = time.time()
+
+@app.after_request
+def send_write_time(response):
+    wrote_at = g.pop('wrote_at', None)
+    if wrote_at is not None:
+        response.headers[READ_AFTER_HEADER] = f"{wrote_at:.3f}"
+    return response
+
+# Wakes change-feed streams when the bookings trigger sends NOTIFY
+change_notifier = change_feed.ChangeNotifier(db_pool.dsn)
+
+# Retried POST /bookings with the same Idempotency-Key get the first response
+# back without touching room_service, weather_service or the bookings table.
+# IDEMPOTENCY_BACKEND=postgres shares stored responses between workers.
+idempotency_store = IdempotencyStore.from_env(db_pool)
+
+# ROOM_CATALOG_SOURCE=db reads rooms straight from the shared database (cached
+# in memory) instead of calling room_service over HTTP for every booking
+room_catalog = None
+if os.getenv('ROOM_CATALOG_SOURCE', 'http') == 'db':
+    room_catalog = RoomCatalog(db_router.reads(), ttl=float(os.getenv('ROOM_CATALOG_TTL', 60)))
+
+def lookup_room(room_id):
+    """Return the room's details, or None if it does not exist."""
+    if room_catalog is not None:
+        return room_catalog.get(room_id)
+    room_response = room_client.get(f"/rooms/{room_id}")
+    if room_response.status_code != 200:
+        return None
+    return room_response.json()
+
+# Each gunicorn worker gets its own connections and sessions (see gunicorn.conf.py)
+serving.on_worker_start(db_router.after_fork)
+serving.on_worker_start(room_client.reset)
+serving.on_worker_start(weather_client.reset)
+serving.on_worker_start(change_notifier.reset)
+
+def fetch_temperature(location, date_str):
+    """Ask weather_service for the forecast, falling back to DEFAULT_TEMP."""
+    # Fails fast to the default once the weather breaker has tripped
+    try:
+        weather_response = weather_client.get(
+            "/weather", params={"location": location, "date": date_str}
+        )
+        if weather_response.status_code == 200:
+            return weather_response.json().get('temperature', DEFAULT_TEMP)
+    except (ServiceUnavailable, ValueError) as e:
+        tracing.log_event('weather_fallback', logging.WARNING, error=str(e), default=DEFAULT_TEMP)
+    return DEFAULT_TEMP
 
 # --- NEW: LOGIN ENDPOINT (Added for Phase 2) ---
 @app.route('/login', methods=['POST', 'OPTIONS'])
@@ -42,15 +156,10 @@ def login():
         return jsonify({"error": "Email and password required"}), 400
 
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # 1. Find the user by Email
-        cur.execute("SELECT id, name, password_hash FROM users WHERE email = %s", (email,))
-        user = cur.fetchone()
-        
-        cur.close()
-        conn.close()
+        with get_db_connection() as conn, conn.cursor() as cur:
+            # 1. Find the user by Email
+            cur.execute("SELECT id, name, password_hash FROM users WHERE email = %s", (email,))
+            user = cur.fetchone()
 
         if user:
             user_id, name, stored_password = user
@@ -66,188 +175,539 @@ def login():
         return jsonify({"error": "Invalid credentials"}), 401
 
     except Exception as e:
-        print(f"LOGIN ERROR: {e}")
+        tracing.log_event('login_error', logging.ERROR, error=str(e))
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "service": "Booking Service"}), 200
+    return jsonify({
+        "status": "healthy",
+        "service": "Booking Service",
+        "db_pool": db_pool.stats(),
+        "db_replicas": db_router.stats(),
+        "dependencies": {
+            "room_service": room_client.stats(),
+            "weather_service": weather_client.stats()
+        },
+        "room_catalog": room_catalog.stats() if room_catalog else None,
+        "auth": token_verifier.stats(),
+        "change_feed": change_notifier.stats(),
+        "idempotency": idempotency_store.stats()
+    }), 200
 
 # --- THE MAIN ENDPOINT: CREATE A BOOKING ---
 @app.route('/bookings', methods=['POST'])
+@idempotent(idempotency_store, scope=jwt_auth.current_user_id)
 def create_booking():
     data = request.get_json()
-    user_id = data.get('user_id')
-    room_id = data.get('room_id')
-    room_name = data.get('room_name')
-    date_str = data.get('date')
-    
     # Check if this is just a preview (Quote)
     is_preview = data.get('preview', False)
-
-    if not all([user_id, room_id, date_str]):
-        return jsonify({"error": "Missing fields"}), 400
+    try:
+        user_id, room_id, room_name = contract.booking_request(data, jwt_auth.current_user_id())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
 
     # --- BLOCK PAST DATES ---
     try:
-        booking_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-        today = date.today()
-
-        if booking_date < today:
-            return jsonify({
-                "error": f"Cannot book in the past. Today is {today}, you asked for {booking_date}"
-            }), 400
-            
-    except ValueError:
-        return jsonify({"error": "Invalid date format. Use YYYY-MM-DD"}), 400
+        slot = slots.parse_slot(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    days = slot.days()
+    date_str = days[0][0].isoformat()
 
     try:
-        # 1. ORCHESTRATION: Get Room Details
-        room_response = requests.get(f"{ROOM_SERVICE_URL}/rooms/{room_id}")
-        if room_response.status_code != 200:
+        # 1 + 2. ORCHESTRATION: start the weather lookup straight away if we
+        # already know where the room is, then fetch the room details.
+        # (With the local catalog the room lookup is a dict access anyway.)
+        known_location = None
+        if PARALLEL_LOOKUPS and room_catalog is None:
+            known_location = room_locations.get(str(room_id))
+        weather_future = None
+        if known_location:
+            weather_future = orchestration_pool.submit(
+                tracing.wrap(fetch_slot_temperatures), known_location, days
+            )
+
+        def drop_weather():
+            # Unused forecast: skip it if it has not started yet
+            if weather_future is not None:
+                weather_future.cancel()
+
+        try:
+            room_data = lookup_room(room_id)
+        except ServiceUnavailable as e:
+            drop_weather()
+            return jsonify({"error": str(e)}), 503
+        if room_data is None:
+            drop_weather()
+            with room_locations_lock:
+                room_locations.pop(str(room_id), None)
             return jsonify({"error": "Room not found"}), 404
-        room_data = room_response.json()
         
         location = room_data.get('location', 'Unknown')
-        base_price = room_data.get('price_per_hour') or room_data.get('base_price', 0)
-        
-        # 2. ORCHESTRATION: Get Weather Details
-        current_temp = 20 
-        try:
-            weather_response = requests.get(f"{WEATHER_SERVICE_URL}/weather?location={location}&date={date_str}")
-            if weather_response.status_code == 200:
-                current_temp = weather_response.json().get('temperature', 20)
-        except:
-            print("Weather service unavailable, using default.")
-
-        # 3. ALGORITHM: Calculate Surcharge
-        target_temp = 21
-        temp_diff = abs(target_temp - current_temp)
-        surcharge_percentage = 0.0
-
-        if temp_diff < 2:
-            surcharge_percentage = 0.0
-        elif 2 <= temp_diff < 5:
-            surcharge_percentage = 0.10
-        elif 5 <= temp_diff < 10:
-            surcharge_percentage = 0.20
-        elif 10 <= temp_diff < 20:
-            surcharge_percentage = 0.30
-        else: 
-            surcharge_percentage = 0.50
-
-        surcharge = base_price * surcharge_percentage
-        total_price = base_price + surcharge
+        base_price = contract.room_price(room_data)
+        with room_locations_lock:
+            room_locations[str(room_id)] = location
+
+        # Sequential fallback: unknown room, or it moved since we cached it
+        if weather_future is not None and known_location == location:
+            temps = weather_future.result()
+        else:
+            drop_weather()
+            temps = fetch_slot_temperatures(location, days)
+        current_temp = temps[0]
+
+        # 3. ALGORITHM: Calculate Surcharge (each day with its own forecast)
+        with tracing.span('pricing', 'quote'):
+            surcharge, total_price = pricing.quote_slot(
+                base_price, [(hours, temp) for (_, hours), temp in zip(days, temps)]
+            )
 
         # --- PREVIEW MODE ---
         if is_preview:
-            return jsonify({
-                "message": "Price Preview Calculated",
-                "room": room_name,
-                "date": date_str,
-                "location": location,
-                "weather_temp": current_temp,
-                "base_price": base_price,
-                "surcharge": surcharge,
-                "total_price": total_price,
-                "status": "PREVIEW_ONLY"
-            }), 200
+            return jsonify(pricing.receipt(
+                room_name, location, current_temp, base_price, surcharge, total_price,
+                message="Price Preview Calculated", date=date_str, status="PREVIEW_ONLY",
+                **slot.to_json()
+            )), 200
 
         # 4. DATABASE: Save the Booking (Only if NOT preview)
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Double Booking Protection
-        cur.execute("SELECT id FROM bookings WHERE room_id = %s AND date = %s", (room_id, date_str))
-        if cur.fetchone():
-            cur.close()
-            conn.close()
-            return jsonify({"error": "Room already booked for this date"}), 409
-
-        cur.execute(
-            """
-            INSERT INTO bookings (user_id, room_id, room_name, date, total_price)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id;
-            """,
-            (user_id, room_id, room_name, date_str, total_price)
-        )
-        
-        booking_id = cur.fetchone()[0]
-        conn.commit()
-        cur.close()
-        conn.close()
+        with get_db_connection() as conn, conn.cursor() as cur:
+            # Double Booking Protection: a single statement, so there is no
+            # window between "is it free?" and "take it". If the slot overlaps
+            # a booking of the same room, the exclusion constraint (one GiST
+            # probe) makes ON CONFLICT skip the insert.
+            cur.execute(
+                contract.INSERT_BOOKING_SQL,
+                (user_id, room_id, room_name, days[0][0], slot.start, slot.end, total_price)
+            )
+
+            row = cur.fetchone()
+            conn.commit()
+            if row is None:
+                return jsonify({"error": contract.ALREADY_BOOKED}), 409
+            mark_written(user_id)
+            booking_id = row[0]
 
         # 5. RESULT: Return the receipt
+        return jsonify(pricing.receipt(
+            room_name, location, current_temp, base_price, surcharge, total_price,
+            message="Booking confirmed!", id=booking_id, **slot.to_json()
+        )), 201
+
+    except (psycopg2.errors.UniqueViolation, psycopg2.errors.ExclusionViolation):
+        return jsonify({"error": contract.ALREADY_BOOKED}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- BATCH BOOKINGS: recurring meetings in one call ---
+# Every occurrence is priced from one room lookup and one batch weather call,
+# then inserted with a single multi-row INSERT in one transaction. By default
+# each occurrence succeeds or fails on its own (207 with per-item results);
+# with "all_or_nothing": true any failure rolls the whole batch back.
+# The request format is described in contract.py.
+@app.route('/bookings/batch', methods=['POST'])
+@idempotent(idempotency_store, scope=jwt_auth.current_user_id)
+def create_booking_batch():
+    data = request.get_json(silent=True) or {}
+    user_id = data.get('user_id') or jwt_auth.current_user_id()
+    room_id = data.get('room_id')
+    room_name = data.get('room_name')
+    all_or_nothing = bool(data.get('all_or_nothing', False))
+    is_preview = data.get('preview', False)
+
+    if not all([user_id, room_id]):
+        return jsonify({"error": "Missing fields"}), 400
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+    try:
+        items = slots.expand_batch(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # 1. Validate every occurrence
+    results, wanted = contract.validate_batch(items, all_or_nothing)
+    if not wanted and all_or_nothing:
+        return jsonify({"results": results}), 409
+
+    try:
+        # 2. One room lookup and one weather call for the whole batch
+        try:
+            room_data = lookup_room(room_id)
+        except ServiceUnavailable as e:
+            return jsonify({"error": str(e)}), 503
+        if room_data is None:
+            return jsonify({"error": "Room not found"}), 404
+        location = room_data.get('location', 'Unknown')
+        base_price = contract.room_price(room_data)
+
+        temps = fetch_temperatures(contract.weather_pairs(location, wanted))
+        with tracing.span('pricing', 'quote_slot'):
+            prices = contract.price_batch(base_price, location, wanted, temps)
+
+        if is_preview:
+            contract.batch_preview(results, wanted, prices)
+            return jsonify({"room": room_name, "location": location, "base_price": base_price,
+                            "status": "PREVIEW_ONLY", "results": results}), \
+                contract.batch_status(results, all_or_nothing, ok=200)
+
+        # 3. One statement inserts every occurrence that does not overlap an
+        # existing booking; RETURNING says which ones made it
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(contract.INSERT_BATCH_SQL,
+                        contract.batch_insert_params(user_id, room_id, room_name, wanted, prices))
+            created = {start: booking_id for booking_id, start in cur.fetchall()}
+            rolled_back = all_or_nothing and len(created) < len(wanted)
+            if rolled_back:
+                conn.rollback()
+            else:
+                conn.commit()
+                mark_written(user_id)
+
+        contract.batch_outcome(results, wanted, prices, created, rolled_back)
+        return jsonify({"room": room_name, "location": location, "results": results}), \
+            contract.batch_status(results, all_or_nothing)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- BULK QUOTES: many rooms x a date range in one call ---
+def lookup_rooms(room_ids):
+    """Return {room_id: room} for the requested ids with a single lookup."""
+    if room_catalog is not None:
+        rooms = room_catalog.all()
+    else:
+        rooms_response = room_client.get("/rooms")
+        if rooms_response.status_code != 200:
+            raise ServiceUnavailable(f"room_service returned {rooms_response.status_code}")
+        rooms = rooms_response.json()
+    return contract.rooms_by_id(rooms, room_ids)
+
+def fetch_temperatures(pairs):
+    """Forecasts for many (location, date) pairs in one weather_service call."""
+    temps = {pair: DEFAULT_TEMP for pair in pairs}
+    if not pairs:
+        return temps
+    try:
+        weather_response = weather_client.post(
+            "/weather/batch",
+            json={"items": [{"location": loc, "date": day} for loc, day in pairs]},
+            idempotent=True
+        )
+        if weather_response.status_code == 200:
+            for pair, result in zip(pairs, weather_response.json().get('results', [])):
+                temps[pair] = result.get('temperature', DEFAULT_TEMP)
+    except (ServiceUnavailable, ValueError) as e:
+        tracing.log_event('weather_fallback', logging.WARNING, error=str(e), default=DEFAULT_TEMP)
+    return temps
+
+def fetch_slot_temperatures(location, days):
+    """Forecast for each [(date, hours)] of a booking, in order."""
+    if len(days) == 1:
+        return [fetch_temperature(location, days[0][0].isoformat())]
+    pairs = [(location, day.isoformat()) for day, _ in days]
+    temps = fetch_temperatures(pairs)
+    return [temps[pair] for pair in pairs]
+
+@app.route('/quotes', methods=['POST'])
+def create_quotes():
+    try:
+        room_ids, start, end, days = contract.quote_request(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        # 1. Rooms and weather in bulk, in parallel with the availability query
+        try:
+            rooms = lookup_rooms(room_ids)
+        except ServiceUnavailable as e:
+            return jsonify({"error": str(e)}), 503
+        weather_future = orchestration_pool.submit(
+            tracing.wrap(fetch_temperatures), contract.quote_pairs(rooms, days)
+        )
+
+        # 2. Availability: one range query for every room and day
+        calendar = availability(list(rooms), start, end)
+        temps = weather_future.result()
+
+        # 3. Price the whole matrix in one pass
+        with tracing.span('pricing', 'price_many'):
+            return jsonify(contract.quotes_json(room_ids, rooms, days, temps, calendar)), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- AVAILABILITY CALENDAR ---
+def availability(room_ids, start, end):
+    """Bookings per room overlapping [start, end], one GiST index probe per room."""
+    with get_read_connection(jwt_auth.current_user_id()) as conn, conn.cursor() as cur:
+        cur.execute(contract.AVAILABILITY_SQL, contract.availability_params(room_ids, start, end))
+        return contract.availability_json(room_ids, start, end, cur.fetchall())
+
+@app.route('/rooms/<int:room_id>/availability', methods=['GET'])
+def get_room_availability(room_id):
+    try:
+        start, end = contract.parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date range: {e}"}), 400
+    try:
+        rooms = availability([room_id], start, end)
+        return jsonify({"room_id": room_id, "from": start.isoformat(), "to": end.isoformat(),
+                        **rooms[room_id]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/rooms/availability', methods=['GET'])
+def get_rooms_availability():
+    # ?room_ids=1,2,3&from=2025-03-01&to=2025-03-31
+    try:
+        room_ids = contract.parse_room_ids(request.args)
+        start, end = contract.parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    if not room_ids or len(room_ids) > contract.MAX_QUOTE_ROOMS:
+        return jsonify({"error": f"Provide between 1 and {contract.MAX_QUOTE_ROOMS} room_ids"}), 400
+    try:
+        rooms = availability(room_ids, start, end)
         return jsonify({
-            "message": "Booking confirmed!",
-            "id": booking_id,
-            "room": room_name,
-            "location": location,
-            "weather_temp": current_temp,
-            "base_price": base_price,
-            "surcharge": surcharge,
-            "total_price": total_price
-        }), 201
-
-    except psycopg2.errors.UniqueViolation:
-        return jsonify({"error": "Room already booked for this date"}), 409
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "rooms": {str(room_id): rooms[room_id] for room_id in room_ids}
+        }), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # --- DASHBOARD ENDPOINT ---
+# Paging and filters are described in contract.user_bookings_query.
+def stream_json_array(rows):
+    """Yield a JSON array one booking at a time."""
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(contract.booking_to_json(row))
+    yield ']'
+
 @app.route('/bookings/user/<int:user_id>', methods=['GET'])
 def get_user_bookings(user_id):
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+    try:
+        sql, params, limit, when = contract.user_bookings_query(user_id, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def list_position(cur):
+        """(ETag, change-feed cursor) for the list read next on ``cur``'s connection."""
+        version, cursor = change_feed.list_position(cur, user_id)
+        return contract.list_etag(user_id, version, when), cursor
+
+    if limit is None:
+        # Whole history: a server-side cursor feeds the response in batches,
+        # so neither the database driver nor Flask holds every row at once.
+        # The version, cursor and rows are read on one connection, so neither
+        # names newer data than the body holds.
+        resources = ExitStack()
+        try:
+            conn = resources.enter_context(get_read_connection(user_id))
+            with conn.cursor() as cur:
+                etag, cursor = list_position(cur)
+            unchanged = responses.not_modified(etag, contract.BOOKINGS_CACHE_CONTROL)
+        except Exception:
+            resources.close()
+            raise
+        if unchanged is not None:
+            resources.close()
+            unchanged.headers['X-Changes-Cursor'] = cursor
+            return unchanged
+
+        def generate():
+            with resources, conn.cursor(name='user_bookings') as cur:
+                cur.itersize = contract.STREAM_BATCH
+                cur.execute(sql, params)
+                yield from stream_json_array(cur)
+
+        response = Response(generate(), mimetype='application/json')
+        # Also returns the connection if the body is never read
+        response.call_on_close(resources.close)
+        response.headers['X-Changes-Cursor'] = cursor
+        return responses.with_validators(response, etag, contract.BOOKINGS_CACHE_CONTROL)
+
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT * FROM bookings WHERE user_id = %s ORDER BY date DESC", (user_id,))
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        bookings = []
-        for row in rows:
-            bookings.append({
-                "id": row[0],
-                "room_name": row[3],
-                "date": row[4],
-                "total_price": float(row[5]),
-                "created_at": str(row[6]) if len(row) > 6 else ""
-            })
-        return jsonify(bookings), 200
+        with get_read_connection(user_id) as conn, conn.cursor() as cur:
+            etag, cursor = list_position(cur)
+            unchanged = responses.not_modified(etag, contract.BOOKINGS_CACHE_CONTROL)
+            if unchanged is not None:
+                unchanged.headers['X-Changes-Cursor'] = cursor
+                return unchanged
+            # One extra row tells us whether another page exists
+            cur.execute(sql + " LIMIT %s", params + [limit + 1])
+            rows = cur.fetchall()
+
+        response = Response(stream_json_array(rows[:limit]), mimetype='application/json')
+        response.headers['X-Changes-Cursor'] = cursor
+        next_cursor = contract.next_page_cursor(rows, limit)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return responses.with_validators(response, etag, contract.BOOKINGS_CACHE_CONTROL)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+# --- CHANGE FEED ---
+# GET /bookings/changes?user_id=1                 -> {"changes": [], "next": cursor}
+# GET /bookings/changes?user_id=1&since=<cursor>  -> inserts and deletes after it
+# GET /bookings/changes/stream?user_id=1&since=.. -> the same as Server-Sent Events
+# Load /bookings/user/<id> and follow the feed from its X-Changes-Cursor, which
+# is read on the same connection (primary or replica) just before the list:
+# a change that lands in between is delivered again, which is harmless when
+# clients apply changes by booking id. A bare cursor from /bookings/changes
+# comes from the primary; a list loaded after it from a lagging replica could
+# be older than it, so it is only a safe start without replicas.
+CHANGES_POLL_SECONDS = float(os.getenv('CHANGES_POLL_SECONDS', 15))
+# Each open stream holds one of the worker's gthread threads, so streams are
+# short (the browser reconnects after the retry: delay, with Last-Event-ID)
+# and at most MAX_CHANGE_STREAMS are open per worker; past that the stream is
+# a 503 and clients poll /bookings/changes instead
+CHANGES_STREAM_SECONDS = float(os.getenv('CHANGES_STREAM_SECONDS', 25))
+MAX_CHANGE_STREAMS = int(os.getenv('MAX_CHANGE_STREAMS', max(1, int(os.getenv('GUNICORN_THREADS', 8)) // 2)))
+change_streams = threading.BoundedSemaphore(MAX_CHANGE_STREAMS)
+
+def changes_request():
+    """(user_id, since) from the query string, or raise ValueError."""
+    return change_feed.parse_request(request.args, request.headers, jwt_auth.current_user_id())
+
+def fetch_changes(user_id, since):
+    # The primary: it is what NOTIFY announces
+    with get_db_connection() as conn, conn.cursor() as cur:
+        rows, cursor = change_feed.read_changes(cur, user_id, since)
+        change_feed.maybe_purge(cur)
+        conn.commit()
+    return [contract.change_to_json(row) for row in rows], cursor
+
+@app.route('/bookings/changes', methods=['GET'])
+def get_booking_changes():
+    try:
+        user_id, since = changes_request()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+    try:
+        changes, cursor = fetch_changes(user_id, since)
+        return jsonify({"changes": changes, "next": cursor}), 200
+    except change_feed.CursorExpired:
+        return jsonify({"error": "Cursor expired; reload the bookings"}), 410
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/bookings/changes/stream', methods=['GET'])
+def stream_booking_changes():
+    try:
+        user_id, since = changes_request()
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+    if not change_streams.acquire(blocking=False):
+        response = jsonify({"error": contract.STREAMS_FULL})
+        response.headers['Retry-After'] = str(int(CHANGES_POLL_SECONDS))
+        return response, 503
+
+    def generate():
+        cursor = since
+        deadline = time.monotonic() + CHANGES_STREAM_SECONDS
+        seen = change_notifier.version(user_id)
+        yield contract.STREAM_RETRY
+        while True:
+            try:
+                changes, next_cursor = fetch_changes(user_id, cursor)
+            except change_feed.CursorExpired:
+                yield contract.STREAM_EXPIRED
+                return
+            if changes or cursor is None:
+                yield contract.change_event(changes, next_cursor)
+            else:
+                yield contract.STREAM_KEEP_ALIVE
+            cursor = change_feed.parse_cursor(next_cursor)
+            if time.monotonic() >= deadline:
+                return
+            seen = change_notifier.wait(user_id, seen, min(CHANGES_POLL_SECONDS, deadline - time.monotonic()))
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Called however the stream ends, even if the client left before it began
+    response.call_on_close(change_streams.release)
+    return response
+
 # --- DELETE BOOKING ENDPOINT ---
+# Who may delete what is described in contract.py.
+def delete_owner():
+    """(user_id the delete is limited to or None, 403 response or None)."""
+    owner, stated = contract.delete_owner(request.get_json(silent=True) or {}, request.args,
+                                          jwt_auth.current_user_id())
+    if stated is not None:
+        denied = forbidden_unless_self(stated)
+        if denied:
+            return None, denied
+    return owner, None
+
 @app.route('/bookings/<int:booking_id>', methods=['DELETE'])
 def delete_booking(booking_id):
+    owner, denied = delete_owner()
+    if denied:
+        return denied
     try:
-        # Make sure this block is indented!
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Check if booking exists first
-        cur.execute("SELECT id FROM bookings WHERE id = %s", (booking_id,))
-        if not cur.fetchone():
-            cur.close()
-            conn.close()
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(*contract.delete_sql(owner, booking_id))
+            deleted = cur.fetchone()
+            conn.commit()
+
+        if not deleted:
             return jsonify({"error": "Booking not found"}), 404
+        mark_written(deleted[0])
 
-        # Delete it
-        cur.execute("DELETE FROM bookings WHERE id = %s", (booking_id,))
-        conn.commit()
-        
-        cur.close()
-        conn.close()
-        
         return jsonify({"message": "Booking deleted successfully"}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+@app.route('/bookings/batch', methods=['DELETE'])
+def delete_booking_batch():
+    try:
+        booking_ids, all_or_nothing = contract.batch_delete_request(request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    owner, denied = delete_owner()
+    if denied:
+        return denied
+
+    try:
+        with get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute(*contract.batch_delete_sql(owner, booking_ids))
+            owners = dict(cur.fetchall())
+            deleted = set(owners)
+            if all_or_nothing and len(deleted) < len(booking_ids):
+                conn.rollback()
+                return jsonify({"results": contract.batch_delete_results(booking_ids, deleted, rolled_back=True)}), 409
+            conn.commit()
+            if owners:
+                mark_written(*set(owners.values()))
+
+        results = contract.batch_delete_results(booking_ids, deleted)
+        return jsonify({"results": results}), 200 if len(deleted) == len(booking_ids) else 207
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5004))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,616 @@
+"""Async (asyncio) variant of the booking service, for A/B testing against app.py.
+
+The same endpoints, JSON, headers and status codes as app.py (contract.py
+holds everything the two share), built on Quart, httpx and asyncpg: a
+request waiting on room_service, weather_service or Postgres parks a
+coroutine instead of a thread, so one process can keep thousands of bookings
+in flight. JWT checks, Idempotency-Key replays, batches, the change feed,
+ETags and compression behave as in app.py. Differences: every read goes to
+the primary (DB_REPLICAS is ignored, so X-Read-After is sent but never
+needed) and rooms always come from room_service (ROOM_CATALOG_SOURCE is
+ignored). Run it with an ASGI server, e.g.
+
+    cd booking_service && hypercorn async_app:app --bind 0.0.0.0:5004
+"""
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+import asyncpg
+from dotenv import load_dotenv
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import async_web, jwt_auth, tracing
+from common.async_db import AsyncConnectionPool
+from common.async_http_client import AsyncServiceClient
+from common.cache import AsyncSingleFlight
+from common.db_pool import ConnectionPool
+from common.http_client import ServiceUnavailable
+from common.idempotency import IdempotencyStore
+import change_feed
+import contract
+import pricing
+import slots
+
+load_dotenv()
+
+app = cors(Quart(__name__), allow_origin="*",
+           expose_headers=["X-Next-Cursor", "X-Changes-Cursor", "X-Read-After", "Idempotent-Replayed",
+                           tracing.TRACE_HEADER])
+async_web.init_tracing(app, 'booking_service')
+async_web.init_compression(app)
+token_verifier = jwt_auth.TokenVerifier.from_env()
+async_web.init_auth(app, token_verifier)
+current_user_id = async_web.current_user_id
+
+def forbidden_unless_self(user_id):
+    """403 response if an authenticated caller acts for another user, else None."""
+    caller = current_user_id()
+    if caller is not None and str(caller) != str(user_id):
+        return jsonify({"error": "You can only act on your own bookings"}), 403
+    return None
+
+# --- CONFIGURATION ---
+room_client = AsyncServiceClient.from_env('room_service', 'ROOM_SERVICE', 'http://localhost:5002')
+weather_client = AsyncServiceClient.from_env('weather_service', 'WEATHER_SERVICE', 'http://localhost:5000')
+DEFAULT_TEMP = 20
+PARALLEL_LOOKUPS = os.getenv('PARALLEL_LOOKUPS', '1') == '1'
+room_locations = {}
+
+db_pool = AsyncConnectionPool.from_env(
+    'booking', host='localhost', database='postgres', user='postgres', password='postgres'
+)
+
+def get_db_connection():
+    return db_pool.connection()
+
+def get_read_connection(key=None):
+    # No replicas here: reads always see the caller's own writes
+    return db_pool.connection()
+
+READ_AFTER_HEADER = 'X-Read-After'
+
+def mark_written(*user_ids):
+    g.wrote_at = time.time()
+
+@app.after_request
+async def send_write_time(response):
+    wrote_at = g.pop('wrote_at', None)
+    if wrote_at is not None:
+        response.headers[READ_AFTER_HEADER] = f"{wrote_at:.3f}"
+    return response
+
+change_notifier = change_feed.AsyncChangeNotifier(db_pool)
+
+# Same table as app.py with IDEMPOTENCY_BACKEND=postgres, so a retry may land
+# on either variant; the store's blocking calls run on a thread
+idempotency_store = IdempotencyStore.from_env(
+    ConnectionPool.from_env('booking-idempotency', host='localhost', database='postgres',
+                            user='postgres', password='postgres'),
+    flights=AsyncSingleFlight()
+)
+
+@app.before_serving
+async def startup():
+    await db_pool.open()
+    room_client.start()
+    weather_client.start()
+
+@app.after_serving
+async def shutdown():
+    await room_client.close()
+    await weather_client.close()
+    await change_notifier.stop()
+    await db_pool.close()
+
+async def lookup_room(room_id):
+    """Return the room's details, or None if it does not exist."""
+    room_response = await room_client.get(f"/rooms/{room_id}")
+    if room_response.status_code != 200:
+        return None
+    return room_response.json()
+
+async def lookup_rooms(room_ids):
+    """Return {room_id: room} for the requested ids with a single lookup."""
+    rooms_response = await room_client.get("/rooms")
+    if rooms_response.status_code != 200:
+        raise ServiceUnavailable(f"room_service returned {rooms_response.status_code}")
+    return contract.rooms_by_id(rooms_response.json(), room_ids)
+
+async def fetch_temperature(location, date_str):
+    """Ask weather_service for the forecast, falling back to DEFAULT_TEMP."""
+    try:
+        weather_response = await weather_client.get(
+            "/weather", params={"location": location, "date": date_str}
+        )
+        if weather_response.status_code == 200:
+            return weather_response.json().get('temperature', DEFAULT_TEMP)
+    except (ServiceUnavailable, ValueError) as e:
+        tracing.log_event('weather_fallback', logging.WARNING, error=str(e), default=DEFAULT_TEMP)
+    return DEFAULT_TEMP
+
+async def fetch_temperatures(pairs):
+    """Forecasts for many (location, date) pairs in one weather_service call."""
+    temps = {pair: DEFAULT_TEMP for pair in pairs}
+    if not pairs:
+        return temps
+    try:
+        weather_response = await weather_client.post(
+            "/weather/batch",
+            json={"items": [{"location": loc, "date": day} for loc, day in pairs]},
+            idempotent=True
+        )
+        if weather_response.status_code == 200:
+            for pair, result in zip(pairs, weather_response.json().get('results', [])):
+                temps[pair] = result.get('temperature', DEFAULT_TEMP)
+    except (ServiceUnavailable, ValueError) as e:
+        tracing.log_event('weather_fallback', logging.WARNING, error=str(e), default=DEFAULT_TEMP)
+    return temps
+
+async def fetch_slot_temperatures(location, days):
+    """Forecast for each [(date, hours)] of a booking, in order."""
+    if len(days) == 1:
+        return [await fetch_temperature(location, days[0][0].isoformat())]
+    pairs = [(location, day.isoformat()) for day, _ in days]
+    temps = await fetch_temperatures(pairs)
+    return [temps[pair] for pair in pairs]
+
+# --- LOGIN ---
+@app.route('/login', methods=['POST', 'OPTIONS'])
+async def login():
+    if request.method == 'OPTIONS':
+        return jsonify({'message': 'CORS OK'}), 200
+
+    data = await request.get_json()
+    email = data.get('email')
+    password = data.get('password')
+
+    if not email or not password:
+        return jsonify({"error": "Email and password required"}), 400
+
+    try:
+        async with get_db_connection() as cur:
+            await cur.execute("SELECT id, name, password_hash FROM users WHERE email = %s", (email,))
+            user = cur.fetchone()
+
+        if user:
+            user_id, name, stored_password = user
+            if password == stored_password:
+                return jsonify({
+                    "message": "Login successful",
+                    "user_id": user_id,
+                    "name": name
+                }), 200
+
+        return jsonify({"error": "Invalid credentials"}), 401
+
+    except Exception as e:
+        tracing.log_event('login_error', logging.ERROR, error=str(e))
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/health', methods=['GET'])
+async def health():
+    return jsonify({
+        "status": "healthy",
+        "service": "Booking Service (async)",
+        "db_pool": db_pool.stats(),
+        "db_replicas": None,
+        "dependencies": {
+            "room_service": room_client.stats(),
+            "weather_service": weather_client.stats()
+        },
+        "room_catalog": None,
+        "auth": token_verifier.stats(),
+        "change_feed": change_notifier.stats(),
+        "idempotency": idempotency_store.stats()
+    }), 200
+
+# --- CREATE A BOOKING ---
+@app.route('/bookings', methods=['POST'])
+@async_web.idempotent(idempotency_store, scope=current_user_id)
+async def create_booking():
+    data = await request.get_json()
+    is_preview = data.get('preview', False)
+    try:
+        user_id, room_id, room_name = contract.booking_request(data, current_user_id())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+
+    try:
+        slot = slots.parse_slot(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    days = slot.days()
+    date_str = days[0][0].isoformat()
+
+    try:
+        # Room and weather concurrently when the location is already known
+        known_location = room_locations.get(str(room_id)) if PARALLEL_LOOKUPS else None
+        weather_task = None
+        if known_location:
+            weather_task = asyncio.ensure_future(fetch_slot_temperatures(known_location, days))
+
+        def drop_weather():
+            if weather_task is not None:
+                weather_task.cancel()
+
+        try:
+            room_data = await lookup_room(room_id)
+        except ServiceUnavailable as e:
+            drop_weather()
+            return jsonify({"error": str(e)}), 503
+        if room_data is None:
+            drop_weather()
+            room_locations.pop(str(room_id), None)
+            return jsonify({"error": "Room not found"}), 404
+
+        location = room_data.get('location', 'Unknown')
+        base_price = contract.room_price(room_data)
+        room_locations[str(room_id)] = location
+
+        if weather_task is not None and known_location == location:
+            temps = await weather_task
+        else:
+            drop_weather()
+            temps = await fetch_slot_temperatures(location, days)
+        current_temp = temps[0]
+
+        with tracing.span('pricing', 'quote'):
+            surcharge, total_price = pricing.quote_slot(
+                base_price, [(hours, temp) for (_, hours), temp in zip(days, temps)]
+            )
+
+        if is_preview:
+            return jsonify(pricing.receipt(
+                room_name, location, current_temp, base_price, surcharge, total_price,
+                message="Price Preview Calculated", date=date_str, status="PREVIEW_ONLY",
+                **slot.to_json()
+            )), 200
+
+        async with get_db_connection() as cur:
+            await cur.execute(
+                contract.INSERT_BOOKING_SQL,
+                (int(user_id), int(room_id), room_name, days[0][0], slot.start, slot.end, total_price)
+            )
+            row = cur.fetchone()
+            await cur.commit()
+        if row is None:
+            return jsonify({"error": contract.ALREADY_BOOKED}), 409
+        mark_written(user_id)
+
+        return jsonify(pricing.receipt(
+            room_name, location, current_temp, base_price, surcharge, total_price,
+            message="Booking confirmed!", id=row[0], **slot.to_json()
+        )), 201
+
+    except (asyncpg.UniqueViolationError, asyncpg.ExclusionViolationError):
+        return jsonify({"error": contract.ALREADY_BOOKED}), 409
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- BATCH BOOKINGS ---
+@app.route('/bookings/batch', methods=['POST'])
+@async_web.idempotent(idempotency_store, scope=current_user_id)
+async def create_booking_batch():
+    data = await request.get_json(silent=True) or {}
+    user_id = data.get('user_id') or current_user_id()
+    room_id = data.get('room_id')
+    room_name = data.get('room_name')
+    all_or_nothing = bool(data.get('all_or_nothing', False))
+    is_preview = data.get('preview', False)
+
+    if not all([user_id, room_id]):
+        return jsonify({"error": "Missing fields"}), 400
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+    try:
+        items = slots.expand_batch(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results, wanted = contract.validate_batch(items, all_or_nothing)
+    if not wanted and all_or_nothing:
+        return jsonify({"results": results}), 409
+
+    try:
+        try:
+            room_data = await lookup_room(room_id)
+        except ServiceUnavailable as e:
+            return jsonify({"error": str(e)}), 503
+        if room_data is None:
+            return jsonify({"error": "Room not found"}), 404
+        location = room_data.get('location', 'Unknown')
+        base_price = contract.room_price(room_data)
+
+        temps = await fetch_temperatures(contract.weather_pairs(location, wanted))
+        with tracing.span('pricing', 'quote_slot'):
+            prices = contract.price_batch(base_price, location, wanted, temps)
+
+        if is_preview:
+            contract.batch_preview(results, wanted, prices)
+            return jsonify({"room": room_name, "location": location, "base_price": base_price,
+                            "status": "PREVIEW_ONLY", "results": results}), \
+                contract.batch_status(results, all_or_nothing, ok=200)
+
+        async with get_db_connection() as cur:
+            await cur.execute(contract.INSERT_BATCH_SQL,
+                              contract.batch_insert_params(int(user_id), int(room_id), room_name, wanted, prices))
+            created = {start: booking_id for booking_id, start in cur.fetchall()}
+            rolled_back = all_or_nothing and len(created) < len(wanted)
+            if rolled_back:
+                await cur.rollback()
+            else:
+                await cur.commit()
+                mark_written(user_id)
+
+        contract.batch_outcome(results, wanted, prices, created, rolled_back)
+        return jsonify({"room": room_name, "location": location, "results": results}), \
+            contract.batch_status(results, all_or_nothing)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- BULK QUOTES ---
+@app.route('/quotes', methods=['POST'])
+async def create_quotes():
+    try:
+        room_ids, start, end, days = contract.quote_request(await request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        try:
+            rooms = await lookup_rooms(room_ids)
+        except ServiceUnavailable as e:
+            return jsonify({"error": str(e)}), 503
+        # Weather and availability side by side
+        temps, calendar = await asyncio.gather(
+            fetch_temperatures(contract.quote_pairs(rooms, days)),
+            availability(list(rooms), start, end)
+        )
+        with tracing.span('pricing', 'price_many'):
+            return jsonify(contract.quotes_json(room_ids, rooms, days, temps, calendar)), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- AVAILABILITY CALENDAR ---
+async def availability(room_ids, start, end):
+    async with get_read_connection(current_user_id()) as cur:
+        await cur.execute(contract.AVAILABILITY_SQL, contract.availability_params(room_ids, start, end))
+        return contract.availability_json(room_ids, start, end, cur.fetchall())
+
+@app.route('/rooms/<int:room_id>/availability', methods=['GET'])
+async def get_room_availability(room_id):
+    try:
+        start, end = contract.parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date range: {e}"}), 400
+    try:
+        rooms = await availability([room_id], start, end)
+        return jsonify({"room_id": room_id, "from": start.isoformat(), "to": end.isoformat(),
+                        **rooms[room_id]}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/rooms/availability', methods=['GET'])
+async def get_rooms_availability():
+    try:
+        room_ids = contract.parse_room_ids(request.args)
+        start, end = contract.parse_date_range(request.args)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    if not room_ids or len(room_ids) > contract.MAX_QUOTE_ROOMS:
+        return jsonify({"error": f"Provide between 1 and {contract.MAX_QUOTE_ROOMS} room_ids"}), 400
+    try:
+        rooms = await availability(room_ids, start, end)
+        return jsonify({
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "rooms": {str(room_id): rooms[room_id] for room_id in room_ids}
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# --- DASHBOARD ---
+async def stream_json_array(rows):
+    """Yield a JSON array one booking at a time, from an async iterable of rows."""
+    yield '['
+    first = True
+    async for row in rows:
+        yield ('' if first else ',') + json.dumps(contract.booking_to_json(row))
+        first = False
+    yield ']'
+
+async def each(rows):
+    for row in rows:
+        yield row
+
+def with_validators(response, etag):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = contract.BOOKINGS_CACHE_CONTROL
+    return response
+
+@app.route('/bookings/user/<int:user_id>', methods=['GET'])
+async def get_user_bookings(user_id):
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+    try:
+        sql, params, limit, when = contract.user_bookings_query(user_id, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        async with get_read_connection(user_id) as cur:
+            version, cursor = await change_feed.list_position_async(cur, user_id)
+            etag = contract.list_etag(user_id, version, when)
+            unchanged = async_web.not_modified(etag, contract.BOOKINGS_CACHE_CONTROL)
+            if unchanged is not None:
+                unchanged.headers['X-Changes-Cursor'] = cursor
+                return unchanged
+            rows = None
+            if limit is not None:
+                # One extra row tells us whether another page exists
+                await cur.execute(sql + " LIMIT %s", params + [limit + 1])
+                rows = cur.fetchall()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    if rows is None:
+        # Whole history from a server-side cursor, on a connection of its own
+        # that the body holds while it streams. It is the primary too, so the
+        # rows are at least as new as the version and cursor above; a change
+        # in between is delivered again by the feed, which is harmless.
+        async def generate():
+            async with get_read_connection(user_id) as stream_cur:
+                async for chunk in stream_json_array(
+                        stream_cur.stream(sql, params, prefetch=contract.STREAM_BATCH)):
+                    yield chunk
+
+        response = Response(generate(), mimetype='application/json')
+    else:
+        response = Response(stream_json_array(each(rows[:limit])), mimetype='application/json')
+        next_cursor = contract.next_page_cursor(rows, limit)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+    response.headers['X-Changes-Cursor'] = cursor
+    return with_validators(response, etag)
+
+# --- CHANGE FEED (see app.py) ---
+CHANGES_POLL_SECONDS = float(os.getenv('CHANGES_POLL_SECONDS', 15))
+# A waiting stream is a coroutine, not a thread, so there is no per-worker
+# cap here; streams still end after the same time as app.py's
+CHANGES_STREAM_SECONDS = float(os.getenv('CHANGES_STREAM_SECONDS', 25))
+
+async def fetch_changes(user_id, since):
+    async with get_db_connection() as cur:
+        rows, cursor = await change_feed.read_changes_async(cur, user_id, since)
+        await change_feed.maybe_purge_async(cur)
+        await cur.commit()
+    return [contract.change_to_json(row) for row in rows], cursor
+
+@app.route('/bookings/changes', methods=['GET'])
+async def get_booking_changes():
+    try:
+        user_id, since = change_feed.parse_request(request.args, request.headers, current_user_id())
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+    try:
+        changes, cursor = await fetch_changes(user_id, since)
+        return jsonify({"changes": changes, "next": cursor}), 200
+    except change_feed.CursorExpired:
+        return jsonify({"error": "Cursor expired; reload the bookings"}), 410
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/bookings/changes/stream', methods=['GET'])
+async def stream_booking_changes():
+    try:
+        user_id, since = change_feed.parse_request(request.args, request.headers, current_user_id())
+    except ValueError as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+    denied = forbidden_unless_self(user_id)
+    if denied:
+        return denied
+
+    async def generate():
+        cursor = since
+        deadline = time.monotonic() + CHANGES_STREAM_SECONDS
+        seen = change_notifier.version(user_id)
+        yield contract.STREAM_RETRY
+        while True:
+            try:
+                changes, next_cursor = await fetch_changes(user_id, cursor)
+            except change_feed.CursorExpired:
+                yield contract.STREAM_EXPIRED
+                return
+            if changes or cursor is None:
+                yield contract.change_event(changes, next_cursor)
+            else:
+                yield contract.STREAM_KEEP_ALIVE
+            cursor = change_feed.parse_cursor(next_cursor)
+            if time.monotonic() >= deadline:
+                return
+            seen = await change_notifier.wait(user_id, seen, min(CHANGES_POLL_SECONDS, deadline - time.monotonic()))
+
+    response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # The stream ends itself after CHANGES_STREAM_SECONDS, not Quart's RESPONSE_TIMEOUT
+    response.timeout = None
+    return response
+
+# --- DELETE BOOKING (ownership rules in contract.py) ---
+async def delete_owner():
+    """(user_id the delete is limited to or None, 403 response or None)."""
+    owner, stated = contract.delete_owner(await request.get_json(silent=True) or {}, request.args,
+                                          current_user_id())
+    if stated is not None:
+        denied = forbidden_unless_self(stated)
+        if denied:
+            return None, denied
+    return (int(owner) if owner is not None else None), None
+
+@app.route('/bookings/<int:booking_id>', methods=['DELETE'])
+async def delete_booking(booking_id):
+    try:
+        owner, denied = await delete_owner()
+        if denied:
+            return denied
+        async with get_db_connection() as cur:
+            await cur.execute(*contract.delete_sql(owner, booking_id))
+            deleted = cur.fetchone()
+            await cur.commit()
+
+        if not deleted:
+            return jsonify({"error": "Booking not found"}), 404
+        mark_written(deleted[0])
+
+        return jsonify({"message": "Booking deleted successfully"}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/bookings/batch', methods=['DELETE'])
+async def delete_booking_batch():
+    try:
+        booking_ids, all_or_nothing = contract.batch_delete_request(await request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        owner, denied = await delete_owner()
+        if denied:
+            return denied
+        async with get_db_connection() as cur:
+            await cur.execute(*contract.batch_delete_sql(owner, booking_ids))
+            owners = dict(cur.fetchall())
+            deleted = set(owners)
+            if all_or_nothing and len(deleted) < len(booking_ids):
+                await cur.rollback()
+                return jsonify({"results": contract.batch_delete_results(booking_ids, deleted, rolled_back=True)}), 409
+            await cur.commit()
+            if owners:
+                mark_written(*set(owners.values()))
+
+        results = contract.batch_delete_results(booking_ids, deleted)
+        return jsonify({"results": results}), 200 if len(deleted) == len(booking_ids) else 207
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5004)))
@@ -0,0 +1,292 @@
+# --- CHANGE FEED: what changed in a user's bookings since a cursor ---
+# A trigger on bookings appends every insert and delete to booking_changes and
+# sends NOTIFY booking_changes (see init_db.py). Clients load their bookings
+# once, then apply these deltas instead of refetching the whole list.
+#
+# Cursors look like "<tx>-<id>". Changes are read in (tx, id) order, and only
+# from transactions older than every transaction still running
+# (pg_snapshot_xmin): a change can then never commit "behind" a cursor that
+# was already handed out. The price is that one long-running transaction
+# holds the feed back until it finishes.
+#
+# The *_async functions and AsyncChangeNotifier do the same for async_app.py,
+# over common/async_db.py cursors and the same SQL.
+import asyncio
+import logging
+import os
+import random
+import select
+import threading
+import time
+
+import psycopg2
+
+from common import tracing
+
+PAGE_SIZE = int(os.getenv('CHANGES_PAGE_SIZE', 500))
+RETENTION_DAYS = int(os.getenv('CHANGES_RETENTION_DAYS', 7))
+CHANNEL = 'booking_changes'
+
+CHANGE_COLUMNS = ("tx, id, op, booking_id, room_name, date, total_price, created_at, "
+                  "lower(slot), upper(slot)")
+
+
+class CursorExpired(Exception):
+    """Changes after this cursor have been purged; the client must reload."""
+
+
+HORIZON_SQL = ("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint, "
+               "(SELECT tx FROM booking_changes_purged)")
+CHANGES_SQL = (f"SELECT {CHANGE_COLUMNS} FROM booking_changes "
+               "WHERE user_id = %s AND (tx, id) > (%s, %s) AND tx < %s "
+               "ORDER BY tx, id LIMIT %s")
+POSITION_SQL = ("SELECT count(*), max(id), (SELECT tx FROM booking_changes_purged), "
+                "pg_snapshot_xmin(pg_current_snapshot())::text::bigint "
+                "FROM booking_changes WHERE user_id = %s")
+PURGE_SQL = """
+    WITH gone AS (
+        DELETE FROM booking_changes
+        WHERE changed_at < now() - make_interval(days => %s)
+        RETURNING tx
+    )
+    INSERT INTO booking_changes_purged (id, tx)
+    SELECT 1, max(tx) + 1 FROM gone HAVING count(*) > 0
+    ON CONFLICT (id) DO UPDATE SET tx = GREATEST(booking_changes_purged.tx, EXCLUDED.tx);
+"""
+
+
+def parse_cursor(value):
+    tx, change_id = str(value).split('-')
+    return int(tx), int(change_id)
+
+
+def parse_request(args, headers, caller):
+    """(user_id, since) of a change-feed request, or raise ValueError."""
+    user_id = int(args.get('user_id') or caller or 0)
+    if not user_id:
+        raise ValueError("user_id is required")
+    # EventSource reconnects to the URL it was opened with, so ?since is
+    # where the client started and Last-Event-ID how far it got since
+    since = headers.get('Last-Event-ID') or args.get('since')
+    return user_id, parse_cursor(since) if since else None
+
+
+def _check_since(since, horizon, purged):
+    if since is not None and purged is not None and since[0] < purged:
+        raise CursorExpired(since)
+
+
+def _next_cursor(rows, since, horizon, limit):
+    if len(rows) == limit:
+        return f"{rows[-1][0]}-{rows[-1][1]}"
+    return f"{max(horizon, since[0])}-0"
+
+
+def read_changes(cur, user_id, since=None, limit=PAGE_SIZE):
+    """Return (rows, next_cursor). Without ``since`` only the current cursor."""
+    cur.execute(HORIZON_SQL)
+    horizon, purged = cur.fetchone()
+    if since is None:
+        return [], f"{horizon}-0"
+    _check_since(since, horizon, purged)
+
+    cur.execute(CHANGES_SQL, (user_id, since[0], since[1], horizon, limit))
+    rows = cur.fetchall()
+    return rows, _next_cursor(rows, since, horizon, limit)
+
+
+async def read_changes_async(cur, user_id, since=None, limit=PAGE_SIZE):
+    await cur.execute(HORIZON_SQL)
+    horizon, purged = cur.fetchone()
+    if since is None:
+        return [], f"{horizon}-0"
+    _check_since(since, horizon, purged)
+
+    await cur.execute(CHANGES_SQL, (user_id, since[0], since[1], horizon, limit))
+    rows = cur.fetchall()
+    return rows, _next_cursor(rows, since, horizon, limit)
+
+
+def list_position(cur, user_id):
+    """(version, cursor) for a list of ``user_id``'s bookings read next on ``cur``.
+
+    The version is a string that changes whenever the user's bookings do, for
+    ETags. Rows are only ever appended, so the count moves with every committed
+    change, even one from a transaction that started before the newest row;
+    the purge horizon covers rows disappearing. The cursor is where to follow
+    the feed from: every transaction before it has finished, so a list read
+    afterwards on the same connection already holds its changes.
+    """
+    cur.execute(POSITION_SQL, (user_id,))
+    return _position(*cur.fetchone())
+
+
+async def list_position_async(cur, user_id):
+    await cur.execute(POSITION_SQL, (user_id,))
+    return _position(*cur.fetchone())
+
+
+def _position(count, last_id, purged, horizon):
+    return f"{count}.{last_id or 0}.{purged or 0}", f"{horizon}-0"
+
+
+def maybe_purge(cur, probability=0.01):
+    """Now and then drop changes older than RETENTION_DAYS, remembering how far."""
+    if random.random() < probability:
+        cur.execute(PURGE_SQL, (RETENTION_DAYS,))
+
+
+async def maybe_purge_async(cur, probability=0.01):
+    if random.random() < probability:
+        await cur.execute(PURGE_SQL, (RETENTION_DAYS,))
+
+
+class ChangeNotifier:
+    """One LISTEN connection per process that wakes the SSE streams of a user.
+
+    Streams wait on ``wait()`` instead of polling the table; the listener
+    thread is started by the first stream and restarted after a fork.
+    """
+
+    def __init__(self, dsn, channel=CHANNEL, reconnect_delay=1.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self.reset()
+
+    def reset(self):
+        self._cond = threading.Condition()
+        self._versions = {}
+        self._thread = None
+        self.notifications = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='change-listener', daemon=True)
+                self._thread.start()
+
+    def version(self, user_id):
+        with self._cond:
+            return self._versions.get(str(user_id), 0)
+
+    def wait(self, user_id, seen, timeout):
+        """Block until ``user_id`` has news after version ``seen`` (or timeout)."""
+        self.start()
+        key = str(user_id)
+        with self._cond:
+            self._cond.wait_for(lambda: self._versions.get(key, 0) != seen, timeout)
+            return self._versions.get(key, 0)
+
+    def _publish(self, user_ids):
+        with self._cond:
+            for key in user_ids:
+                self._versions[key] = self._versions.get(key, 0) + 1
+            self.notifications += len(user_ids)
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**self.dsn)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel};")
+                while True:
+                    if select.select([conn], [], [], 5.0)[0]:
+                        conn.poll()
+                        if conn.notifies:
+                            self._publish({n.payload for n in conn.notifies})
+                            conn.notifies.clear()
+            except Exception as e:
+                tracing.log_event('change_listener_error', logging.WARNING, error=str(e))
+                time.sleep(self.reconnect_delay)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self):
+        return {
+            "listening": self._thread is not None and self._thread.is_alive(),
+            "notifications": self.notifications,
+        }
+
+
+class AsyncChangeNotifier:
+    """``ChangeNotifier`` for async_app.py: the LISTEN connection is a task on
+    the event loop, opened with ``pool.connect()`` by the first stream."""
+
+    def __init__(self, pool, channel=CHANNEL, reconnect_delay=1.0):
+        self.pool = pool
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        self._versions = {}
+        self._waiters = {}         # user id -> {future}
+        self._task = None
+        self.notifications = 0
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def version(self, user_id):
+        return self._versions.get(str(user_id), 0)
+
+    async def wait(self, user_id, seen, timeout):
+        """Wait until ``user_id`` has news after version ``seen`` (or timeout)."""
+        self.start()
+        key = str(user_id)
+        if self._versions.get(key, 0) == seen and timeout > 0:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.setdefault(key, set()).add(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                waiters = self._waiters.get(key)
+                if waiters is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[key]
+        return self._versions.get(key, 0)
+
+    def _publish(self, user_ids):
+        for key in user_ids:
+            self._versions[key] = self._versions.get(key, 0) + 1
+            for waiter in self._waiters.get(key, ()):
+                if not waiter.done():
+                    waiter.set_result(None)
+        self.notifications += len(user_ids)
+
+    async def _run(self):
+        while True:
+            conn = None
+            try:
+                conn = await self.pool.connect()
+                closed = asyncio.get_running_loop().create_future()
+                conn.add_termination_listener(lambda _: closed.done() or closed.set_result(None))
+                await conn.add_listener(self.channel, lambda _conn, _pid, _channel, payload: self._publish({payload}))
+                await closed
+                tracing.log_event('change_listener_error', logging.WARNING, error='connection closed')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                tracing.log_event('change_listener_error', logging.WARNING, error=str(e))
+            finally:
+                if conn is not None and not conn.is_closed():
+                    conn.terminate()
+            await asyncio.sleep(self.reconnect_delay)
+
+    def stats(self):
+        return {
+            "listening": self._task is not None and not self._task.done(),
+            "notifications": self.notifications,
+        }
@@ -0,0 +1,409 @@
+# --- CONTRACT: what app.py and async_app.py both promise their clients ---
+# Request parsing, SQL and JSON shapes of the booking endpoints. The two
+# variants only differ in how they wait on Postgres and the other services
+# (threads vs. asyncio), so everything a client can observe is decided here
+# and an A/B comparison measures the runtime, not two drifting copies.
+# SQL uses psycopg2's %s placeholders; common/async_db.py renumbers them.
+import json
+import os
+from datetime import date, datetime, timedelta
+
+import pricing
+import slots
+
+# --- BOOKINGS ---
+INSERT_BOOKING_SQL = """
+    INSERT INTO bookings (user_id, room_id, room_name, date, slot, total_price)
+    VALUES (%s, %s, %s, %s, tstzrange(%s, %s), %s)
+    ON CONFLICT DO NOTHING
+    RETURNING id;
+"""
+ALREADY_BOOKED = "Room already booked for this time"
+
+
+def booking_request(data, caller):
+    """(user_id, room_id, room_name) of a POST /bookings body, or raise ValueError.
+
+    Whole days: {"date": ..., "end_date": ...}; hours: {"start": ..., "end": ...}.
+    An authenticated caller books for themselves when no user_id is given.
+    """
+    user_id = data.get('user_id') or caller
+    room_id = data.get('room_id')
+    if not all([user_id, room_id, data.get('date') or data.get('start')]):
+        raise ValueError("Missing fields")
+    return user_id, room_id, data.get('room_name')
+
+
+def room_price(room):
+    return room.get('price_per_hour') or room.get('base_price', 0)
+
+
+# --- BATCH BOOKINGS ---
+# {"room_id": 1, "room_name": "...", "date": "2030-01-07",
+#  "recurrence": "FREQ=WEEKLY;BYDAY=TU;COUNT=13", "start_time": "09:00", "end_time": "10:00"}
+# or {"room_id": 1, "dates": ["2030-01-07", ...]}; optional "all_or_nothing", "preview"
+NOT_ATTEMPTED = "Not booked: another date in the batch failed"
+
+INSERT_BATCH_SQL = """
+    INSERT INTO bookings (user_id, room_id, room_name, date, slot, total_price)
+    SELECT %s, %s, %s, day, tstzrange(slot_start, slot_end), price
+    FROM unnest(%s::date[], %s::timestamptz[], %s::timestamptz[], %s::numeric[])
+        AS t(day, slot_start, slot_end, price)
+    ON CONFLICT DO NOTHING
+    RETURNING id, lower(slot);
+"""
+
+
+def batch_result(index, status, slot=None, **fields):
+    result = {"index": index, "status": status}
+    if slot is not None:
+        result.update(date=slot.start.date().isoformat(), **slot.to_json())
+    result.update(fields)
+    return result
+
+
+def batch_status(results, all_or_nothing, ok=201):
+    if all(r['status'] == ok for r in results):
+        return ok
+    return 409 if all_or_nothing else 207
+
+
+def validate_batch(items, all_or_nothing):
+    """(results, wanted): per-item results so far and the [(index, slot)] to price.
+
+    A repeated start is a conflict within the batch. With ``all_or_nothing``
+    any invalid item marks the rest not attempted and ``wanted`` is empty.
+    """
+    results = [None] * len(items)
+    wanted, starts = [], set()
+    for index, item in enumerate(items):
+        try:
+            slot = slots.parse_slot(item)
+        except ValueError as e:
+            results[index] = batch_result(index, 400, error=str(e), **item)
+            continue
+        if slot.start in starts:
+            results[index] = batch_result(index, 409, slot, error="Repeated in this batch")
+            continue
+        starts.add(slot.start)
+        wanted.append((index, slot))
+    if all_or_nothing and len(wanted) < len(items):
+        for index, slot in wanted:
+            results[index] = batch_result(index, 424, slot, error=NOT_ATTEMPTED)
+        return results, []
+    return results, wanted
+
+
+def weather_pairs(location, wanted):
+    """Distinct (location, date) forecasts a batch needs."""
+    return list(dict.fromkeys(
+        (location, day.isoformat()) for _, slot in wanted for day, _ in slot.days()
+    ))
+
+
+def price_batch(base_price, location, wanted, temps):
+    return [
+        pricing.quote_slot(base_price, [(hours, temps[(location, day.isoformat())])
+                                        for day, hours in slot.days()])
+        for _, slot in wanted
+    ]
+
+
+def batch_preview(results, wanted, prices):
+    for (index, slot), (surcharge, total_price) in zip(wanted, prices):
+        results[index] = batch_result(index, 200, slot, surcharge=float(surcharge),
+                                      total_price=float(total_price))
+    return results
+
+
+def batch_insert_params(user_id, room_id, room_name, wanted, prices):
+    return (user_id, room_id, room_name,
+            [slot.start.date() for _, slot in wanted],
+            [slot.start for _, slot in wanted],
+            [slot.end for _, slot in wanted],
+            [total_price for _, total_price in prices])
+
+
+def batch_outcome(results, wanted, prices, created, rolled_back):
+    """Fill in the results of an insert; ``created`` is {slot start: booking id}."""
+    for (index, slot), (surcharge, total_price) in zip(wanted, prices):
+        if slot.start not in created:
+            results[index] = batch_result(index, 409, slot, error=ALREADY_BOOKED)
+        elif rolled_back:
+            results[index] = batch_result(index, 424, slot, error=NOT_ATTEMPTED)
+        else:
+            results[index] = batch_result(index, 201, slot, id=created[slot.start],
+                                          surcharge=float(surcharge), total_price=float(total_price))
+    return results
+
+
+# --- BULK QUOTES ---
+MAX_QUOTE_DAYS = int(os.getenv('MAX_QUOTE_DAYS', 62))
+MAX_QUOTE_ROOMS = int(os.getenv('MAX_QUOTE_ROOMS', 50))
+
+
+def quote_request(data):
+    """(room_ids, start, end, days) of a POST /quotes body, or raise ValueError."""
+    room_ids = data.get('room_ids')
+    from_str = data.get('from')
+    to_str = data.get('to')
+
+    if not room_ids or not from_str or not to_str:
+        raise ValueError("room_ids, from and to are required")
+    try:
+        room_ids = list(dict.fromkeys(int(r) for r in room_ids))
+        start = datetime.strptime(from_str, '%Y-%m-%d').date()
+        end = datetime.strptime(to_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError("room_ids must be integers and dates YYYY-MM-DD")
+
+    if start < date.today():
+        raise ValueError(f"Cannot quote in the past. Today is {date.today()}")
+    if end < start:
+        raise ValueError("'to' must not be before 'from'")
+    if (end - start).days + 1 > MAX_QUOTE_DAYS or len(room_ids) > MAX_QUOTE_ROOMS:
+        raise ValueError(f"At most {MAX_QUOTE_ROOMS} rooms and {MAX_QUOTE_DAYS} days per request")
+
+    days = [(start + timedelta(days=i)).isoformat() for i in range((end - start).days + 1)]
+    return room_ids, start, end, days
+
+
+def rooms_by_id(rooms, room_ids):
+    wanted = set(room_ids)
+    return {room['id']: room for room in rooms if room['id'] in wanted}
+
+
+def quote_pairs(rooms, days):
+    return list(dict.fromkeys(
+        (room['location'], day) for room in rooms.values() for day in days
+    ))
+
+
+def quotes_json(room_ids, rooms, days, temps, calendar):
+    """Price the whole rooms x days matrix in one pass."""
+    cells = [(room, day) for room in rooms.values() for day in days]
+    base_prices = [room.get('price_per_hour', 0) for room, _ in cells]
+    cell_temps = [temps[(room['location'], day)] for room, day in cells]
+    # Exact cents for a whole day; c / 100 is the same float as
+    # float(Decimal) would give
+    surcharges, totals = pricing.engine.price_many_cents(
+        [pricing.engine.billed_cents(pricing.to_cents(base), pricing.HOURS_PER_DAY) for base in base_prices],
+        cell_temps
+    )
+
+    results = {room_id: [] for room_id in rooms}
+    for (room, day), temp, base, surcharge, total in zip(
+            cells, cell_temps, base_prices, surcharges, totals):
+        day_index = len(results[room['id']])
+        results[room['id']].append({
+            "date": day,
+            "weather_temp": temp,
+            "base_price": base,
+            "surcharge": surcharge / 100,
+            "total_price": total / 100,
+            "available": calendar[room['id']]['bitmap'][day_index] == '1'
+        })
+
+    return {
+        "from": days[0],
+        "to": days[-1],
+        "rooms": [{
+            "room_id": room_id,
+            "name": rooms[room_id]['name'],
+            "location": rooms[room_id]['location'],
+            "quotes": results[room_id]
+        } for room_id in room_ids if room_id in rooms],
+        "not_found": [room_id for room_id in room_ids if room_id not in rooms]
+    }
+
+
+# --- AVAILABILITY CALENDAR ---
+MAX_AVAILABILITY_DAYS = int(os.getenv('MAX_AVAILABILITY_DAYS', 366))
+
+# Bookings per room overlapping a window, one GiST index probe per room
+AVAILABILITY_SQL = (
+    "SELECT r.id, lower(b.slot), upper(b.slot) FROM unnest(%s::int[]) AS r(id) "
+    f"JOIN bookings b ON {slots.ROOM_KEY.format(column='b.room_id')} = "
+    f"{slots.ROOM_KEY.format(column='r.id')} AND b.slot && tstzrange(%s, %s)"
+)
+
+
+def parse_date_range(args):
+    """Read ?from=&to= (defaults: today .. today + 30 days), inclusive."""
+    start = datetime.strptime(args.get('from', date.today().isoformat()), '%Y-%m-%d').date()
+    end = datetime.strptime(
+        args.get('to', (start + timedelta(days=30)).isoformat()), '%Y-%m-%d'
+    ).date()
+    if end < start:
+        raise ValueError("'to' must not be before 'from'")
+    if (end - start).days + 1 > MAX_AVAILABILITY_DAYS:
+        raise ValueError(f"At most {MAX_AVAILABILITY_DAYS} days per request")
+    return start, end
+
+
+def parse_room_ids(args):
+    """?room_ids=1,2,3 as a list of distinct ints, or raise ValueError."""
+    return list(dict.fromkeys(
+        int(r) for r in args.get('room_ids', '').split(',') if r.strip()
+    ))
+
+
+def availability_params(room_ids, start, end):
+    window = slots.Slot.for_days(start, end)
+    return room_ids, window.start, window.end
+
+
+def availability_json(room_ids, start, end, rows):
+    """{room_id: calendar} from the (room_id, slot start, slot end) rows of AVAILABILITY_SQL."""
+    booked = {room_id: set() for room_id in room_ids}
+    taken = {room_id: [] for room_id in room_ids}
+    for room_id, slot_start, slot_end in rows:
+        slot = slots.Slot(slot_start, slot_end)
+        booked[room_id].update(day for day, _ in slot.days() if start <= day <= end)
+        taken[room_id].append(slot)
+
+    days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+    result = {}
+    for room_id in room_ids:
+        result[room_id] = {
+            # One character per day from `from`: 1 = free, 0 = (partly) booked
+            "bitmap": ''.join('0' if day in booked[room_id] else '1' for day in days),
+            "booked": sorted(day.isoformat() for day in booked[room_id]),
+            "slots": [slot.to_json() for slot in sorted(taken[room_id])],
+        }
+    return result
+
+
+# --- DASHBOARD LIST ---
+# Newest first, keyset-paginated on (date, id) so every page is an index
+# range scan on bookings (user_id, date DESC, id DESC), however deep it is.
+MAX_PAGE_SIZE = 500
+STREAM_BATCH = 500
+# Browsers keep the list but ask every time; unchanged lists are an empty 304
+BOOKINGS_CACHE_CONTROL = 'private, no-cache'
+BOOKING_COLUMNS = "id, room_name, date, total_price, created_at, lower(slot), upper(slot)"
+
+
+def booking_to_json(row):
+    return {
+        "id": row[0],
+        "room_name": row[1],
+        "date": str(row[2]),
+        "total_price": float(row[3]),
+        "created_at": str(row[4]) if row[4] is not None else "",
+        **slots.Slot(row[5], row[6]).to_json()
+    }
+
+
+def user_bookings_query(user_id, args):
+    """(sql, params, limit, when) for GET /bookings/user/<id>, or raise ValueError.
+
+    ?limit=50            page size (None: stream every booking)
+    ?after=2025-03-01,42 continue after this (date, id), from X-Next-Cursor
+    ?when=upcoming|past  only bookings from today on / before today
+    """
+    conditions, params = ["user_id = %s"], [user_id]
+    try:
+        after = args.get('after')
+        if after:
+            after_date, after_id = after.split(',')
+            conditions.append("(date, id) < (%s, %s)")
+            params += [datetime.strptime(after_date, '%Y-%m-%d').date(), int(after_id)]
+
+        limit = args.get('limit')
+        if limit is not None:
+            limit = int(limit)
+            if not 1 <= limit <= MAX_PAGE_SIZE:
+                raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    except ValueError as e:
+        raise ValueError(f"Invalid pagination parameters: {e}")
+
+    when = args.get('when')
+    if when == 'upcoming':
+        conditions.append("date >= CURRENT_DATE")
+    elif when == 'past':
+        conditions.append("date < CURRENT_DATE")
+    elif when is not None:
+        raise ValueError("when must be 'upcoming' or 'past'")
+
+    sql = (f"SELECT {BOOKING_COLUMNS} FROM bookings WHERE {' AND '.join(conditions)} "
+           "ORDER BY date DESC, id DESC")
+    return sql, params, limit, when
+
+
+def list_etag(user_id, version, when):
+    """The user's change-log position is the list's version; `when` filters
+    also move with the calendar."""
+    day = f"-{date.today()}" if when else ""
+    return f"bookings-{user_id}-{version}{day}"
+
+
+def next_page_cursor(rows, limit):
+    """X-Next-Cursor for a page fetched with one extra row, or None on the last page."""
+    if len(rows) <= limit:
+        return None
+    last = rows[limit - 1]
+    return f"{last[2]},{last[0]}"
+
+
+# --- CHANGE FEED ---
+def change_to_json(row):
+    change = {"op": "insert" if row[2] == 'I' else "delete", "id": row[3]}
+    if row[2] == 'I':
+        change["booking"] = booking_to_json(row[3:])
+    return change
+
+
+def change_event(changes, cursor):
+    """One Server-Sent Event carrying a page of changes."""
+    return f"id: {cursor}\nevent: changes\ndata: {json.dumps({'changes': changes, 'next': cursor})}\n\n"
+
+
+STREAM_RETRY = "retry: 2000\n\n"
+STREAM_EXPIRED = "event: expired\ndata: {}\n\n"
+STREAM_KEEP_ALIVE = ": keep-alive\n\n"
+STREAMS_FULL = "Too many open change streams; poll /bookings/changes instead"
+
+
+# --- DELETES ---
+# An authenticated caller can only delete their own bookings, and a "user_id"
+# (body or query string) naming someone else is a 403. Without a token (only
+# possible while JWT_REQUIRED=0) deletes are unowned: a stated user_id limits
+# them to that user's bookings, but nothing proves the caller is that user,
+# and with no user_id any booking id can be deleted.
+def delete_owner(data, args, caller):
+    """(user_id the delete is limited to or None, stated user_id to check or None)."""
+    stated = data.get('user_id') or args.get('user_id')
+    return (caller if caller is not None else stated), stated
+
+
+def delete_sql(owner, booking_id):
+    # RETURNING tells us whether it existed in the same round trip
+    if owner is None:
+        return "DELETE FROM bookings WHERE id = %s RETURNING user_id", (booking_id,)
+    return "DELETE FROM bookings WHERE id = %s AND user_id = %s RETURNING user_id", (booking_id, owner)
+
+
+def batch_delete_request(data):
+    """(booking_ids, all_or_nothing) of {"ids": [1, 2, 3], "all_or_nothing": false}, or raise ValueError."""
+    try:
+        booking_ids = list(dict.fromkeys(int(i) for i in data.get('ids') or []))
+    except (TypeError, ValueError):
+        raise ValueError("ids must be a list of integers")
+    if not 1 <= len(booking_ids) <= slots.MAX_BATCH_BOOKINGS:
+        raise ValueError(f"Provide between 1 and {slots.MAX_BATCH_BOOKINGS} ids")
+    return booking_ids, bool(data.get('all_or_nothing', False))
+
+
+def batch_delete_sql(owner, booking_ids):
+    # Same ownership rule as the single delete, in one statement
+    if owner is None:
+        return "DELETE FROM bookings WHERE id = ANY(%s) RETURNING id, user_id", (booking_ids,)
+    return ("DELETE FROM bookings WHERE id = ANY(%s) AND user_id = %s RETURNING id, user_id",
+            (booking_ids, owner))
+
+
+def batch_delete_results(booking_ids, deleted, rolled_back=False):
+    if rolled_back:
+        return [{"id": i, "status": 404 if i not in deleted else 424} for i in booking_ids]
+    return [{"id": i, "status": 200 if i in deleted else 404} for i in booking_ids]
@@ -15,20 +15,139 @@ def init_db():
         cur = conn.cursor()
 
         # Create the Bookings Table
-        # The 'UNIQUE' constraint prevents double-booking the same room on the same date
+        # `slot` is the time the room is held for (whole days or hours, see
+        # slots.py) and `date` its first day. The exclusion constraint below
+        # prevents double-booking overlapping slots of the same room.
         cur.execute("""
         CREATE TABLE IF NOT EXISTS bookings (
             id SERIAL PRIMARY KEY,
             user_id INTEGER NOT NULL,
             room_id INTEGER NOT NULL,
             room_name VARCHAR(100),
-            date VARCHAR(20) NOT NULL,
+            date DATE NOT NULL,
+            slot TSTZRANGE NOT NULL,
             total_price DECIMAL(10, 2) NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(room_id, date)
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
         """)
-        
+
+        # Migration: older databases stored the date as VARCHAR(20).
+        # A real DATE keeps the dashboard's (date, id) keyset pages a range
+        # scan of bookings_user_date_idx; availability and quotes go through
+        # the slot's GiST index below.
+        cur.execute("""
+            SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'bookings' AND column_name = 'date';
+        """)
+        if cur.fetchone()[0] != 'date':
+            print("Migrating bookings.date from VARCHAR to DATE...")
+            cur.execute("ALTER TABLE bookings ALTER COLUMN date TYPE DATE USING date::date;")
+
+        # Migration: bookings used to be whole single days, unique on (room_id, date)
+        cur.execute("ALTER TABLE bookings ADD COLUMN IF NOT EXISTS slot TSTZRANGE;")
+        cur.execute("""
+            UPDATE bookings
+            SET slot = tstzrange(date::timestamp AT TIME ZONE 'UTC', (date + 1)::timestamp AT TIME ZONE 'UTC')
+            WHERE slot IS NULL;
+        """)
+        cur.execute("ALTER TABLE bookings ALTER COLUMN slot SET NOT NULL;")
+
+        # No two bookings of a room may overlap. The GiST index behind this
+        # answers "does anything overlap?" in O(log n), for the insert and
+        # for availability queries. The room is wrapped in a one-element
+        # range so the built-in range_ops can index it (no btree_gist needed).
+        cur.execute("SELECT 1 FROM pg_constraint WHERE conname = 'bookings_no_overlap';")
+        if cur.fetchone() is None:
+            print("Adding the bookings_no_overlap exclusion constraint...")
+            cur.execute("""
+                ALTER TABLE bookings ADD CONSTRAINT bookings_no_overlap
+                EXCLUDE USING gist (int4range(room_id, room_id, '[]') WITH =, slot WITH &&);
+            """)
+        cur.execute("ALTER TABLE bookings DROP CONSTRAINT IF EXISTS bookings_room_id_date_key;")
+
+        # Dashboard: a user's bookings newest first, keyset-paginated on (date, id)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS bookings_user_date_idx
+            ON bookings (user_id, date DESC, id DESC);
+        """)
+
+        # Change feed (see change_feed.py): every insert and delete on bookings
+        # is appended here by a trigger, tagged with its transaction id, and
+        # announced with NOTIFY booking_changes '<user_id>'.
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS booking_changes (
+            id BIGSERIAL PRIMARY KEY,
+            tx BIGINT NOT NULL DEFAULT pg_current_xact_id()::text::bigint,
+            op CHAR(1) NOT NULL,
+            booking_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            room_id INTEGER NOT NULL,
+            room_name VARCHAR(100),
+            date DATE,
+            slot TSTZRANGE,
+            total_price DECIMAL(10, 2),
+            created_at TIMESTAMP,
+            changed_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS booking_changes_user_tx_idx
+            ON booking_changes (user_id, tx, id);
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS booking_changes_changed_at_idx
+            ON booking_changes (changed_at);
+        """)
+        # How far old changes have been purged; older cursors must reload
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS booking_changes_purged (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            tx BIGINT NOT NULL
+        );
+        """)
+        cur.execute("""
+        CREATE OR REPLACE FUNCTION log_booking_change() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO booking_changes
+                    (op, booking_id, user_id, room_id, room_name, date, slot, total_price, created_at)
+                VALUES ('I', NEW.id, NEW.user_id, NEW.room_id, NEW.room_name, NEW.date,
+                        NEW.slot, NEW.total_price, NEW.created_at);
+                PERFORM pg_notify('booking_changes', NEW.user_id::text);
+            ELSE
+                INSERT INTO booking_changes (op, booking_id, user_id, room_id)
+                VALUES ('D', OLD.id, OLD.user_id, OLD.room_id);
+                PERFORM pg_notify('booking_changes', OLD.user_id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS bookings_change_log ON bookings;")
+        cur.execute("""
+            CREATE TRIGGER bookings_change_log
+            AFTER INSERT OR DELETE ON bookings
+            FOR EACH ROW EXECUTE FUNCTION log_booking_change();
+        """)
+
+        # Stored responses for retried POST /bookings (IDEMPOTENCY_BACKEND=postgres).
+        # status_code stays NULL while the first request is still running.
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            key VARCHAR(400) PRIMARY KEY,
+            fingerprint CHAR(64) NOT NULL,
+            status_code INTEGER,
+            body BYTEA,
+            content_type VARCHAR(100),
+            created_at TIMESTAMPTZ DEFAULT now(),
+            expires_at TIMESTAMPTZ NOT NULL
+        );
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idempotency_keys_expires_idx
+            ON idempotency_keys (expires_at);
+        """)
+
         conn.commit()
         cur.close()
         conn.close()
@@ -0,0 +1,217 @@
+# --- PRICING: weather-based surcharge ---
+# Rooms cost more the further the forecast is from a comfortable 21°C.
+#
+# Money is handled in whole cents (integers) and handed out as Decimal with two
+# places, so prices match the DECIMAL(10,2) total_price column exactly.
+# Surcharges are rounded half up to the cent.
+#
+# The tier table can be replaced without code changes: set PRICING_CONFIG to a
+# JSON file (or inline JSON) such as
+#   {"target_temp": 21, "tiers": [[2, 0], [5, 0.1], [10, 0.2], [20, 0.3]], "max_rate": 0.5,
+#    "day_rate_hours": 8}
+# It is read once, when the module is imported.
+#
+# A whole day costs the room's price_per_hour, as it always has (it is the
+# rate a single-day booking and the per-day prices of POST /quotes were ever
+# charged). Part of a day is billed pro rata over a day_rate_hours (default 8)
+# working day: 3 hours are 3/8 of the day's price, 8 hours or more the whole
+# of it. Setting day_rate_hours to 1 bills any booked hour as a full day.
+import json
+import os
+from bisect import bisect_right
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+try:
+    import numpy as np
+except ImportError:  # optional: price_many falls back to plain Python
+    np = None
+
+TARGET_TEMP = 21
+
+# (temperature difference below which the rate applies, surcharge rate)
+SURCHARGE_TIERS = [
+    (2, 0.0),
+    (5, 0.10),
+    (10, 0.20),
+    (20, 0.30),
+]
+MAX_SURCHARGE = 0.50
+DAY_RATE_HOURS = 8
+HOURS_PER_DAY = 24
+
+# Whole-degree forecasts (what weather_service returns) in this range are
+# looked up in a precomputed table; anything else goes through bisect
+TABLE_RANGE = range(-100, 101)
+
+# Below this many cells the NumPy call overhead costs more than it saves
+VECTORIZE_MIN = 64
+
+
+@lru_cache(maxsize=4096)
+def to_cents(amount):
+    """Exact number of cents in a price given as int, float, str or Decimal."""
+    if isinstance(amount, float):
+        # repr() is the shortest string that round-trips, e.g. 0.1 -> '0.1'
+        amount = repr(amount)
+    return int((Decimal(amount) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    return Decimal(int(cents)).scaleb(-2)
+
+
+def _basis_points(rate):
+    bp = Decimal(str(rate)) * 10000
+    if bp != bp.to_integral_value() or bp < 0:
+        raise ValueError(f"Surcharge rate {rate} must be a non-negative multiple of 0.0001")
+    return int(bp)
+
+
+class PricingEngine:
+    """Surcharge tiers compiled into lookup tables.
+
+    Rates are kept in basis points, so a surcharge in cents is one integer
+    multiply and divide, rounded half up.
+    """
+
+    def __init__(self, target_temp=TARGET_TEMP, tiers=SURCHARGE_TIERS, max_rate=MAX_SURCHARGE,
+                 day_rate_hours=DAY_RATE_HOURS):
+        tiers = sorted((float(limit), rate) for limit, rate in tiers)
+        if len({limit for limit, _ in tiers}) != len(tiers):
+            raise ValueError("Surcharge tier limits must be unique")
+        self.target_temp = target_temp
+        self.day_rate_hours = day_rate_hours
+        self.limits = [limit for limit, _ in tiers]
+        # rates_bp[i] applies when limits[i-1] <= diff < limits[i]; the last
+        # entry is max_rate for differences beyond every tier
+        self.rates_bp = [_basis_points(rate) for _, rate in tiers] + [_basis_points(max_rate)]
+        self._table = {temp: self._rate_bp(temp) for temp in TABLE_RANGE}
+        if np is not None:
+            self._np_limits = np.array(self.limits, dtype=np.float64)
+            self._np_rates = np.array(self.rates_bp, dtype=np.int64)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            target_temp=config.get('target_temp', TARGET_TEMP),
+            tiers=[tuple(tier) for tier in config.get('tiers', SURCHARGE_TIERS)],
+            max_rate=config.get('max_rate', MAX_SURCHARGE),
+            day_rate_hours=config.get('day_rate_hours', DAY_RATE_HOURS),
+        )
+
+    @classmethod
+    def from_env(cls):
+        """Build from PRICING_CONFIG (a JSON file path or inline JSON), else the defaults."""
+        source = os.getenv('PRICING_CONFIG')
+        if not source:
+            return cls()
+        if source.lstrip().startswith('{'):
+            return cls.from_config(json.loads(source))
+        with open(source) as f:
+            return cls.from_config(json.load(f))
+
+    def _rate_bp(self, temp):
+        return self.rates_bp[bisect_right(self.limits, abs(self.target_temp - temp))]
+
+    def rate_bp(self, temp):
+        """Surcharge rate for a forecast, in basis points."""
+        bp = self._table.get(temp)
+        return self._rate_bp(temp) if bp is None else bp
+
+    def surcharge_rate(self, temp):
+        return self.rate_bp(temp) / 10000
+
+    def quote_cents(self, base_cents, temp):
+        """(surcharge, total) in cents for one room on one day."""
+        surcharge = (base_cents * self.rate_bp(temp) + 5000) // 10000
+        return surcharge, base_cents + surcharge
+
+    def quote(self, base_price, temp):
+        """Return (surcharge, total_price) as Decimal for one room on one day."""
+        surcharge, total = self.quote_cents(to_cents(base_price), temp)
+        return from_cents(surcharge), from_cents(total)
+
+    def price_many_cents(self, base_cents, temps):
+        """Vectorized ``quote_cents``: two lists of cents aligned with the inputs."""
+        if np is not None and len(base_cents) >= VECTORIZE_MIN:
+            diffs = np.abs(self.target_temp - np.asarray(temps, dtype=np.float64))
+            rates = self._np_rates[np.searchsorted(self._np_limits, diffs, side='right')]
+            bases = np.asarray(base_cents, dtype=np.int64)
+            surcharges = (bases * rates + 5000) // 10000
+            return surcharges.tolist(), (bases + surcharges).tolist()
+
+        rate_bp = self.rate_bp
+        surcharges = [(base * rate_bp(t) + 5000) // 10000 for base, t in zip(base_cents, temps)]
+        return surcharges, [base + s for base, s in zip(base_cents, surcharges)]
+
+    def billed_cents(self, day_cents, hours):
+        """Base price in cents for ``hours`` of one day whose full price is ``day_cents``."""
+        if hours >= self.day_rate_hours:
+            return day_cents
+        share = Decimal(day_cents) * Decimal(repr(hours)) / Decimal(repr(self.day_rate_hours))
+        return int(share.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+    def quote_slot(self, base_price, days):
+        """(surcharge, total_price) as Decimal for a booking spanning ``days``.
+
+        ``days`` is [(hours booked that day, forecast)]; each day is billed
+        its share of ``base_price`` (see ``billed_cents``) and priced with its
+        own forecast.
+        """
+        base_cents = to_cents(base_price)
+        surcharges, totals = self.price_many_cents(
+            [self.billed_cents(base_cents, hours) for hours, _ in days],
+            [temp for _, temp in days]
+        )
+        return from_cents(sum(surcharges)), from_cents(sum(totals))
+
+    def price_many(self, base_prices, temps):
+        """Price many (base_price, temp) pairs at once.
+
+        Returns two lists of Decimal, surcharges and totals, aligned with the inputs.
+        """
+        surcharges, totals = self.price_many_cents([to_cents(b) for b in base_prices], temps)
+        return [from_cents(c) for c in surcharges], [from_cents(c) for c in totals]
+
+
+engine = PricingEngine.from_env()
+
+
+def surcharge_rate(temp):
+    return engine.surcharge_rate(temp)
+
+
+def quote(base_price, temp):
+    """Return (surcharge, total_price) as Decimal for one room on one day."""
+    return engine.quote(base_price, temp)
+
+
+def quote_slot(base_price, days):
+    """Return (surcharge, total_price) as Decimal for [(hours, temp)] per day."""
+    return engine.quote_slot(base_price, days)
+
+
+def price_many(base_prices, temps):
+    """Return (surcharges, totals) as lists of Decimal aligned with the inputs."""
+    return engine.price_many(base_prices, temps)
+
+
+def receipt(room_name, location, temp, base_price, surcharge, total_price, **fields):
+    """Response body shared by the price preview and the booking confirmation.
+
+    Money goes out as JSON numbers (the frontend does arithmetic on them).
+    ``base_price`` is what the booked time was billed before the surcharge,
+    so base_price + surcharge == total_price; the room's rate is
+    ``price_per_hour``.
+    """
+    return {
+        **fields,
+        "room": room_name,
+        "location": location,
+        "weather_temp": temp,
+        "price_per_hour": base_price,
+        "base_price": float(total_price - surcharge),
+        "surcharge": float(surcharge),
+        "total_price": float(total_price),
+    }
@@ -0,0 +1,133 @@
+# --- SLOTS: the time a booking holds a room for ---
+# A booking covers whole days ("date", optionally through "end_date") or an
+# hour-aligned range ("start" / "end", ISO 8601; no offset means UTC). Either
+# way it is stored as a half-open tstzrange in the bookings.slot column.
+#
+# Overlaps are rejected by the bookings_no_overlap exclusion constraint, a
+# GiST index on (room, slot): checking a new booking is one index probe
+# however many bookings the room already has. The room is indexed as the
+# one-element range int4range(room_id, room_id, '[]') so range_ops can
+# compare it with `=` and no btree_gist extension is needed.
+import os
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+
+from dateutil.rrule import rrulestr
+
+MAX_BOOKING_DAYS = int(os.getenv('MAX_BOOKING_DAYS', 31))
+MAX_BATCH_BOOKINGS = int(os.getenv('MAX_BATCH_BOOKINGS', 100))
+
+# Postgres expression for the room half of the exclusion constraint; queries
+# must use the same expression for the planner to pick the GiST index
+ROOM_KEY = "int4range({column}, {column}, '[]')"
+
+
+class Slot(namedtuple('Slot', 'start end')):
+    """Half-open [start, end) in UTC."""
+
+    @classmethod
+    def for_days(cls, first, last):
+        """Whole days ``first`` through ``last`` (inclusive)."""
+        return cls(_midnight(first), _midnight(last + timedelta(days=1)))
+
+    @property
+    def whole_days(self):
+        return self.start.time() == time(0) and self.end.time() == time(0)
+
+    def days(self):
+        """[(date, hours)] for every UTC day the slot touches."""
+        result = []
+        day = self.start.date()
+        while _midnight(day) < self.end:
+            overlap = min(self.end, _midnight(day + timedelta(days=1))) - max(self.start, _midnight(day))
+            result.append((day, overlap.total_seconds() / 3600))
+            day += timedelta(days=1)
+        return result
+
+    def to_json(self):
+        return {"start": self.start.isoformat(), "end": self.end.isoformat()}
+
+
+def _midnight(day):
+    return datetime.combine(day, time(0), tzinfo=timezone.utc)
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        raise ValueError("Invalid date format. Use YYYY-MM-DD")
+
+
+def _parse_datetime(value):
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError("Invalid start/end. Use ISO 8601, e.g. 2030-01-31T09:00:00Z")
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+def parse_slot(data, today=None, now=None):
+    """Read the slot from a booking request body; raises ValueError with a user-facing message."""
+    today = today or date.today()
+    if data.get('start'):
+        if not data.get('end'):
+            raise ValueError("Hourly bookings need both start and end")
+        slot = Slot(_parse_datetime(data['start']), _parse_datetime(data['end']))
+        if any((t.minute, t.second, t.microsecond) != (0, 0, 0) for t in slot):
+            raise ValueError("Hourly bookings must start and end on the hour")
+        if slot.end <= slot.start:
+            raise ValueError("end must be after start")
+        now = now or datetime.now(timezone.utc)
+        if slot.start < now.replace(minute=0, second=0, microsecond=0):
+            raise ValueError(f"Cannot book in the past. It is now {now:%Y-%m-%d %H:%M} UTC")
+    else:
+        first = _parse_date(data.get('date'))
+        last = _parse_date(data['end_date']) if data.get('end_date') else first
+        if first < today:
+            raise ValueError(f"Cannot book in the past. Today is {today}, you asked for {first}")
+        if last < first:
+            raise ValueError("end_date must not be before date")
+        slot = Slot.for_days(first, last)
+
+    if slot.end - slot.start > timedelta(days=MAX_BOOKING_DAYS):
+        raise ValueError(f"A booking can last at most {MAX_BOOKING_DAYS} days")
+    return slot
+
+
+def expand_batch(data, limit=MAX_BATCH_BOOKINGS):
+    """One booking request body per occurrence of a POST /bookings/batch.
+
+    Occurrences are an explicit "dates" list, or a "recurrence" rule in
+    RFC 5545 form (e.g. "FREQ=WEEKLY;BYDAY=TU;COUNT=13") starting at "date".
+    With "start_time" / "end_time" (HH:MM, UTC) each occurrence is that
+    hourly slot instead of the whole day.
+    """
+    if data.get('dates'):
+        if not isinstance(data['dates'], list):
+            raise ValueError("dates must be a list of YYYY-MM-DD")
+        days = [str(day) for day in data['dates']]
+    elif data.get('recurrence'):
+        first = _parse_date(data.get('date'))
+        try:
+            rule = rrulestr(str(data['recurrence']), dtstart=datetime.combine(first, time(0)))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid recurrence rule: {e}")
+        days = []
+        for occurrence in rule:
+            if len(days) == limit:
+                raise ValueError(f"The recurrence has more than {limit} occurrences; add COUNT or UNTIL")
+            days.append(occurrence.date().isoformat())
+    else:
+        raise ValueError("Provide a dates list or a recurrence rule")
+
+    if not days:
+        raise ValueError("The batch has no dates")
+    if len(days) > limit:
+        raise ValueError(f"At most {limit} bookings per batch")
+    if data.get('start_time') or data.get('end_time'):
+        return [{"start": f"{day}T{data.get('start_time')}", "end": f"{day}T{data.get('end_time')}"}
+                for day in days]
+    return [{"date": day} for day in days]
@@ -1,6 +1,87 @@
+import asyncio
+import gzip
+import os
+import threading
+import time
 import unittest
 import json
-from app import app
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from unittest import mock
+import app as booking_app
+import contract
+import pricing
+import slots
+from app import app, room_client, weather_client
+
+try:
+    import async_app
+except ImportError:  # requirements-async.txt not installed
+    async_app = None
+
+UTC = timezone.utc
+
+def day_slot(day):
+    return datetime.combine(day, datetime.min.time(), UTC), datetime.combine(day + timedelta(days=1), datetime.min.time(), UTC)
+
+class FakeCursor:
+    """Stands in for a pooled connection + cursor; returns canned rows."""
+
+    def __init__(self, rows=()):
+        self.rows = list(rows)
+        self.executed = []
+        self.rolled_back = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self, name=None):
+        return self
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+class FakeAsyncCursor(FakeCursor):
+    """FakeCursor for async_app: awaitable execute/commit and ``stream``."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, sql, params=None):
+        FakeCursor.execute(self, sql, params)
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        FakeCursor.rollback(self)
+
+    async def stream(self, sql, params=(), prefetch=None):
+        FakeCursor.execute(self, sql, params)
+        for row in self.fetchall():
+            yield row
 
 class BookingServiceTestCase(unittest.TestCase):
     def setUp(self):
@@ -10,12 +91,736 @@ class BookingServiceTestCase(unittest.TestCase):
     def test_health_check(self):
         """Test if the service is up and running"""
         response = self.app.get('/health')
-        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('in_use', response.get_json()['db_pool'])
+
+    def test_trace_id_and_metrics(self):
+        """The caller's X-Request-ID is echoed back and requests show up on /metrics"""
+        response = self.app.get('/health', headers={'X-Request-ID': 'trace-42'})
+        self.assertEqual(response.headers['X-Request-ID'], 'trace-42')
+
+        metrics = self.app.get('/metrics').get_data(as_text=True)
+        self.assertIn('http_request_duration_seconds_count{method="GET",endpoint="/health",status="200"', metrics)
+
+    def test_token_user_must_match(self):
+        """A verified token only grants access to the caller's own bookings"""
+        with mock.patch.object(booking_app.token_verifier, 'verify', return_value={'user_id': 7}):
+            response = self.app.get('/bookings/user/8?limit=5',
+                                    headers={'Authorization': 'Bearer good-token'})
+        self.assertEqual(response.status_code, 403)
+
+        response = self.app.get('/bookings/user/8?limit=5',
+                                headers={'Authorization': 'Bearer not-a-jwt'})
+        self.assertEqual(response.status_code, 401)
 
     def test_login_page_load(self):
         """Test if login endpoint accepts OPTIONS (CORS check)"""
         response = self.app.open('/login', method='OPTIONS')
         self.assertEqual(response.status_code, 200)
 
+    def test_preview_uses_default_temp_when_weather_breaker_open(self):
+        """A tripped weather breaker falls back to 20°C without calling the service"""
+        room = mock.Mock(status_code=200)
+        room.json.return_value = {"location": "Paris", "price_per_hour": 200.0}
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+
+        with mock.patch.object(room_client, 'get', return_value=room), \
+             mock.patch.object(weather_client.breaker, 'allow', return_value=False), \
+             mock.patch.object(weather_client.session, 'request') as weather_call:
+            response = self.app.post('/bookings', json={
+                "user_id": 1, "room_id": 5, "room_name": "Louvre Room",
+                "date": tomorrow, "preview": True
+            })
+
+        weather_call.assert_not_called()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['weather_temp'], 20)
+
+    def test_bulk_quotes_matrix(self):
+        """One call prices every room for every day and marks booked days"""
+        start = date.today() + timedelta(days=1)
+        days = [(start + timedelta(days=i)).isoformat() for i in range(3)]
+        rooms = mock.Mock(status_code=200)
+        rooms.json.return_value = [
+            {"id": 1, "name": "Mitte Room", "location": "Berlin", "price_per_hour": 100.0},
+            {"id": 5, "name": "Louvre Room", "location": "Paris", "price_per_hour": 200.0},
+        ]
+        weather = mock.Mock(status_code=200)
+        weather.json.return_value = {"results": [{"temperature": 16}] * 3 + [{"temperature": 27}] * 3}
+        db = FakeCursor(rows=[(5, *day_slot(start + timedelta(days=1)))])
+
+        with mock.patch.object(room_client, 'get', return_value=rooms), \
+             mock.patch.object(weather_client, 'post', return_value=weather) as weather_call, \
+             mock.patch.object(booking_app, 'get_read_connection', return_value=db):
+            response = self.app.post('/quotes', json={
+                "room_ids": [5, 1, 99], "from": days[0], "to": days[-1]
+            })
+
+        body = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(weather_call.call_count, 1)
+        self.assertEqual(len(db.executed), 1)
+        self.assertEqual([r['room_id'] for r in body['rooms']], [5, 1])
+        self.assertEqual(body['not_found'], [99])
+        paris = body['rooms'][0]['quotes']
+        self.assertEqual([q['available'] for q in paris], [True, False, True])
+        self.assertAlmostEqual(paris[0]['total_price'], 240.0)    # 6°C off target: +20%
+        self.assertAlmostEqual(body['rooms'][1]['quotes'][0]['surcharge'], 20.0)
+
+    def test_room_availability_bitmap(self):
+        """Availability comes back as a per-day bitmap plus the booked dates"""
+        db = FakeCursor(rows=[(3, *day_slot(date(2030, 3, 2))),
+                              (3, datetime(2030, 3, 4, 9, tzinfo=UTC), datetime(2030, 3, 4, 11, tzinfo=UTC))])
+        with mock.patch.object(booking_app, 'get_read_connection', return_value=db):
+            response = self.app.get('/rooms/3/availability?from=2030-03-01&to=2030-03-04')
+        body = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body['bitmap'], '1010')
+        self.assertEqual(body['booked'], ['2030-03-02', '2030-03-04'])
+        self.assertEqual(body['slots'][1], {"start": "2030-03-04T09:00:00+00:00", "end": "2030-03-04T11:00:00+00:00"})
+        self.assertEqual(len(db.executed), 1)
+        self.assertIn('b.slot && tstzrange(%s, %s)', db.executed[0][0])
+
+    def test_availability_rejects_bad_range(self):
+        """Reversed or malformed ranges are a 400"""
+        response = self.app.get('/rooms/3/availability?from=2030-03-04&to=2030-03-01')
+        self.assertEqual(response.status_code, 400)
+        response = self.app.get('/rooms/availability?room_ids=a,b')
+        self.assertEqual(response.status_code, 400)
+
+    def test_conflicting_insert_returns_409(self):
+        """ON CONFLICT DO NOTHING returning no row is mapped to a 409"""
+        room = mock.Mock(status_code=200)
+        room.json.return_value = {"location": "Berlin", "price_per_hour": 100.0}
+        db = FakeCursor(rows=[])
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        with mock.patch.object(room_client, 'get', return_value=room), \
+             mock.patch.object(booking_app, 'fetch_temperature', return_value=20), \
+             mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.post('/bookings', json={
+                "user_id": 1, "room_id": 1, "room_name": "Mitte Room", "date": tomorrow
+            })
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(len(db.executed), 1)
+        self.assertIn('ON CONFLICT', db.executed[0][0])
+
+    def test_known_room_looks_up_room_and_weather_in_parallel(self):
+        """With the room's location cached, both calls are in flight before either returns"""
+        started = {'room': threading.Event(), 'weather': threading.Event()}
+        overlapped = []
+
+        def call(name, result):
+            def wait_for_the_other(*args, **kwargs):
+                started[name].set()
+                other = started['weather' if name == 'room' else 'room']
+                overlapped.append(other.wait(timeout=2))
+                return result
+            return wait_for_the_other
+
+        room = mock.Mock(status_code=200)
+        room.json.return_value = {"location": "Berlin", "price_per_hour": 100.0}
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        with mock.patch.dict(booking_app.room_locations, {'1': 'Berlin'}), \
+             mock.patch.object(booking_app, 'room_catalog', None), \
+             mock.patch.object(room_client, 'get', side_effect=call('room', room)), \
+             mock.patch.object(booking_app, 'fetch_temperature', side_effect=call('weather', 27)):
+            response = self.app.post('/bookings', json={
+                "user_id": 1, "room_id": 1, "room_name": "Mitte Room", "date": tomorrow, "preview": True
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['weather_temp'], 27)
+        self.assertEqual(overlapped, [True, True])
+
+    def test_missing_room_drops_the_weather_lookup(self):
+        """A 404 cancels the forecast started for a cached location and forgets the location"""
+        weather_future = mock.Mock()
+        missing = mock.Mock(status_code=404)
+        tomorrow = (date.today() + timedelta(days=1)).isoformat()
+        with mock.patch.dict(booking_app.room_locations, {'1': 'Berlin'}), \
+             mock.patch.object(booking_app, 'room_catalog', None), \
+             mock.patch.object(booking_app.orchestration_pool, 'submit', return_value=weather_future), \
+             mock.patch.object(room_client, 'get', return_value=missing):
+            response = self.app.post('/bookings', json={
+                "user_id": 1, "room_id": 1, "room_name": "Mitte Room", "date": tomorrow
+            })
+            self.assertNotIn('1', booking_app.room_locations)
+        self.assertEqual(response.status_code, 404)
+        weather_future.cancel.assert_called_once_with()
+
+    def test_hourly_booking_is_stored_as_a_slot(self):
+        """start/end bookings are inserted as a tstzrange on the first day"""
+        room = mock.Mock(status_code=200)
+        room.json.return_value = {"location": "Berlin", "price_per_hour": 100.0}
+        db = FakeCursor(rows=[(77,)])
+        day = date.today() + timedelta(days=4)
+        with mock.patch.object(room_client, 'get', return_value=room), \
+             mock.patch.object(booking_app, 'fetch_temperature', return_value=21), \
+             mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.post('/bookings', json={
+                "user_id": 1, "room_id": 1, "room_name": "Mitte Room",
+                "start": f"{day}T09:00:00Z", "end": f"{day}T12:00:00Z"
+            })
+        body = response.get_json()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(body['start'], f"{day}T09:00:00+00:00")
+        sql, params = db.executed[0]
+        self.assertIn('tstzrange(%s, %s)', sql)
+        self.assertEqual(params[3], day)
+        self.assertEqual(params[4:6], (datetime(day.year, day.month, day.day, 9, tzinfo=UTC),
+                                       datetime(day.year, day.month, day.day, 12, tzinfo=UTC)))
+
+    def test_idempotent_retry_is_replayed(self):
+        """A retry with the same Idempotency-Key replays the first response without downstream calls"""
+        room = mock.Mock(status_code=200)
+        room.json.return_value = {"location": "Berlin", "price_per_hour": 100.0}
+        db = FakeCursor(rows=[(41,)])
+        tomorrow = (date.today() + timedelta(days=2)).isoformat()
+        payload = {"user_id": 1, "room_id": 1, "room_name": "Mitte Room", "date": tomorrow}
+        headers = {"Idempotency-Key": "retry-test-1"}
+
+        with mock.patch.object(room_client, 'get', return_value=room) as room_call, \
+             mock.patch.object(booking_app, 'fetch_temperature', return_value=20), \
+             mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            first = self.app.post('/bookings', json=payload, headers=headers)
+            retry = self.app.post('/bookings', json=payload, headers=headers)
+            other = self.app.post('/bookings', json=dict(payload, room_id=2), headers=headers)
+
+        self.assertEqual((first.status_code, retry.status_code), (201, 201))
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(room_call.call_count, 1)
+        self.assertEqual(len(db.executed), 1)
+        self.assertEqual(other.status_code, 422)
+
+    def test_in_flight_duplicate_waits_for_original(self):
+        """A duplicate arriving mid-request gets the original's response instead of racing it"""
+        room = mock.Mock(status_code=200)
+        room.json.return_value = {"location": "Berlin", "price_per_hour": 100.0}
+        started, release = threading.Event(), threading.Event()
+
+        def slow_room(*args, **kwargs):
+            started.set()
+            release.wait(2)
+            return room
+
+        tomorrow = (date.today() + timedelta(days=3)).isoformat()
+        payload = {"user_id": 1, "room_id": 1, "room_name": "Mitte Room", "date": tomorrow}
+        headers = {"Idempotency-Key": "in-flight-1"}
+        results = []
+
+        with mock.patch.object(room_client, 'get', side_effect=slow_room) as room_call, \
+             mock.patch.object(booking_app, 'fetch_temperature', return_value=20), \
+             mock.patch.object(booking_app, 'get_db_connection', return_value=FakeCursor(rows=[(42,)])):
+            first = threading.Thread(target=lambda: results.append(
+                app.test_client().post('/bookings', json=payload, headers=headers)))
+            first.start()
+            started.wait(2)
+            second = threading.Thread(target=lambda: results.append(
+                app.test_client().post('/bookings', json=payload, headers=headers)))
+            second.start()
+            time.sleep(0.05)
+            release.set()
+            first.join()
+            second.join()
+
+        self.assertEqual(room_call.call_count, 1)
+        self.assertEqual([r.status_code for r in results], [201, 201])
+        self.assertEqual(results[0].get_json()['id'], results[1].get_json()['id'])
+
+    def batch_post(self, db, payload):
+        room = mock.Mock(status_code=200)
+        room.json.return_value = {"location": "Berlin", "price_per_hour": 100.0}
+        weather = mock.Mock(status_code=200)
+        weather.json.return_value = {"results": [{"temperature": 21}] * 3}
+        with mock.patch.object(room_client, 'get', return_value=room) as room_call, \
+             mock.patch.object(weather_client, 'post', return_value=weather) as weather_call, \
+             mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.post('/bookings/batch', json=dict(
+                {"user_id": 1, "room_id": 1, "room_name": "Mitte Room"}, **payload))
+        self.assertEqual((room_call.call_count, weather_call.call_count), (1, 1))
+        return response
+
+    def test_batch_booking_reports_each_occurrence(self):
+        """A recurring booking is one INSERT; overlapping occurrences come back as 409s"""
+        first = date.today() + timedelta(days=7)
+        weeks = [first + timedelta(weeks=i) for i in range(3)]
+        db = FakeCursor(rows=[(101, day_slot(weeks[0])[0]), (103, day_slot(weeks[2])[0])])
+        response = self.batch_post(db, {"date": first.isoformat(), "recurrence": "FREQ=WEEKLY;COUNT=3"})
+
+        results = response.get_json()['results']
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in results], [201, 409, 201])
+        self.assertEqual([r['date'] for r in results], [w.isoformat() for w in weeks])
+        self.assertEqual(results[2]['id'], 103)
+        self.assertEqual(len(db.executed), 1)
+        self.assertEqual(db.executed[0][1][3], weeks)
+        self.assertFalse(db.rolled_back)
+
+    def test_batch_all_or_nothing_rolls_back(self):
+        """With all_or_nothing one conflict undoes the whole batch"""
+        days = [date.today() + timedelta(days=i) for i in (8, 9)]
+        db = FakeCursor(rows=[(101, day_slot(days[0])[0])])
+        response = self.batch_post(db, {"dates": [d.isoformat() for d in days], "all_or_nothing": True})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([r['status'] for r in response.get_json()['results']], [424, 409])
+        self.assertTrue(db.rolled_back)
+
+    def test_batch_delete(self):
+        """Batch cancellation is one DELETE ... WHERE id = ANY, with per-id results"""
+        db = FakeCursor(rows=[(4, 1), (6, 1)])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.delete('/bookings/batch', json={"ids": [4, 5, 6]})
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([r['status'] for r in response.get_json()['results']], [200, 404, 200])
+        self.assertIn('id = ANY(%s)', db.executed[0][0])
+
+        db = FakeCursor(rows=[(4, 1)])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.delete('/bookings/batch', json={"ids": [4, 5], "all_or_nothing": True})
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(db.rolled_back)
+
+    def test_change_feed_returns_deltas_after_cursor(self):
+        """Inserts carry the booking, deletes only the id; next is the snapshot horizon"""
+        db = FakeCursor(rows=[(500, None)])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            first = self.app.get('/bookings/changes?user_id=1').get_json()
+        self.assertEqual(first, {"changes": [], "next": "500-0"})
+
+        db = FakeCursor(rows=[(520, None)])
+        db.fetchall = lambda: [(505, 7, 'I', 41, 'Mitte Room', date(2030, 5, 2), 100, None, *day_slot(date(2030, 5, 2))),
+                               (511, 9, 'D', 40, None, None, None, None, None, None)]
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.get('/bookings/changes?user_id=1&since=500-0')
+        body = response.get_json()
+        self.assertEqual(body['next'], '520-0')
+        self.assertEqual(body['changes'][0]['booking']['room_name'], 'Mitte Room')
+        self.assertEqual(body['changes'][1], {"op": "delete", "id": 40})
+        self.assertEqual(db.executed[1][1], (1, 500, 0, 520, booking_app.change_feed.PAGE_SIZE))
+
+    def test_last_event_id_overrides_since(self):
+        """A reconnecting EventSource resumes from Last-Event-ID, not the ?since it was opened with"""
+        db = FakeCursor(rows=[(520, None)])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.get('/bookings/changes?user_id=1&since=500-0',
+                                    headers={'Last-Event-ID': '510-4'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.executed[1][1][1:3], (510, 4))
+
+    def test_change_streams_are_capped_per_worker(self):
+        """Past MAX_CHANGE_STREAMS open streams a worker answers 503 until one closes"""
+        with mock.patch.object(booking_app, 'change_streams', threading.BoundedSemaphore(1)):
+            first = self.app.get('/bookings/changes/stream?user_id=1', buffered=False)
+            full = self.app.get('/bookings/changes/stream?user_id=1')
+            first.close()
+            again = self.app.get('/bookings/changes/stream?user_id=1', buffered=False)
+            again.close()
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(full.status_code, 503)
+        self.assertEqual(full.headers['Retry-After'], str(int(booking_app.CHANGES_POLL_SECONDS)))
+        self.assertEqual(again.status_code, 200)
+
+    def test_change_feed_expired_cursor_is_410(self):
+        """A cursor from before the purge horizon must reload instead of missing deletes"""
+        db = FakeCursor(rows=[(900, 600)])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.get('/bookings/changes?user_id=1&since=550-3')
+        self.assertEqual(response.status_code, 410)
+
+    def test_delete_owner_rules(self):
+        """A token holder cannot name another owner; an anonymous user_id limits the delete"""
+        db = FakeCursor(rows=[])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db), \
+             mock.patch.object(booking_app.token_verifier, 'verify', return_value={'user_id': 7}):
+            auth = {'Authorization': 'Bearer good-token'}
+            self.assertEqual(self.app.delete('/bookings/41', json={"user_id": 8}, headers=auth).status_code, 403)
+            self.assertEqual(self.app.delete('/bookings/batch', json={"ids": [41], "user_id": 8},
+                                             headers=auth).status_code, 403)
+        self.assertEqual(db.executed, [])
+
+        db = FakeCursor(rows=[(3,)])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.delete('/bookings/41?user_id=3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(db.executed[0][1], (41, '3'))
+
+    def test_delete_missing_booking_is_404(self):
+        """DELETE ... RETURNING with no row means the booking did not exist"""
+        db = FakeCursor(rows=[])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db):
+            response = self.app.delete('/bookings/12345')
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(db.executed), 1)
+
+    def test_cancel_pins_owner_reads_to_primary(self):
+        """After a cancellation the owner's next list read must not hit a lagging replica"""
+        db = FakeCursor(rows=[(3,)])
+        with mock.patch.object(booking_app, 'get_db_connection', return_value=db), \
+             mock.patch.object(booking_app.db_router, 'wrote') as wrote:
+            response = self.app.delete('/bookings/41')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('RETURNING user_id', db.executed[0][0])
+        wrote.assert_called_once_with(3)
+        self.assertAlmostEqual(float(response.headers['X-Read-After']), time.time(), delta=5)
+
+    def test_client_write_time_routes_reads_to_primary(self):
+        """X-Read-After from a write response reaches the router from any worker"""
+        db = FakeCursor(rows=[(1, 3, None, 640)])
+        with mock.patch.object(booking_app.db_router, 'read_connection', return_value=db) as read:
+            self.app.get('/bookings/user/1', headers={'X-Read-After': '1767225600.25'})
+            self.app.get('/bookings/user/1', headers={'X-Read-After': 'soon'})
+        self.assertEqual(read.call_args_list[0], mock.call(1, wrote_at=1767225600.25))
+        self.assertEqual(read.call_args_list[1], mock.call(1, wrote_at=None))
+
+    def test_user_bookings_keyset_page(self):
+        """A full page returns the keyset cursor for the next one"""
+        rows = [(9, 'Mitte Room', date(2030, 5, 2), 120, None, *day_slot(date(2030, 5, 2))),
+                (7, 'Mitte Room', date(2030, 5, 1), 100, None, *day_slot(date(2030, 5, 1))),
+                (3, 'Louvre Room', date(2030, 4, 1), 200, None, *day_slot(date(2030, 4, 1)))]
+        db = FakeCursor(rows=[(3, 12, None, 640)] + rows)
+        with mock.patch.object(booking_app, 'get_read_connection', return_value=db):
+            response = self.app.get('/bookings/user/1?limit=2&after=2030-06-01,50&when=upcoming')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([b['id'] for b in response.get_json()], [9, 7])
+        self.assertEqual(response.headers['X-Next-Cursor'], '2030-05-01,7')
+        sql, params = db.executed[1]
+        self.assertIn('(date, id) < (%s, %s)', sql)
+        self.assertEqual(params[-1], 3)      # limit + 1
+
+    def test_user_bookings_streams_everything_without_limit(self):
+        """Without a limit the whole history is streamed as one JSON array"""
+        db = FakeCursor(rows=[(1, 3, None, 640), (1, 'Mitte Room', date(2030, 5, 2), 120, None, *day_slot(date(2030, 5, 2)))])
+        with mock.patch.object(booking_app, 'get_read_connection', return_value=db):
+            response = self.app.get('/bookings/user/1')
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(response.get_json()[0]['date'], '2030-05-02')
+        self.assertEqual(response.get_json()[0]['end'], '2030-05-03T00:00:00+00:00')
+        self.assertNotIn('X-Next-Cursor', response.headers)
+        self.assertEqual(response.headers['ETag'], '"bookings-1-1.3.0"')
+        self.assertEqual(response.headers['X-Changes-Cursor'], '640-0')
+
+    def test_unchanged_bookings_are_304_without_listing(self):
+        """A client holding the current change-log version gets a 304; the list query never runs"""
+        db = FakeCursor(rows=[(1, 3, None, 640)])
+        with mock.patch.object(booking_app, 'get_read_connection', return_value=db):
+            response = self.app.get('/bookings/user/1', headers={'If-None-Match': '"bookings-1-1.3.0-gzip"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['Cache-Control'], 'private, no-cache')
+        self.assertEqual(len(db.executed), 1)
+
+    def test_streamed_bookings_are_gzipped(self):
+        """The streamed history is compressed chunk by chunk when the client accepts gzip"""
+        rows = [(i, 'Mitte Room', date(2030, 5, 2), 120, None, *day_slot(date(2030, 5, 2))) for i in range(200)]
+        db = FakeCursor(rows=[(200, 200, None, 640)] + rows)
+        with mock.patch.object(booking_app, 'get_read_connection', return_value=db):
+            response = self.app.get('/bookings/user/1', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.headers['ETag'], '"bookings-1-200.200.0-gzip"')
+        body = response.get_data()
+        self.assertEqual(len(json.loads(gzip.decompress(body))), 200)
+        self.assertLess(len(body), len(json.dumps([contract.booking_to_json(r) for r in rows])) / 5)
+
+
+@unittest.skipIf(async_app is None, "install requirements-async.txt to compare async_app.py")
+class AsyncParityTestCase(unittest.TestCase):
+    """async_app.py must answer like app.py: each scenario runs against both."""
+
+    HEADERS = ('ETag', 'X-Next-Cursor', 'X-Changes-Cursor', 'Content-Encoding',
+               'Idempotent-Replayed', 'Cache-Control', 'Retry-After')
+
+    def setUp(self):
+        self.room = mock.Mock(status_code=200)
+        self.room.json.return_value = {"location": "Berlin", "price_per_hour": 100.0}
+        self.weather = mock.Mock(status_code=200)
+        self.weather.json.return_value = {"temperature": 27,
+                                          "results": [{"temperature": 21}, {"temperature": 27}] * 3}
+
+    def answer(self, response, data):
+        if response.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        body = json.loads(data) if data else None
+        return response.status_code, {h: response.headers.get(h) for h in self.HEADERS}, body
+
+    def sync_call(self, rows, requests):
+        db = FakeCursor(rows=rows)
+        with mock.patch.dict(booking_app.room_locations, clear=True), \
+             mock.patch.object(booking_app, 'room_catalog', None), \
+             mock.patch.object(room_client, 'get', return_value=self.room), \
+             mock.patch.object(weather_client, 'get', return_value=self.weather), \
+             mock.patch.object(weather_client, 'post', return_value=self.weather), \
+             mock.patch.object(booking_app, 'get_db_connection', return_value=db), \
+             mock.patch.object(booking_app, 'get_read_connection', return_value=db), \
+             mock.patch.object(booking_app.token_verifier, 'verify', side_effect=self.verify):
+            client = app.test_client()
+            answers = []
+            for method, path, kwargs in requests:
+                response = client.open(path, method=method, **kwargs)
+                answers.append(self.answer(response, response.get_data()))
+        return answers, db.executed
+
+    def async_call(self, rows, requests):
+        db = FakeAsyncCursor(rows=rows)
+
+        async def run():
+            client = async_app.app.test_client()
+            answers = []
+            for method, path, kwargs in requests:
+                response = await client.open(path, method=method, **kwargs)
+                answers.append(self.answer(response, await response.get_data()))
+            return answers
+
+        with mock.patch.dict(async_app.room_locations, clear=True), \
+             mock.patch.object(async_app.room_client, 'get', mock.AsyncMock(return_value=self.room)), \
+             mock.patch.object(async_app.weather_client, 'get', mock.AsyncMock(return_value=self.weather)), \
+             mock.patch.object(async_app.weather_client, 'post', mock.AsyncMock(return_value=self.weather)), \
+             mock.patch.object(async_app, 'get_db_connection', return_value=db), \
+             mock.patch.object(async_app, 'get_read_connection', return_value=db), \
+             mock.patch.object(async_app.token_verifier, 'verify', side_effect=self.verify):
+            return asyncio.run(run()), db.executed
+
+    @staticmethod
+    def verify(token):
+        if token != 'good-token':
+            raise booking_app.jwt_auth.InvalidToken('not a JWT')
+        return {'user_id': 7}
+
+    def assertSameAnswers(self, rows, *requests):
+        """Both apps give the same statuses, headers and JSON; returns the sync answers."""
+        requests = [(method, path, kwargs) for method, path, kwargs in requests]
+        sync_answers, sync_sql = self.sync_call(rows, requests)
+        async_answers, async_sql = self.async_call(rows, requests)
+        self.assertEqual(async_answers, sync_answers)
+        # Same statements; async_app passes ids as ints for asyncpg
+        self.assertEqual(len(async_sql), len(sync_sql))
+        return sync_answers
+
+    def test_preview_and_booking(self):
+        day = (date.today() + timedelta(days=1)).isoformat()
+        payload = {"user_id": 1, "room_id": 1, "room_name": "Mitte Room", "date": day}
+        (preview,) = self.assertSameAnswers([], ('POST', '/bookings', {"json": dict(payload, preview=True)}))
+        self.assertEqual(preview[2]['weather_temp'], 27)
+        (created,) = self.assertSameAnswers([(41,)], ('POST', '/bookings', {"json": payload}))
+        self.assertEqual(created[0], 201)
+        (conflict,) = self.assertSameAnswers([], ('POST', '/bookings', {"json": payload}))
+        self.assertEqual(conflict[0], 409)
+
+    def test_tokens(self):
+        self.assertSameAnswers(
+            [], ('GET', '/bookings/user/8?limit=5', {"headers": {'Authorization': 'Bearer good-token'}}),
+            ('GET', '/bookings/user/8?limit=5', {"headers": {'Authorization': 'Bearer not-a-jwt'}}))
+
+    def test_idempotent_replay(self):
+        day = (date.today() + timedelta(days=2)).isoformat()
+        payload = {"user_id": 1, "room_id": 1, "room_name": "Mitte Room", "date": day}
+        sync_headers = {"Idempotency-Key": f"parity-{time.time()}"}
+        async_headers = {"Idempotency-Key": f"parity-async-{time.time()}"}
+        requests = lambda headers: [('POST', '/bookings', {"json": payload, "headers": headers}),
+                                    ('POST', '/bookings', {"json": payload, "headers": headers}),
+                                    ('POST', '/bookings', {"json": dict(payload, room_id=2), "headers": headers})]
+        # Both apps share the idempotency table, so each gets its own key
+        sync_answers, _ = self.sync_call([(41,)], requests(sync_headers))
+        async_answers, _ = self.async_call([(41,)], requests(async_headers))
+        self.assertEqual(async_answers, sync_answers)
+        self.assertEqual([a[0] for a in sync_answers], [201, 201, 422])
+        self.assertEqual(sync_answers[1][1]['Idempotent-Replayed'], 'true')
+
+    def test_batch(self):
+        first = date.today() + timedelta(days=7)
+        weeks = [first + timedelta(weeks=i) for i in range(3)]
+        (batch,) = self.assertSameAnswers(
+            [(101, day_slot(weeks[0])[0]), (103, day_slot(weeks[2])[0])],
+            ('POST', '/bookings/batch', {"json": {"user_id": 1, "room_id": 1, "room_name": "Mitte Room",
+                                                  "date": first.isoformat(), "recurrence": "FREQ=WEEKLY;COUNT=3"}}))
+        self.assertEqual([r['status'] for r in batch[2]['results']], [201, 409, 201])
+
+    def test_quotes_and_availability(self):
+        self.room.json.return_value = [{"id": 1, "name": "Mitte Room", "location": "Berlin",
+                                          "price_per_hour": 100.0}]
+        start = date.today() + timedelta(days=3)
+        (quotes,) = self.assertSameAnswers(
+            [(1, *day_slot(start))],
+            ('POST', '/quotes', {"json": {"room_ids": [1, 99], "from": start.isoformat(),
+                                          "to": (start + timedelta(days=2)).isoformat()}}))
+        self.assertEqual(quotes[0], 200)
+        self.assertSameAnswers(
+            [(3, *day_slot(date(2030, 3, 2)))],
+            ('GET', '/rooms/availability?room_ids=3,4&from=2030-03-01&to=2030-03-04', {}))
+
+    def test_change_feed(self):
+        (changes,) = self.assertSameAnswers(
+            [(520, None), (505, 7, 'I', 41, 'Mitte Room', date(2030, 5, 2), 100, None, *day_slot(date(2030, 5, 2))),
+             (511, 9, 'D', 40, None, None, None, None, None, None)],
+            ('GET', '/bookings/changes?user_id=1&since=500-0', {}))
+        self.assertEqual(changes[2]['next'], '520-0')
+        (expired,) = self.assertSameAnswers([(900, 600)], ('GET', '/bookings/changes?user_id=1&since=550-3', {}))
+        self.assertEqual(expired[0], 410)
+
+    def test_user_bookings(self):
+        rows = [(9, 'Mitte Room', date(2030, 5, 2), 120, None, *day_slot(date(2030, 5, 2))),
+                (7, 'Mitte Room', date(2030, 5, 1), 100, None, *day_slot(date(2030, 5, 1))),
+                (3, 'Louvre Room', date(2030, 4, 1), 200, None, *day_slot(date(2030, 4, 1)))]
+        (page,) = self.assertSameAnswers([(3, 12, None, 640)] + rows,
+                                         ('GET', '/bookings/user/1?limit=2&after=2030-06-01,50&when=upcoming', {}))
+        self.assertEqual(page[1]['X-Next-Cursor'], '2030-05-01,7')
+        (cached,) = self.assertSameAnswers(
+            [(1, 3, None, 640)], ('GET', '/bookings/user/1', {"headers": {'If-None-Match': '"bookings-1-1.3.0-gzip"'}}))
+        self.assertEqual(cached[0], 304)
+
+        many = [(i, 'Mitte Room', date(2030, 5, 2), 120, None, *day_slot(date(2030, 5, 2))) for i in range(200)]
+        (streamed,) = self.assertSameAnswers([(200, 200, None, 640)] + many,
+                                             ('GET', '/bookings/user/1', {"headers": {'Accept-Encoding': 'gzip'}}))
+        self.assertEqual(streamed[1]['ETag'], '"bookings-1-200.200.0-gzip"')
+        self.assertEqual(len(streamed[2]), 200)
+
+    def test_deletes(self):
+        auth = {'Authorization': 'Bearer good-token'}
+        self.assertSameAnswers([], ('DELETE', '/bookings/41', {"json": {"user_id": 8}, "headers": auth}),
+                               ('DELETE', '/bookings/batch', {"json": {"ids": [41], "user_id": 8}, "headers": auth}))
+        self.assertSameAnswers([(3,)], ('DELETE', '/bookings/41?user_id=3', {}))
+        self.assertSameAnswers([], ('DELETE', '/bookings/12345', {}))
+        (batch,) = self.assertSameAnswers([(4, 1), (6, 1)], ('DELETE', '/bookings/batch', {"json": {"ids": [4, 5, 6]}}))
+        self.assertEqual([r['status'] for r in batch[2]['results']], [200, 404, 200])
+
+
+@unittest.skipUnless(os.getenv('BOOKING_STRESS_DB'), "set BOOKING_STRESS_DB=1 and DB_* to run against Postgres")
+class BookingConcurrencyTestCase(unittest.TestCase):
+    """Fires many simultaneous bookings for one room/date at a real database."""
+
+    WORKERS = int(os.getenv('BOOKING_STRESS_WORKERS', 50))
+    ROUNDS = int(os.getenv('BOOKING_STRESS_ROUNDS', 10))
+    ROOM_ID = 990001
+
+    def setUp(self):
+        room = mock.Mock(status_code=200)
+        room.json.return_value = {"location": "Berlin", "price_per_hour": 100.0}
+        for patcher in (mock.patch.object(room_client, 'get', return_value=room),
+                        mock.patch.object(booking_app, 'fetch_temperature', return_value=20)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(self.cleanup)
+
+    def cleanup(self):
+        with booking_app.get_db_connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM bookings WHERE room_id = %s", (self.ROOM_ID,))
+            conn.commit()
+
+    def test_exactly_one_booking_wins(self):
+        """Per round, exactly one of WORKERS racing requests gets a 201"""
+        total_requests, started = 0, time.perf_counter()
+        for round_no in range(self.ROUNDS):
+            day = (date.today() + timedelta(days=1 + round_no)).isoformat()
+            barrier = threading.Barrier(self.WORKERS)
+            statuses = []
+
+            def book():
+                client = app.test_client()
+                barrier.wait()
+                statuses.append(client.post('/bookings', json={
+                    "user_id": 1, "room_id": self.ROOM_ID, "room_name": "Stress Room", "date": day
+                }).status_code)
+
+            threads = [threading.Thread(target=book) for _ in range(self.WORKERS)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.assertEqual(statuses.count(201), 1, statuses)
+            self.assertEqual(statuses.count(409), self.WORKERS - 1, statuses)
+            total_requests += len(statuses)
+
+        elapsed = time.perf_counter() - started
+        print(f"\n{total_requests} contended bookings in {elapsed:.2f}s "
+              f"({total_requests / elapsed:.0f} req/s, pool: {booking_app.db_pool.stats()})")
+
+class SlotTestCase(unittest.TestCase):
+    TODAY = date(2030, 1, 10)
+    NOW = datetime(2030, 1, 10, 8, 30, tzinfo=UTC)
+
+    def parse(self, **data):
+        return slots.parse_slot(data, today=self.TODAY, now=self.NOW)
+
+    def test_whole_and_multi_day_slots(self):
+        """date..end_date covers whole UTC days, end exclusive"""
+        slot = self.parse(date='2030-01-10', end_date='2030-01-12')
+        self.assertEqual(slot.end - slot.start, timedelta(days=3))
+        self.assertTrue(slot.whole_days)
+        self.assertEqual([hours for _, hours in slot.days()], [24, 24, 24])
+
+    def test_hourly_slot_split_across_midnight(self):
+        """Offsets are converted to UTC and hours are counted per day"""
+        slot = self.parse(start='2030-01-11T23:00:00+01:00', end='2030-01-12T03:00:00Z')
+        self.assertEqual(slot.days(), [(date(2030, 1, 11), 2), (date(2030, 1, 12), 3)])
+
+    def test_invalid_slots(self):
+        """Past, unaligned, reversed and over-long slots are rejected"""
+        for data in ({'date': '2030-01-09'}, {'date': '10/01/2030'},
+                     {'start': '2030-01-10T07:00', 'end': '2030-01-10T09:00'},
+                     {'start': '2030-01-10T10:30', 'end': '2030-01-10T12:00'},
+                     {'start': '2030-01-10T12:00', 'end': '2030-01-10T10:00'},
+                     {'date': '2030-01-10', 'end_date': '2030-06-10'}):
+            with self.assertRaises(ValueError, msg=data):
+                self.parse(**data)
+        self.assertEqual(self.parse(start='2030-01-10T08:00', end='2030-01-10T09:00').start.hour, 8)
+
+    def test_recurrence_expands_to_occurrences(self):
+        """An RRULE from the first date gives one request per occurrence"""
+        items = slots.expand_batch({"date": "2030-01-08", "recurrence": "FREQ=WEEKLY;BYDAY=TU;COUNT=13",
+                                    "start_time": "09:00", "end_time": "10:00"})
+        self.assertEqual(len(items), 13)
+        self.assertEqual(items[1], {"start": "2030-01-15T09:00", "end": "2030-01-15T10:00"})
+        with self.assertRaises(ValueError):
+            slots.expand_batch({"date": "2030-01-08", "recurrence": "FREQ=DAILY"})
+
+class PricingTestCase(unittest.TestCase):
+    def test_tier_boundaries(self):
+        """A difference equal to a tier limit falls into the next tier"""
+        engine = pricing.PricingEngine()
+        rates = [engine.surcharge_rate(t) for t in (21, 19.5, 19, 16, 11, 1, 0.5, 45)]
+        self.assertEqual(rates, [0.0, 0.0, 0.1, 0.2, 0.3, 0.5, 0.5, 0.5])
+
+    def test_money_is_exact_cents(self):
+        """Surcharges are rounded half up to the cent, as DECIMAL(10,2) stores them"""
+        self.assertEqual(pricing.quote(33.33, 18), (Decimal('3.33'), Decimal('36.66')))
+        self.assertEqual(pricing.quote(0.05, 18), (Decimal('0.01'), Decimal('0.06')))
+        self.assertEqual(pricing.quote(100.1, 27), (Decimal('20.02'), Decimal('120.12')))
+
+    def test_slot_billing_caps_each_day(self):
+        """Part of a day is billed pro rata with that day's forecast; a whole day is the room's price"""
+        engine = pricing.PricingEngine()
+        self.assertEqual(engine.quote_slot(100, [(3, 21)]), (Decimal('0.00'), Decimal('37.50')))
+        self.assertEqual(engine.quote_slot(100, [(24, 21), (2, 27)]),
+                         (Decimal('5.00'), Decimal('130.00')))
+        # A whole day costs what single-day bookings always did
+        self.assertEqual(engine.quote_slot(100, [(24, 27)]), pricing.quote(100, 27))
+        self.assertEqual(pricing.PricingEngine(day_rate_hours=1).quote_slot(100, [(1, 27)]),
+                         pricing.quote(100, 27))
+
+    def test_receipt_base_adds_up(self):
+        """base_price on a receipt is the billed amount, so base + surcharge = total"""
+        surcharge, total = pricing.quote_slot(100, [(3, 27)])
+        body = pricing.receipt('Mitte Room', 'Berlin', 27, 100.0, surcharge, total)
+        self.assertEqual(body['price_per_hour'], 100.0)
+        self.assertAlmostEqual(body['base_price'] + body['surcharge'], body['total_price'])
+        self.assertAlmostEqual(body['base_price'], 37.5)
+
+    def test_longer_slots_cost_more(self):
+        """Part of a day is billed by the hour, so 1 hour is cheaper than 3 or 8"""
+        one, three, eight, day = (pricing.quote_slot(100, [(hours, 27)])[1] for hours in (1, 3, 8, 24))
+        self.assertLess(one, three)
+        self.assertLess(three, eight)
+        self.assertEqual(eight, day)
+
+    def test_vectorized_matches_scalar(self):
+        """price_many gives the same cents as quote, with or without NumPy"""
+        engine = pricing.PricingEngine.from_config({"target_temp": 20, "tiers": [[3, 0.05]], "max_rate": 0.25})
+        bases = [99.99, 150, 0.3] * 40
+        temps = [20, 23, -4.5] * 40
+        expected = [engine.quote(b, t) for b, t in zip(bases, temps)]
+        self.assertEqual(list(zip(*engine.price_many(bases, temps))), expected)
+        with mock.patch.object(pricing, 'np', None):
+            self.assertEqual(list(zip(*engine.price_many(bases, temps))), expected)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,5 @@
+# Shared building blocks used by the Flask microservices.
+#
+# Each service adds the repository root to sys.path at startup so that
+# `import common` works both from `python <service>/app.py` and inside the
+# Docker images (which copy this package next to app.py).
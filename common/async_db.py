@@ -0,0 +1,179 @@
+"""asyncpg counterpart of ``ConnectionPool`` for the asyncio booking service.
+
+Statements keep psycopg2's ``%s`` placeholders so the SQL is shared with the
+sync code; they are renumbered to asyncpg's ``$1, $2, ...`` on the way.
+``connection()`` hands out an ``AsyncCursor`` that behaves like a psycopg2
+connection and cursor in one: its first statement opens a transaction, rows
+are fetched with ``fetchone()`` / ``fetchall()``, and whatever was not
+committed is rolled back when the connection goes back to the pool.
+"""
+import asyncio
+import itertools
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import asyncpg
+
+from common import tracing
+from common.db_pool import PoolTimeout, statement_label
+
+_PLACEHOLDER = re.compile(r'%([s%])')
+
+
+@lru_cache(maxsize=1024)
+def numbered(query):
+    """``query`` with ``%s`` placeholders as ``$1, $2, ...`` and ``%%`` as ``%``."""
+    counter = itertools.count(1)
+    return _PLACEHOLDER.sub(lambda m: f"${next(counter)}" if m.group(1) == 's' else '%', query)
+
+
+class AsyncCursor:
+    """One pooled asyncpg connection with psycopg2's execute/fetch/commit shape."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rows = []
+        self._transaction = None
+
+    async def _begin(self):
+        if self._transaction is None:
+            self._transaction = self.conn.transaction()
+            await self._transaction.start()
+
+    async def execute(self, query, params=()):
+        await self._begin()
+        with tracing.span('db', statement_label(query)):
+            self.rows = [tuple(row) for row in await self.conn.fetch(numbered(query), *params)]
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    async def stream(self, query, params=(), prefetch=500):
+        """Yield rows from a server-side cursor, ``prefetch`` at a time."""
+        await self._begin()
+        async for row in self.conn.cursor(numbered(query), *params, prefetch=prefetch):
+            yield tuple(row)
+
+    async def commit(self):
+        if self._transaction is not None:
+            transaction, self._transaction = self._transaction, None
+            await transaction.commit()
+
+    async def rollback(self):
+        if self._transaction is not None:
+            transaction, self._transaction = self._transaction, None
+            await transaction.rollback()
+
+
+class AsyncConnectionPool:
+    """A bounded asyncpg pool, configured and measured like ``ConnectionPool``.
+
+    The asyncpg pool is created on first use (or with ``open()`` at start-up),
+    inside the event loop that will use it.
+    """
+
+    def __init__(self, name='default', minconn=1, maxconn=10, timeout=5.0, connect_timeout=5.0, **dsn):
+        self.name = name
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.dsn = dict(dsn, timeout=connect_timeout)
+        self._pool = None
+        self._opening = None
+
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def from_env(cls, name='default', **defaults):
+        """Reads the same DB_* variables as ``ConnectionPool.from_env``."""
+        return cls(
+            name=name,
+            minconn=int(os.getenv('DB_POOL_MIN', 1)),
+            maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            host=os.getenv('DB_HOST', defaults.get('host')),
+            database=os.getenv('DB_NAME', defaults.get('database', 'postgres')),
+            user=os.getenv('DB_USER', defaults.get('user')),
+            password=os.getenv('DB_PASS', defaults.get('password')),
+            port=int(os.getenv('DB_PORT', defaults.get('port', 5432))),
+            connect_timeout=float(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+        )
+
+    async def open(self):
+        if self._pool is not None:
+            return
+        if self._opening is None:
+            self._opening = asyncio.ensure_future(asyncpg.create_pool(
+                min_size=self.minconn, max_size=self.maxconn, **self.dsn
+            ))
+        try:
+            self._pool = await asyncio.shield(self._opening)
+        except Exception:
+            self._opening = None
+            raise
+
+    async def close(self):
+        if self._pool is not None:
+            pool, self._pool, self._opening = self._pool, None, None
+            await pool.close()
+
+    async def connect(self):
+        """A connection of its own, outside the pool (e.g. for LISTEN)."""
+        return await asyncpg.connect(**self.dsn)
+
+    @asynccontextmanager
+    async def connection(self, timeout=None):
+        """``async with pool.connection() as cur:`` - the connection is always returned."""
+        await self.open()
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        self._waiting += 1
+        try:
+            conn = await self._pool.acquire(timeout=timeout)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise PoolTimeout(f"No connection available in pool '{self.name}' after {timeout}s")
+        finally:
+            self._waiting -= 1
+        waited = time.monotonic() - started
+        self._checkouts += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+
+        cur = AsyncCursor(conn)
+        try:
+            yield cur
+        finally:
+            try:
+                if not conn.is_closed():
+                    await cur.rollback()
+            finally:
+                await self._pool.release(conn)
+
+    def stats(self):
+        size = self._pool.get_size() if self._pool is not None else 0
+        idle = self._pool.get_idle_size() if self._pool is not None else 0
+        return {
+            "name": self.name,
+            "min": self.minconn,
+            "max": self.maxconn,
+            "size": size,
+            "idle": idle,
+            "in_use": size - idle,
+            "waiting": self._waiting,
+            "checkouts": self._checkouts,
+            "timeouts": self._timeouts,
+            "wait_time_avg_ms": round(1000 * self._wait_total / self._checkouts, 3) if self._checkouts else 0.0,
+            "wait_time_max_ms": round(1000 * self._wait_max, 3),
+        }
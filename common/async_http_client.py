@@ -0,0 +1,109 @@
+import asyncio
+import os
+import random
+import time
+
+import httpx
+
+from common import tracing
+from common.http_client import CircuitBreaker, LatencyHistogram, ServiceUnavailable, with_trace_header
+
+
+class AsyncServiceClient:
+    """asyncio counterpart of ``ServiceClient`` built on ``httpx.AsyncClient``.
+
+    Same timeouts, retry and circuit-breaker behaviour, but waiting on a
+    dependency does not hold a thread. Call ``start()`` from inside the event
+    loop before use and ``close()`` on shutdown.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=1.0, read_timeout=3.0,
+                 retries=2, backoff=0.05, pool_size=100, breaker=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self.client = None
+
+    @classmethod
+    def from_env(cls, name, prefix, default_url):
+        """Reads the same ``<PREFIX>_*`` variables as ``ServiceClient.from_env``."""
+        return cls(
+            name,
+            os.getenv(f'{prefix}_URL', default_url),
+            connect_timeout=float(os.getenv(f'{prefix}_CONNECT_TIMEOUT', 1.0)),
+            read_timeout=float(os.getenv(f'{prefix}_READ_TIMEOUT', 3.0)),
+            retries=int(os.getenv(f'{prefix}_RETRIES', 2)),
+            pool_size=int(os.getenv(f'{prefix}_POOL_SIZE', 100)),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv(f'{prefix}_BREAKER_THRESHOLD', 5)),
+                reset_timeout=float(os.getenv(f'{prefix}_BREAKER_RESET', 30)),
+            ),
+        )
+
+    def start(self):
+        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout, limits=self.limits)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def request(self, method, path, idempotent=None, **kwargs):
+        if not self.breaker.allow():
+            raise ServiceUnavailable(f"{self.name} circuit breaker is open")
+        try:
+            response = await self._send(method, path, idempotent, **kwargs)
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled (e.g. the weather lookup of a booking that 404'd):
+            # no verdict on the dependency, but free the half-open trial
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return response
+
+    async def _send(self, method, path, idempotent, **kwargs):
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD')
+        attempts = self.retries + 1 if idempotent else 1
+        last_error = None
+        kwargs['headers'] = with_trace_header(kwargs.get('headers'))
+
+        for attempt in range(attempts):
+            if attempt:
+                await asyncio.sleep(random.uniform(0, self.backoff * (2 ** (attempt - 1))))
+            started = time.monotonic()
+            try:
+                with tracing.span('http', f"{self.name} {method}"):
+                    response = await self.client.request(method, path, **kwargs)
+            except httpx.HTTPError as e:
+                last_error = f"{type(e).__name__}: {e}"
+                continue
+            finally:
+                self.latency.observe(time.monotonic() - started)
+
+            if response.status_code < 500:
+                return response
+            last_error = f"HTTP {response.status_code}"
+
+        raise ServiceUnavailable(f"{self.name} unavailable: {last_error}")
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "circuit_breaker": self.breaker.stats(),
+            "latency": self.latency.stats(),
+        }
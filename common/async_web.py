@@ -0,0 +1,235 @@
+"""Quart counterparts of the Flask integrations in common/.
+
+Used by booking_service/async_app.py so that it answers exactly like the
+Flask service it is A/B tested against:
+
+* ``init_tracing`` - trace IDs, request logs and ``GET /metrics`` (tracing.py)
+* ``init_auth`` / ``current_user_id`` - bearer tokens on ``g.user`` (jwt_auth.py)
+* ``init_compression`` / ``not_modified`` - gzip/brotli and ETags (responses.py)
+* ``idempotent`` - ``Idempotency-Key`` replays (idempotency.py)
+
+Hooks are coroutines: Quart runs plain functions on a thread pool, where a
+trace set in a before-request hook would not be seen by the view.
+"""
+import asyncio
+import os
+import time
+from functools import wraps
+
+from quart import Response, g, jsonify, make_response, request
+from quart.wrappers.response import IterableBody
+
+from common import idempotency, jwt_auth, responses, tracing
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+# --- TRACING ---
+def init_tracing(app, service):
+    """Trace every request of ``app`` and serve ``/metrics``."""
+
+    @app.before_request
+    async def start_trace():
+        g.trace_token = tracing.start_request(request.headers.get(tracing.TRACE_HEADER), service)
+        g.trace_started = time.perf_counter()
+
+    @app.after_request
+    async def finish_trace(response):
+        if 'trace_started' not in g:
+            return response
+        trace_id = tracing.finish_request(service, request.method, _endpoint(), request.path,
+                                          response.status_code, time.perf_counter() - g.trace_started)
+        if trace_id is not None:
+            response.headers[tracing.TRACE_HEADER] = trace_id
+        return response
+
+    @app.teardown_request
+    async def end_trace(exc):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            tracing.end_request(token)
+
+    @app.route('/metrics', methods=['GET'])
+    async def metrics():
+        return Response(tracing.render_metrics(service), mimetype='text/plain; version=0.0.4')
+
+    return app
+
+
+# --- AUTHENTICATION ---
+def init_auth(app, verifier, required=None):
+    """Authenticate every request of ``app``; claims end up on ``g.user``."""
+    if required is None:
+        required = os.getenv('JWT_REQUIRED', '0') == '1'
+
+    @app.before_request
+    async def authenticate():
+        g.user = None
+        if request.method == 'OPTIONS':
+            return None
+        token = jwt_auth.bearer_token(request.headers.get('Authorization'))
+        if token is None:
+            if required and request.path not in jwt_auth.PUBLIC_PATHS:
+                return jsonify({"error": "Authentication required"}), 401
+            return None
+        try:
+            g.user = verifier.verify(token)
+        except jwt_auth.InvalidToken as e:
+            return jsonify({"error": f"Invalid token: {e}"}), 401
+        return None
+
+    return app
+
+
+def current_user_id():
+    """``user_id`` claim of the authenticated caller, or None."""
+    user = g.get('user')
+    return user.get('user_id') if user else None
+
+
+# --- RESPONSES ---
+def not_modified(etag, cache_control):
+    """An empty 304 if the client already has version ``etag``, else None."""
+    tag = responses.matching_tag(etag, request)
+    if tag is None:
+        return None
+    response = Response('', status=304)
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+async def _counted_stream(body, endpoint, encoding):
+    """Re-yield a streamed body, compressed with ``encoding`` if given, counting bytes."""
+    feed, finish = responses.stream_compressor(encoding) if encoding else (None, None)
+    identity = sent = 0
+    try:
+        # Leaving the block closes the original generator (and what it holds)
+        async with body:
+            async for chunk in body:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                identity += len(chunk)
+                if feed is not None:
+                    chunk = feed(chunk)
+                if chunk:
+                    sent += len(chunk)
+                    yield chunk
+        if finish is not None:
+            tail = finish()
+            sent += len(tail)
+            yield tail
+    finally:
+        responses.identity_bytes.inc(endpoint, amount=identity)
+        responses.response_bytes.inc(endpoint, encoding or 'identity', amount=sent)
+
+
+async def finish_response(response):
+    """``responses.finish_response`` for Quart: compress and measure the body."""
+    if request.method == 'HEAD' or response.status_code in (204, 304):
+        return response
+    endpoint = _endpoint()
+    streamed = isinstance(response.response, IterableBody)
+
+    if 'Content-Encoding' in response.headers or response.mimetype not in responses.COMPRESSIBLE:
+        if not streamed:
+            length = response.content_length or 0
+            responses.identity_bytes.inc(endpoint, amount=length)
+            responses.response_bytes.inc(endpoint, response.headers.get('Content-Encoding', 'identity'),
+                                         amount=length)
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = responses.negotiate(request)
+    if streamed:
+        # Size unknown up front: compress as it streams
+        response.response = IterableBody(_counted_stream(response.response, endpoint, encoding))
+        response.headers.pop('Content-Length', None)
+    else:
+        data = await response.get_data()
+        responses.identity_bytes.inc(endpoint, amount=len(data))
+        if encoding is None or len(data) < responses.MIN_SIZE:
+            responses.response_bytes.inc(endpoint, 'identity', amount=len(data))
+            return response
+        response.set_data(responses.compress(data, encoding))
+        responses.response_bytes.inc(endpoint, encoding, amount=response.content_length)
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+def init_compression(app):
+    app.after_request(finish_response)
+    return app
+
+
+# --- IDEMPOTENCY ---
+def idempotent(store, scope=None):
+    """``idempotency.idempotent`` for a Quart view.
+
+    ``store`` must be built with ``flights=AsyncSingleFlight()``. Its
+    get/claim/save/release block on Postgres, so they run on a thread.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            header = request.headers.get(idempotency.HEADER)
+            if not header:
+                return await view(*args, **kwargs)
+            if len(header) > idempotency.MAX_KEY_LENGTH:
+                return jsonify({"error": idempotency.TOO_LONG}), 400
+
+            key = idempotency.request_key(header, scope() if scope is not None else None, request.path)
+            body_fingerprint = idempotency.fingerprint(request.method, request.path, await request.get_data())
+
+            ran = []
+
+            async def first_request():
+                stored = await asyncio.to_thread(store.get, key)
+                if stored is not None:
+                    return stored
+                stored = await asyncio.to_thread(store.claim, key, body_fingerprint)
+                if stored is not None:
+                    return stored
+                ran.append(True)
+                try:
+                    response = await make_response(await view(*args, **kwargs))
+                except Exception:
+                    await asyncio.to_thread(store.release, key)
+                    raise
+                stored = idempotency.StoredResponse(body_fingerprint, response.status_code,
+                                                    await response.get_data(), response.content_type)
+                if response.status_code < 500:
+                    await asyncio.to_thread(store.save, key, stored)
+                else:
+                    await asyncio.to_thread(store.release, key)
+                return stored
+
+            try:
+                stored = await store.flights.do(key, first_request)
+            except idempotency.RequestInProgress:
+                response = jsonify({"error": idempotency.IN_PROGRESS})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+
+            if stored.fingerprint != body_fingerprint:
+                store.conflicts += 1
+                return jsonify({"error": idempotency.REUSED}), 422
+
+            response = Response(stored.body, status=stored.status, content_type=stored.content_type)
+            if not ran:
+                store.replays += 1
+                response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        return wrapper
+
+    return decorator
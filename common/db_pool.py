@@ -0,0 +1,487 @@
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from common import tracing
+
+_STATEMENT_TARGET = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+([\w.]+)', re.IGNORECASE)
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became free within the checkout timeout."""
+
+
+def statement_label(query):
+    """Short, low-cardinality name for a SQL statement, e.g. ``INSERT bookings``."""
+    if not isinstance(query, str):
+        return 'query'
+    words = query.split(None, 1)
+    if not words:
+        return 'query'
+    target = _STATEMENT_TARGET.search(query)
+    return f"{words[0].upper()} {target.group(1)}" if target else words[0].upper()
+
+
+class TracedCursor(extensions.cursor):
+    """Cursor that records every ``execute`` as a ``db`` span."""
+
+    def execute(self, query, vars=None):
+        with tracing.span('db', statement_label(query)):
+            return super().execute(query, vars)
+
+
+class ConnectionPool:
+    """A bounded, thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily (or up front with ``warm()``), health checked
+    when they are handed out and replaced transparently if they turn out to be
+    broken. Callers that find the pool exhausted wait up to ``timeout`` seconds
+    for a connection to be returned before ``PoolTimeout`` is raised.
+    """
+
+    def __init__(self, name='default', minconn=1, maxconn=10, timeout=5.0,
+                 check_after=30.0, **dsn):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Pool sizes must satisfy 0 <= minconn <= maxconn, maxconn >= 1")
+        self.name = name
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        # Idle connections older than this are pinged before being handed out
+        self.check_after = check_after
+        self.dsn = dsn
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = []            # [(connection, returned_at)]
+        self._in_use = set()
+        self._opening = 0          # connections being opened outside the lock
+        self._waiting = 0
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._recycled = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @classmethod
+    def from_env(cls, name='default', **defaults):
+        """Build a pool from the DB_* environment variables used by every service."""
+        return cls(
+            name=name,
+            minconn=int(os.getenv('DB_POOL_MIN', 1)),
+            maxconn=int(os.getenv('DB_POOL_MAX', 10)),
+            timeout=float(os.getenv('DB_POOL_TIMEOUT', 5)),
+            host=os.getenv('DB_HOST', defaults.get('host')),
+            database=os.getenv('DB_NAME', defaults.get('database', 'postgres')),
+            user=os.getenv('DB_USER', defaults.get('user')),
+            password=os.getenv('DB_PASS', defaults.get('password')),
+            port=os.getenv('DB_PORT', defaults.get('port', 5432)),
+            connect_timeout=int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+        )
+
+    # --- CONNECTION LIFECYCLE ---
+    def _connect(self):
+        return psycopg2.connect(cursor_factory=TracedCursor, **self.dsn)
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if idle_for < self.check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self._recycled += 1
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self, timeout=None):
+        """Check out a healthy connection, opening a new one if allowed."""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            with self._lock:
+                conn = None
+                while not self._idle and self._total() >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"No connection available in pool '{self.name}' after {timeout}s"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._available.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    idle_for = time.monotonic() - returned_at
+                    self._in_use.add(conn)
+                else:
+                    self._opening += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opening -= 1
+                        self._available.notify()
+                    raise
+                with self._lock:
+                    self._opening -= 1
+                    self._in_use.add(conn)
+            elif not self._is_healthy(conn, idle_for):
+                # Broken connection: drop it and try again with the same deadline
+                with self._lock:
+                    self._in_use.discard(conn)
+                    self._discard(conn)
+                    self._available.notify()
+                continue
+
+            waited = time.monotonic() - started
+            with self._lock:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """Return a connection, rolling back any transaction left open."""
+        if not close and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    close = True
+
+        with self._lock:
+            self._in_use.discard(conn)
+            if close or conn.closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._available.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """``with pool.connection() as conn:`` - the connection is always returned."""
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def warm(self):
+        """Open connections until ``minconn`` are available."""
+        while True:
+            with self._lock:
+                if self._total() >= self.minconn:
+                    return
+                self._opening += 1
+            try:
+                conn = self._connect()
+            finally:
+                with self._lock:
+                    self._opening -= 1
+            self.putconn(conn)
+
+    def reset(self):
+        """Forget every connection without closing it.
+
+        Used in a freshly forked worker: the sockets belong to the parent
+        process, and closing them here would also end the parent's sessions.
+        """
+        with self._lock:
+            self._idle.clear()
+            self._in_use.clear()
+            self._opening = 0
+            self._available.notify_all()
+
+    def after_fork(self):
+        """Per-worker start-up: drop inherited connections, then pre-open
+        ``minconn`` fresh ones if DB_POOL_WARM=1."""
+        self.reset()
+        if os.getenv('DB_POOL_WARM') == '1':
+            try:
+                self.warm()
+            except psycopg2.Error as e:
+                print(f"⚠️ Could not warm pool '{self.name}': {e}", flush=True)
+
+    def closeall(self):
+        with self._lock:
+            for conn, _ in self._idle:
+                conn.close()
+            self._idle.clear()
+
+    # --- METRICS ---
+    def _total(self):
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    def stats(self):
+        with self._lock:
+            return {
+                "name": self.name,
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._total(),
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "wait_time_avg_ms": round(1000 * self._wait_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "wait_time_max_ms": round(1000 * self._wait_max, 3),
+            }
+
+
+# --- READ REPLICAS ---
+# Whether a replica is still receiving WAL, and how far behind the primary it
+# is, in seconds. A streaming replica that has replayed everything it received
+# is caught up, however old its last replayed transaction is (an idle primary
+# sends nothing new). One whose WAL receiver is gone has replayed everything it
+# will ever get, so the lag it reports means nothing. pg_stat_wal_receiver has
+# a row only while the receiver runs; its status is NULL for roles without
+# pg_read_all_stats, which then only learn that it runs.
+_REPLICA_LAG_SQL = """
+SELECT
+    NOT pg_is_in_recovery() OR EXISTS (
+        SELECT 1 FROM pg_stat_wal_receiver WHERE COALESCE(status, 'streaming') = 'streaming'
+    ),
+    CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class _Replica:
+    def __init__(self, pool):
+        self.pool = pool
+        self.healthy = True
+        self.lag = None
+        self.error = None
+        self.checked_at = None
+        self.reads = 0
+
+
+class ReplicaRouter:
+    """Sends reads to streaming replicas and everything else to the primary.
+
+    ``connection()`` is always the primary. ``read_connection(key)`` picks a
+    replica whose replication lag is at most ``max_lag`` seconds; lag is
+    re-measured at most every ``check_interval`` seconds, by whichever request
+    finds the measurement stale. Reads fall back to the primary when no
+    replica qualifies or the chosen one cannot hand out a connection.
+
+    ``key`` is usually the user id. While the set of healthy replicas stays
+    the same, a key always reads from the same replica, so one user's
+    successive reads do not go back in time. When a replica drops out or comes
+    back, only the keys it serves (rendezvous hashing) move, and they may see
+    a replica that is behind the old one, by at most ``max_lag``.
+
+    For ``read_your_writes`` seconds after a write, the writer reads from the
+    primary. ``wrote(key)`` remembers this in the process. Under several
+    workers the next request may land elsewhere, so the write time also goes
+    back to the client (the booking service's X-Read-After header), and a
+    read passes it back in as ``wrote_at``.
+    """
+
+    def __init__(self, primary, replicas=(), max_lag=5.0, check_interval=5.0,
+                 read_your_writes=None):
+        self.primary = primary
+        self.replicas = [_Replica(pool) for pool in replicas]
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        # A write older than this is on every replica we still read from
+        self.read_your_writes = (max_lag + check_interval if read_your_writes is None
+                                 else read_your_writes)
+
+        self._lock = threading.Lock()
+        self._written = {}         # key -> time of the last write
+        self._next = 0
+        self._primary_reads = 0
+        self._fallbacks = 0
+
+    @classmethod
+    def from_env(cls, primary):
+        """Replicas from DB_REPLICAS: comma-separated libpq URIs or key=value
+        strings; anything they leave out (user, password, ...) is the primary's."""
+        replicas = []
+        for i, dsn in enumerate(filter(None, (s.strip() for s in os.getenv('DB_REPLICAS', '').split(',')))):
+            replicas.append(ConnectionPool(
+                name=f"{primary.name}-replica{i + 1}",
+                minconn=primary.minconn,
+                maxconn=primary.maxconn,
+                timeout=float(os.getenv('DB_REPLICA_TIMEOUT', 1)),
+                check_after=primary.check_after,
+                **dict(primary.dsn, **extensions.parse_dsn(dsn)),
+            ))
+        read_your_writes = os.getenv('DB_READ_YOUR_WRITES')
+        return cls(
+            primary,
+            replicas,
+            max_lag=float(os.getenv('DB_REPLICA_MAX_LAG', 5)),
+            check_interval=float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5)),
+            read_your_writes=float(read_your_writes) if read_your_writes is not None else None,
+        )
+
+    # --- ROUTING ---
+    def connection(self, timeout=None):
+        """The primary, for writes and anything that must see them."""
+        return self.primary.connection(timeout)
+
+    def wrote(self, key):
+        """Pin ``key``'s reads to the primary until replicas have caught up."""
+        if not self.replicas or key is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._written[str(key)] = now
+            if len(self._written) > 10000:
+                horizon = now - self.read_your_writes
+                self._written = {k: t for k, t in self._written.items() if t > horizon}
+
+    def _check(self, replica):
+        try:
+            with replica.pool.connection() as conn, conn.cursor() as cur:
+                cur.execute(_REPLICA_LAG_SQL)
+                streaming, lag = cur.fetchone()
+                conn.rollback()
+            replica.lag = float(lag)
+            replica.error = None if streaming else 'WAL receiver is not streaming'
+            replica.healthy = streaming and replica.lag <= self.max_lag
+        except (psycopg2.Error, PoolTimeout) as e:
+            replica.lag, replica.error, replica.healthy = None, str(e), False
+        if not replica.healthy:
+            tracing.log_event('replica_unhealthy', logging.WARNING, pool=replica.pool.name,
+                              lag=replica.lag, error=replica.error)
+
+    def _healthy(self):
+        now = time.monotonic()
+        stale = []
+        with self._lock:
+            for replica in self.replicas:
+                if replica.checked_at is None or now - replica.checked_at >= self.check_interval:
+                    # Claimed: concurrent requests keep using the last result
+                    replica.checked_at = now
+                    stale.append(replica)
+        for replica in stale:
+            self._check(replica)
+        return [replica for replica in self.replicas if replica.healthy]
+
+    def _pick(self, key, wrote_at=None):
+        if not self.replicas:
+            return None
+        if wrote_at is not None and time.time() - wrote_at < self.read_your_writes:
+            return None
+        if key is not None:
+            with self._lock:
+                written = self._written.get(str(key))
+            if written is not None and time.monotonic() - written < self.read_your_writes:
+                return None
+        healthy = self._healthy()
+        if not healthy:
+            return None
+        if key is not None:
+            # Highest score wins: a replica leaving only moves the keys it had
+            return max(healthy, key=lambda replica: zlib.crc32(f"{key}|{replica.pool.name}".encode('utf-8')))
+        with self._lock:
+            self._next += 1
+            return healthy[self._next % len(healthy)]
+
+    @contextmanager
+    def read_connection(self, key=None, timeout=None, wrote_at=None):
+        """A replica connection for a read that may lag by up to ``max_lag``.
+
+        ``wrote_at`` is the (wall clock) time of the caller's last write, if
+        the client told us; until replicas have caught up, that is the primary.
+        """
+        replica = self._pick(key, wrote_at)
+        conn = None
+        if replica is not None:
+            try:
+                conn = replica.pool.getconn(timeout)
+                replica.reads += 1
+            except (psycopg2.OperationalError, PoolTimeout) as e:
+                replica.healthy, replica.error = False, str(e)
+                self._fallbacks += 1
+                tracing.log_event('replica_fallback', logging.WARNING, pool=replica.pool.name, error=str(e))
+                replica = None
+        if replica is None:
+            self._primary_reads += 1
+            with self.primary.connection(timeout) as conn:
+                yield conn
+            return
+
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            broken = True
+            replica.healthy, replica.error = False, str(e)
+            raise
+        finally:
+            replica.pool.putconn(conn, close=broken)
+
+    def reads(self, key=None):
+        """Pool-like view whose ``connection()`` is ``read_connection(key)``,
+        for readers written against a pool (e.g. RoomCatalog)."""
+        return _ReadView(self, key)
+
+    # --- LIFECYCLE ---
+    def after_fork(self):
+        self.primary.after_fork()
+        for replica in self.replicas:
+            replica.pool.after_fork()
+            replica.checked_at = None
+        with self._lock:
+            self._written.clear()
+
+    def stats(self):
+        return {
+            "max_lag": self.max_lag,
+            "read_your_writes": self.read_your_writes,
+            "primary_reads": self._primary_reads,
+            "fallbacks": self._fallbacks,
+            "replicas": [dict(replica.pool.stats(), healthy=replica.healthy, lag=replica.lag,
+                              error=replica.error, reads=replica.reads)
+                         for replica in self.replicas],
+        }
+
+
+class _ReadView:
+    def __init__(self, router, key):
+        self.router = router
+        self.key = key
+
+    def connection(self, timeout=None):
+        return self.router.read_connection(self.key, timeout)
@@ -0,0 +1,250 @@
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from common import tracing
+
+
+class ServiceUnavailable(Exception):
+    """Raised when a dependency failed every attempt or its breaker is open."""
+
+
+class CircuitBreaker:
+    """Stops calling a dependency after repeated failures.
+
+    After ``failure_threshold`` consecutive failures the breaker opens and every
+    call fails fast for ``reset_timeout`` seconds. It then lets a single trial
+    call through (half-open); success closes it again, failure re-opens it.
+    Every ``allow()`` that returned True must end in ``record_success()``,
+    ``record_failure()`` or ``release()``, or no further trial is let through.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # Half-open: only one trial request at a time
+            if self._trial_running:
+                return False
+            self._state = self.HALF_OPEN
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_running = False
+
+    def release(self):
+        """End a call that was interrupted before it had an outcome (e.g.
+        cancelled), freeing the half-open trial without judging the dependency."""
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._times_opened += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "times_opened": self._times_opened,
+            }
+
+
+class LatencyHistogram:
+    """Cumulative request latency histogram with fixed millisecond buckets."""
+
+    BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self, buckets_ms=BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets_ms) + 1)
+        self._count = 0
+        self._sum_ms = 0.0
+
+    def observe(self, seconds):
+        ms = seconds * 1000
+        with self._lock:
+            self._count += 1
+            self._sum_ms += ms
+            for i, bound in enumerate(self.buckets_ms):
+                if ms <= bound:
+                    self._counts[i] += 1
+                    break
+            else:
+                self._counts[-1] += 1
+
+    def stats(self):
+        with self._lock:
+            buckets, running = {}, 0
+            for bound, count in zip(self.buckets_ms, self._counts):
+                running += count
+                buckets[f"le_{bound}ms"] = running
+            buckets["le_inf"] = running + self._counts[-1]
+            return {
+                "count": self._count,
+                "avg_ms": round(self._sum_ms / self._count, 3) if self._count else 0.0,
+                "buckets": buckets,
+            }
+
+
+def with_trace_header(headers):
+    """Copy of ``headers`` carrying the current request's trace ID, if any."""
+    headers = dict(headers or {})
+    trace_id = tracing.current_trace_id()
+    if trace_id and tracing.TRACE_HEADER not in headers:
+        headers[tracing.TRACE_HEADER] = trace_id
+    return headers
+
+
+class ServiceClient:
+    """Keep-alive HTTP client for one downstream service.
+
+    Wraps a pooled ``requests.Session`` with connect/read timeouts, bounded
+    retries with jittered exponential backoff and a circuit breaker.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=1.0, read_timeout=3.0,
+                 retries=2, backoff=0.05, pool_size=20, breaker=None):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyHistogram()
+
+        self.pool_size = pool_size
+        self.session = self._new_session()
+
+    @classmethod
+    def from_env(cls, name, prefix, default_url):
+        """Read ``<PREFIX>_URL``, ``<PREFIX>_CONNECT_TIMEOUT``, ``<PREFIX>_READ_TIMEOUT``,
+        ``<PREFIX>_RETRIES``, ``<PREFIX>_BREAKER_THRESHOLD`` and ``<PREFIX>_BREAKER_RESET``."""
+        return cls(
+            name,
+            os.getenv(f'{prefix}_URL', default_url),
+            connect_timeout=float(os.getenv(f'{prefix}_CONNECT_TIMEOUT', 1.0)),
+            read_timeout=float(os.getenv(f'{prefix}_READ_TIMEOUT', 3.0)),
+            retries=int(os.getenv(f'{prefix}_RETRIES', 2)),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv(f'{prefix}_BREAKER_THRESHOLD', 5)),
+                reset_timeout=float(os.getenv(f'{prefix}_BREAKER_RESET', 30)),
+            ),
+        )
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def reset(self):
+        """Start a fresh session (e.g. in a forked worker) without touching the old sockets."""
+        self.session = self._new_session()
+
+    def _sleep_before_retry(self, attempt):
+        # Full jitter: spread retries out so callers don't retry in lockstep
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def request(self, method, path, idempotent=None, **kwargs):
+        """Send a request; 5xx responses and connection errors are retried.
+
+        Only idempotent requests are retried (GET/HEAD by default, or pass
+        ``idempotent=True`` for a POST that is safe to repeat). Returns the
+        final ``requests.Response`` (which may still be a 4xx) or raises
+        ``ServiceUnavailable``.
+        """
+        if not self.breaker.allow():
+            raise ServiceUnavailable(f"{self.name} circuit breaker is open")
+        try:
+            response = self._send(method, path, idempotent, **kwargs)
+        except Exception:
+            # ServiceUnavailable, but also anything that is not a network
+            # error (a bad URL, a body that cannot be encoded, ...)
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            self.breaker.release()
+            raise
+        self.breaker.record_success()
+        return response
+
+    def _send(self, method, path, idempotent, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        kwargs['headers'] = with_trace_header(kwargs.get('headers'))
+        url = f"{self.base_url}{path}"
+        if idempotent is None:
+            idempotent = method in ('GET', 'HEAD')
+        attempts = self.retries + 1 if idempotent else 1
+        last_error = None
+
+        for attempt in range(attempts):
+            if attempt:
+                self._sleep_before_retry(attempt - 1)
+            started = time.monotonic()
+            try:
+                with tracing.span('http', f"{self.name} {method}"):
+                    response = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                last_error = e
+                continue
+            finally:
+                self.latency.observe(time.monotonic() - started)
+
+            if response.status_code < 500:
+                return response
+            last_error = f"HTTP {response.status_code}"
+
+        raise ServiceUnavailable(f"{self.name} unavailable: {last_error}")
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "circuit_breaker": self.breaker.stats(),
+            "latency": self.latency.stats(),
+        }
@@ -0,0 +1,237 @@
+"""``Idempotency-Key`` support for POST endpoints.
+
+A client that retries a request with the same ``Idempotency-Key`` header gets
+the first response back (with ``Idempotent-Replayed: true``) instead of the
+request running again. Responses are kept in an in-process LRU+TTL cache and,
+when a connection pool is given, in the ``idempotency_keys`` table so every
+worker and replica sees them (see booking_service/init_db.py).
+
+Duplicates that arrive while the first request is still running wait for it:
+inside one process they share the original call, across processes they poll
+the table until the first one has stored its response (up to ``wait``
+seconds, then 409). 5xx responses are not stored, so those can be retried.
+Reusing a key with a different request body is a 422.
+"""
+import hashlib
+import os
+import random
+import time
+from collections import namedtuple
+from functools import wraps
+
+from common.cache import SingleFlight, TTLCache
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+StoredResponse = namedtuple('StoredResponse', 'fingerprint status body content_type')
+
+
+class RequestInProgress(Exception):
+    """The first request with this key is still running in another process."""
+
+
+class IdempotencyStore:
+    """Stored responses by idempotency key, in memory and optionally in Postgres."""
+
+    def __init__(self, pool=None, ttl=86400.0, cache_size=10000, wait=10.0,
+                 pending_ttl=60.0, poll_interval=0.05, flights=None):
+        self.pool = pool
+        self.ttl = ttl
+        self.wait = wait
+        # A claim whose owner died is taken over after this long
+        self.pending_ttl = pending_ttl
+        self.poll_interval = poll_interval
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        # AsyncSingleFlight under the Quart decorator in common/async_web.py
+        self.flights = flights or SingleFlight()
+        self.replays = 0
+        self.conflicts = 0
+
+    @classmethod
+    def from_env(cls, pool=None, flights=None):
+        """IDEMPOTENCY_BACKEND=postgres stores responses in ``pool`` as well."""
+        backend = os.getenv('IDEMPOTENCY_BACKEND', 'memory')
+        return cls(
+            pool=pool if backend == 'postgres' else None,
+            flights=flights,
+            ttl=float(os.getenv('IDEMPOTENCY_TTL', 86400)),
+            cache_size=int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000)),
+            wait=float(os.getenv('IDEMPOTENCY_WAIT', 10)),
+        )
+
+    # --- POSTGRES ---
+    def _fetch(self, cur, key):
+        cur.execute(
+            "SELECT fingerprint, status_code, body, content_type FROM idempotency_keys "
+            "WHERE key = %s AND expires_at > now()",
+            (key,)
+        )
+        row = cur.fetchone()
+        if row is None or row[1] is None:
+            return row and 'pending'
+        return StoredResponse(row[0], row[1], bytes(row[2]), row[3])
+
+    def get(self, key):
+        stored = self.cache.get(key)
+        if stored is not None or self.pool is None:
+            return stored
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            stored = self._fetch(cur, key)
+            conn.commit()
+        if isinstance(stored, StoredResponse):
+            self.cache.set(key, stored)
+            return stored
+        return None
+
+    def claim(self, key, fingerprint):
+        """Reserve ``key`` for this request.
+
+        Returns None when the caller should run the request, or the stored
+        response if another process finished it meanwhile. Raises
+        ``RequestInProgress`` if the other process is still busy after ``wait``.
+        """
+        if self.pool is None:
+            return None
+        deadline = time.monotonic() + self.wait
+        while True:
+            with self.pool.connection() as conn, conn.cursor() as cur:
+                if random.random() < 0.01:
+                    cur.execute("DELETE FROM idempotency_keys WHERE expires_at < now()")
+                # Take the key if it is new, or if its previous holder expired
+                cur.execute(
+                    """
+                    INSERT INTO idempotency_keys (key, fingerprint, expires_at)
+                    VALUES (%s, %s, now() + make_interval(secs => %s))
+                    ON CONFLICT (key) DO UPDATE
+                        SET fingerprint = EXCLUDED.fingerprint, status_code = NULL,
+                            body = NULL, content_type = NULL, expires_at = EXCLUDED.expires_at
+                        WHERE idempotency_keys.expires_at <= now()
+                    RETURNING key;
+                    """,
+                    (key, fingerprint, self.pending_ttl)
+                )
+                claimed = cur.fetchone() is not None
+                stored = None if claimed else self._fetch(cur, key)
+                conn.commit()
+            if claimed:
+                return None
+            if isinstance(stored, StoredResponse):
+                self.cache.set(key, stored)
+                return stored
+            if time.monotonic() >= deadline:
+                raise RequestInProgress(key)
+            time.sleep(self.poll_interval)
+
+    def save(self, key, stored):
+        self.cache.set(key, stored)
+        if self.pool is None:
+            return
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                """
+                UPDATE idempotency_keys
+                SET status_code = %s, body = %s, content_type = %s,
+                    expires_at = now() + make_interval(secs => %s)
+                WHERE key = %s;
+                """,
+                (stored.status, stored.body, stored.content_type, self.ttl, key)
+            )
+            conn.commit()
+
+    def release(self, key):
+        """Give up a claim without storing a response (e.g. after a 5xx)."""
+        if self.pool is None:
+            return
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            cur.execute("DELETE FROM idempotency_keys WHERE key = %s AND status_code IS NULL", (key,))
+            conn.commit()
+
+    def stats(self):
+        return {
+            "backend": "postgres" if self.pool is not None else "memory",
+            "replays": self.replays,
+            "conflicts": self.conflicts,
+            "in_flight_coalesced": self.flights.coalesced,
+            "cache": self.cache.stats(),
+        }
+
+
+def request_key(header, owner, path):
+    """Storage key: the caller's scope, the endpoint and the client's key."""
+    return f"{owner if owner is not None else '-'}:{path}:{header}"
+
+
+def fingerprint(method, path, body):
+    return hashlib.sha256(method.encode() + b' ' + path.encode() + b'\n' + body).hexdigest()
+
+
+TOO_LONG = f"{HEADER} must be at most {MAX_KEY_LENGTH} characters"
+IN_PROGRESS = f"A request with this {HEADER} is still in progress"
+REUSED = f"{HEADER} was already used for a different request"
+
+
+def idempotent(store, scope=None):
+    """Decorator for a Flask view: replay responses for repeated ``Idempotency-Key``s.
+
+    ``scope()`` (e.g. the authenticated user id) is folded into the key so two
+    callers cannot see each other's responses.
+    """
+    from flask import jsonify, make_response, request
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            header = request.headers.get(HEADER)
+            if not header:
+                return view(*args, **kwargs)
+            if len(header) > MAX_KEY_LENGTH:
+                return jsonify({"error": TOO_LONG}), 400
+
+            key = request_key(header, scope() if scope is not None else None, request.path)
+            body_fingerprint = fingerprint(request.method, request.path, request.get_data())
+
+            ran = []
+
+            def first_request():
+                stored = store.get(key)
+                if stored is not None:
+                    return stored
+                stored = store.claim(key, body_fingerprint)
+                if stored is not None:
+                    return stored
+                ran.append(True)
+                try:
+                    response = make_response(view(*args, **kwargs))
+                except Exception:
+                    store.release(key)
+                    raise
+                stored = StoredResponse(body_fingerprint, response.status_code,
+                                        response.get_data(), response.content_type)
+                if response.status_code < 500:
+                    store.save(key, stored)
+                else:
+                    store.release(key)
+                return stored
+
+            try:
+                stored = store.flights.do(key, first_request)
+            except RequestInProgress:
+                response = jsonify({"error": IN_PROGRESS})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+
+            if stored.fingerprint != body_fingerprint:
+                store.conflicts += 1
+                return jsonify({"error": REUSED}), 422
+
+            response = make_response(stored.body, stored.status)
+            response.content_type = stored.content_type
+            if not ran:
+                store.replays += 1
+                response.headers['Idempotent-Replayed'] = 'true'
+            return response
+
+        return wrapper
+
+    return decorator
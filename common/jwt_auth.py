@@ -0,0 +1,207 @@
+"""Local verification of the HS256 tokens issued by auth_service.
+
+Services check ``Authorization: Bearer <token>`` themselves, with no call to
+auth_service or the database:
+
+* ``KeySet`` holds the signing keys by ``kid``. Keys come from JWT_KEYS_FILE
+  (a JSON object ``{"kid": "secret"}``, re-read when it changes), JWT_KEYS
+  (``kid1:secret1,kid2:secret2``) and JWT_SECRET (kid ``default``).
+  JWT_ACTIVE_KID picks the key new tokens are signed with. To rotate, add
+  the new key everywhere, switch JWT_ACTIVE_KID on auth_service, and drop
+  the old key once its tokens have expired.
+* ``TokenVerifier`` caches decoded claims per token until the token expires
+  (capped by JWT_CACHE_TTL), so a repeat request costs a dict lookup.
+* ``init_app`` puts the claims on ``flask.g.user``. A bad token is always a
+  401; a missing token is only rejected when JWT_REQUIRED=1.
+"""
+import json
+import os
+import threading
+import time
+
+import jwt
+
+from common.cache import TTLCache
+
+ALGORITHM = 'HS256'
+DEFAULT_KID = 'default'
+
+# Paths that never need a token
+PUBLIC_PATHS = ('/health', '/metrics', '/login')
+
+
+class InvalidToken(Exception):
+    """Raised when a bearer token is malformed, expired or wrongly signed."""
+
+
+class KeySet:
+    """Signing keys by kid, refreshed from JWT_KEYS_FILE at most every ``refresh_every`` seconds."""
+
+    def __init__(self, keys=None, active_kid=None, path=None, refresh_every=30.0):
+        self._static = dict(keys or {})
+        self.active_kid = active_kid
+        self.path = path
+        self.refresh_every = refresh_every
+        self._lock = threading.Lock()
+        self._keys = dict(self._static)
+        self._mtime = None
+        self._checked_at = 0.0
+        self.version = 0            # bumped whenever the keys change
+        self.refresh(force=True)
+
+    @classmethod
+    def from_env(cls):
+        keys = {}
+        if os.getenv('JWT_SECRET'):
+            keys[DEFAULT_KID] = os.getenv('JWT_SECRET')
+        for pair in filter(None, os.getenv('JWT_KEYS', '').split(',')):
+            kid, _, secret = pair.partition(':')
+            keys[kid.strip()] = secret.strip()
+        return cls(
+            keys,
+            active_kid=os.getenv('JWT_ACTIVE_KID'),
+            path=os.getenv('JWT_KEYS_FILE'),
+            refresh_every=float(os.getenv('JWT_KEYS_REFRESH', 30)),
+        )
+
+    def refresh(self, force=False):
+        """Re-read the key file if it changed; returns True when the keys changed."""
+        if not self.path:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if not force and now - self._checked_at < self.refresh_every:
+                return False
+            self._checked_at = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime == self._mtime:
+                    return False
+                with open(self.path) as f:
+                    loaded = json.load(f)
+            except (OSError, ValueError):
+                # Keep serving with the keys we have
+                return False
+            self._mtime = mtime
+            keys = dict(self._static, **loaded)
+            if keys == self._keys:
+                return False
+            self._keys = keys
+            self.version += 1
+            return True
+
+    def get(self, kid):
+        self.refresh()
+        return self._keys.get(kid or DEFAULT_KID)
+
+    def signing_key(self):
+        """(kid, secret) for new tokens: JWT_ACTIVE_KID, else the default key."""
+        self.refresh()
+        kid = self.active_kid or DEFAULT_KID
+        secret = self._keys.get(kid)
+        if secret is None:
+            raise RuntimeError(f"No signing key for kid '{kid}'")
+        return kid, secret
+
+    def kids(self):
+        return sorted(self._keys)
+
+
+class TokenVerifier:
+    """Verifies bearer tokens against a ``KeySet`` and caches the claims."""
+
+    def __init__(self, keys, cache_size=10000, max_cache_ttl=300.0, leeway=0):
+        self.keys = keys
+        self.max_cache_ttl = max_cache_ttl
+        self.leeway = leeway
+        self.cache = TTLCache(maxsize=cache_size, ttl=max_cache_ttl)
+        self._keys_version = keys.version
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            KeySet.from_env(),
+            cache_size=int(os.getenv('JWT_CACHE_SIZE', 10000)),
+            max_cache_ttl=float(os.getenv('JWT_CACHE_TTL', 300)),
+        )
+
+    def verify(self, token):
+        """Return the token's claims or raise ``InvalidToken``."""
+        # Cache hits never reach keys.get(), so look for key changes here
+        self.keys.refresh()
+        if self.keys.version != self._keys_version:
+            # A key may have been withdrawn: re-verify everything
+            self.cache.clear()
+            self._keys_version = self.keys.version
+
+        # Entries expire with the token, so a hit is still valid
+        claims = self.cache.get(token)
+        if claims is not None:
+            return claims
+
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+            secret = self.keys.get(kid)
+            if secret is None and self.keys.refresh(force=True):
+                secret = self.keys.get(kid)
+            if secret is None:
+                raise InvalidToken(f"Unknown signing key '{kid}'")
+            claims = jwt.decode(token, secret, algorithms=[ALGORITHM], leeway=self.leeway)
+        except jwt.PyJWTError as e:
+            raise InvalidToken(str(e))
+
+        ttl = self.max_cache_ttl
+        if claims.get('exp') is not None:
+            ttl = min(ttl, claims['exp'] - time.time())
+        if ttl > 0:
+            self.cache.set(token, claims, ttl=ttl)
+        return claims
+
+    def stats(self):
+        return {"kids": self.keys.kids(), "cache": self.cache.stats()}
+
+
+def bearer_token(header):
+    scheme, _, token = (header or '').partition(' ')
+    if scheme.lower() != 'bearer' or not token.strip():
+        return None
+    return token.strip()
+
+
+def init_app(app, verifier, required=None, is_public=None):
+    """Authenticate every request of ``app``; claims end up on ``g.user``.
+
+    ``is_public(request)`` may exempt more requests than PUBLIC_PATHS from
+    JWT_REQUIRED (a token that is sent is still checked).
+    """
+    from flask import g, jsonify, request
+
+    if required is None:
+        required = os.getenv('JWT_REQUIRED', '0') == '1'
+
+    @app.before_request
+    def authenticate():
+        g.user = None
+        if request.method == 'OPTIONS':
+            return None
+        token = bearer_token(request.headers.get('Authorization'))
+        if token is None:
+            public = request.path in PUBLIC_PATHS or (is_public is not None and is_public(request))
+            if required and not public:
+                return jsonify({"error": "Authentication required"}), 401
+            return None
+        try:
+            g.user = verifier.verify(token)
+        except InvalidToken as e:
+            return jsonify({"error": f"Invalid token: {e}"}), 401
+        return None
+
+    return app
+
+
+def current_user_id():
+    """``user_id`` claim of the authenticated caller, or None."""
+    from flask import g
+
+    user = g.get('user')
+    return user.get('user_id') if user else None
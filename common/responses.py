@@ -0,0 +1,227 @@
+"""Shared HTTP response layer: compression, version ETags and Cache-Control.
+
+``init_app(app)`` compresses responses on the way out: gzip always, brotli
+when the optional ``brotli`` package is installed, picked from the client's
+Accept-Encoding. Bodies under RESPONSE_COMPRESS_MIN_BYTES are sent as they
+are (a packet is a packet), streamed JSON is compressed chunk by chunk, and
+Server-Sent Events are never compressed (each event must leave right away).
+
+Views with a data version (the room catalog version, a user's change log)
+answer through ``cached_json`` / ``not_modified``: the ETag is the version,
+so a client holding it gets an empty 304 without the body being built. A
+compressed body carries the ETag plus "-gzip" / "-br", as a different
+representation of the same version must.
+
+Bytes before and after compression are counted per endpoint on /metrics
+(http_response_identity_bytes_total, http_response_bytes_total).
+
+``negotiate`` and ``matching_tag`` take the request to use, so the Quart
+integration in common/async_web.py shares them.
+"""
+import json
+import os
+import threading
+import zlib
+
+from flask import Response, request
+
+from common import tracing
+
+try:
+    import brotli
+except ImportError:  # optional: responses are gzip-compressed only
+    brotli = None
+
+MIN_SIZE = int(os.getenv('RESPONSE_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.getenv('RESPONSE_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('RESPONSE_BROTLI_QUALITY', 5))
+# Precomputed bodies are compressed once per version, so take the best ratio
+PRECOMPUTED_GZIP_LEVEL = 9
+PRECOMPUTED_BROTLI_QUALITY = 11
+
+# Server preference when the client accepts several with the same q-value
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+COMPRESSIBLE = ('application/json', 'text/html', 'text/plain', 'text/css', 'application/javascript')
+
+response_bytes = tracing.register(tracing.Counter(
+    'http_response_bytes_total', 'Response body bytes sent, by content encoding.', ('endpoint', 'encoding')
+))
+identity_bytes = tracing.register(tracing.Counter(
+    'http_response_identity_bytes_total', 'Response body bytes before compression.', ('endpoint',)
+))
+
+
+# --- ENCODINGS ---
+def compress(data, encoding, precomputed=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=PRECOMPUTED_BROTLI_QUALITY if precomputed else BROTLI_QUALITY)
+    level = PRECOMPUTED_GZIP_LEVEL if precomputed else GZIP_LEVEL
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)     # wbits 31: gzip container
+    return compressor.compress(data) + compressor.flush()
+
+
+def stream_compressor(encoding):
+    """(feed, finish) functions for compressing a body chunk by chunk."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def negotiate(req=request):
+    """The content coding to use for this request, or None for identity."""
+    return req.accept_encodings.best_match(ENCODINGS)
+
+
+def _endpoint():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+# --- PRECOMPUTED BODIES ---
+class Body:
+    """One serialized body and its compressed variants, each built at most once."""
+
+    def __init__(self, data, mimetype='application/json'):
+        self.data = data
+        self.mimetype = mimetype
+        self._variants = {None: data}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def json(cls, payload):
+        return cls(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+
+    def variant(self, encoding):
+        if encoding is None or len(self.data) < MIN_SIZE:
+            return None, self.data
+        with self._lock:
+            if encoding not in self._variants:
+                self._variants[encoding] = compress(self.data, encoding, precomputed=True)
+            return encoding, self._variants[encoding]
+
+
+# --- CONDITIONAL REQUESTS ---
+def matching_tag(etag, req=request):
+    """The If-None-Match tag naming version ``etag`` in any encoding, or None."""
+    tags = req.if_none_match
+    if not tags:
+        return None
+    if tags.star_tag:
+        return etag
+    for tag in [etag] + [f"{etag}-{encoding}" for encoding in ('br', 'gzip')]:
+        if tags.contains_weak(tag):
+            return tag
+    return None
+
+
+def not_modified(etag, cache_control):
+    """An empty 304 if the client already has version ``etag``, else None."""
+    tag = matching_tag(etag)
+    if tag is None:
+        return None
+    response = Response(status=304)
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def with_validators(response, etag, cache_control):
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def cached_json(etag, build, cache_control, bodies=None):
+    """Serve ``build()`` as JSON under version ``etag``.
+
+    Nothing is built for a 304. With a ``bodies`` cache (a TTLCache keyed by
+    ETag) the serialized body and its compressed variants are made once per
+    version and shared by every request for it.
+    """
+    response = not_modified(etag, cache_control)
+    if response is not None:
+        return response
+    body = bodies.get(etag) if bodies is not None else None
+    if body is None:
+        body = Body.json(build())
+        if bodies is not None:
+            bodies.set(etag, body)
+
+    encoding, data = body.variant(negotiate())
+    response = Response(data, mimetype=body.mimetype)
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    with_validators(response, f"{etag}-{encoding}" if encoding else etag, cache_control)
+    response.identity_length = len(body.data)
+    return response
+
+
+# --- COMPRESSION ON THE WAY OUT ---
+def _counted_stream(chunks, endpoint, encoding):
+    """Re-yield a streamed body, compressed with ``encoding`` if given, counting bytes."""
+    feed, finish = stream_compressor(encoding) if encoding else (None, None)
+    identity = sent = 0
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            identity += len(chunk)
+            if feed is not None:
+                chunk = feed(chunk)
+            if chunk:
+                sent += len(chunk)
+                yield chunk
+        if finish is not None:
+            tail = finish()
+            sent += len(tail)
+            yield tail
+    finally:
+        # Closing the original generator releases whatever it holds (e.g. a DB cursor)
+        if hasattr(chunks, 'close'):
+            chunks.close()
+        identity_bytes.inc(endpoint, amount=identity)
+        response_bytes.inc(endpoint, encoding or 'identity', amount=sent)
+
+
+def finish_response(response):
+    if request.method == 'HEAD' or response.status_code in (204, 304) or response.direct_passthrough:
+        return response
+    endpoint = _endpoint()
+
+    if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE:
+        if not response.is_streamed:
+            identity_bytes.inc(endpoint, amount=getattr(response, 'identity_length', response.content_length or 0))
+            response_bytes.inc(endpoint, response.headers.get('Content-Encoding', 'identity'),
+                               amount=response.content_length or 0)
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate()
+    if response.is_streamed:
+        # Size unknown up front: compress as it streams
+        response.response = _counted_stream(response.response, endpoint, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        identity_bytes.inc(endpoint, amount=len(data))
+        if encoding is None or len(data) < MIN_SIZE:
+            response_bytes.inc(endpoint, 'identity', amount=len(data))
+            return response
+        response.set_data(compress(data, encoding))
+        response_bytes.inc(endpoint, encoding, amount=len(response.get_data()))
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+
+def init_app(app):
+    """Compress and measure every response of ``app``."""
+    app.after_request(finish_response)
+    return app
@@ -0,0 +1,136 @@
+import threading
+import time
+import zlib
+from collections import namedtuple
+
+import psycopg2
+
+# One immutable view of the rooms table. `rooms` keeps the GET /rooms order.
+CatalogSnapshot = namedtuple('CatalogSnapshot', ['version', 'rooms', 'by_id', 'etag', 'loaded_at'])
+
+
+class RoomCatalog:
+    """In-memory copy of the `rooms` table.
+
+    The table changes a few times a year, so rooms are served from memory.
+    Every `ttl` seconds the catalog compares its version with the
+    `room_catalog_version` counter (bumped by a trigger on `rooms`, see
+    room_service/init_db.py) and only reloads the rows when it has moved.
+    `invalidate()` forces a re-check on the next read of this process only;
+    `bump()` moves the shared counter, which every process (each gunicorn
+    worker, booking_service's copy) picks up at its next check.
+    """
+
+    def __init__(self, pool, ttl=60.0, miss_recheck=1.0):
+        self.pool = pool
+        self.ttl = ttl
+        # Unknown ids re-check the version, but at most this often
+        self.miss_recheck = miss_recheck
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._reloads = 0
+        self._version_checks = 0
+
+    # --- LOADING ---
+    def _current_version(self, cur):
+        try:
+            cur.execute('SELECT version FROM room_catalog_version')
+            row = cur.fetchone()
+            return row[0] if row else 0
+        except psycopg2.errors.UndefinedTable:
+            # Database created before the version counter existed
+            cur.connection.rollback()
+            return None
+
+    def _load(self, cur, version):
+        cur.execute(
+            'SELECT id, name, capacity, location, price_per_hour FROM rooms '
+            'ORDER BY location, price_per_hour;'
+        )
+        rooms = [{
+            "id": r[0],
+            "name": r[1],
+            "capacity": r[2],
+            "location": r[3],
+            "price_per_hour": float(r[4])
+        } for r in cur.fetchall()]
+        if version is None:
+            # No counter: derive a version from the content instead
+            version = zlib.crc32(repr(rooms).encode('utf-8'))
+        self._reloads += 1
+        return CatalogSnapshot(
+            version=version,
+            rooms=rooms,
+            by_id={room["id"]: room for room in rooms},
+            etag=f"rooms-v{version}",
+            loaded_at=time.time(),
+        )
+
+    def _refresh(self):
+        with self.pool.connection() as conn, conn.cursor() as cur:
+            self._version_checks += 1
+            version = self._current_version(cur)
+            if self._snapshot is None or version is None or version != self._snapshot.version:
+                snapshot = self._load(cur, version)
+                if self._snapshot is None or snapshot.version != self._snapshot.version:
+                    self._snapshot = snapshot
+        self._checked_at = time.monotonic()
+
+    def snapshot(self, max_age=None):
+        """Return the current snapshot, re-checking the version if it is stale."""
+        max_age = self.ttl if max_age is None else max_age
+        if self._snapshot is not None and time.monotonic() - self._checked_at < max_age:
+            return self._snapshot
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._snapshot is None or time.monotonic() - self._checked_at >= max_age:
+                self._refresh()
+            return self._snapshot
+
+    # --- LOOKUPS ---
+    def all(self):
+        return self.snapshot().rooms
+
+    def get(self, room_id):
+        try:
+            room_id = int(room_id)
+        except (TypeError, ValueError):
+            return None
+        room = self.snapshot().by_id.get(room_id)
+        if room is None:
+            # Maybe it was added since our last check
+            room = self.snapshot(max_age=self.miss_recheck).by_id.get(room_id)
+        return room
+
+    def invalidate(self):
+        self._checked_at = 0.0
+
+    def bump(self, pool):
+        """Move ``room_catalog_version`` on ``pool`` (the primary) as the
+        trigger does, e.g. after editing rooms with triggers disabled.
+
+        Returns the new version, or None if the database has no counter (then
+        every check reloads the rows anyway).
+        """
+        with pool.connection() as conn, conn.cursor() as cur:
+            try:
+                cur.execute('UPDATE room_catalog_version SET version = version + 1 RETURNING version')
+            except psycopg2.errors.UndefinedTable:
+                conn.rollback()
+                version = None
+            else:
+                version = cur.fetchone()[0]
+                conn.commit()
+        self.invalidate()
+        return version
+
+    def stats(self):
+        snapshot = self._snapshot
+        return {
+            "version": snapshot.version if snapshot else None,
+            "rooms": len(snapshot.rooms) if snapshot else 0,
+            "reloads": self._reloads,
+            "version_checks": self._version_checks,
+            "ttl": self.ttl,
+        }
@@ -0,0 +1,20 @@
+"""Hooks for running the services under gunicorn (see gunicorn.conf.py).
+
+With ``preload_app`` the app module is imported once in the gunicorn master
+and workers are forked from it, sharing its memory copy-on-write. Anything
+holding sockets (DB pools, HTTP sessions) must not be shared across that fork,
+so each service registers hooks that give every worker its own.
+"""
+
+_worker_start_hooks = []
+
+
+def on_worker_start(fn):
+    """Register ``fn`` to run in each worker process right after it is forked."""
+    _worker_start_hooks.append(fn)
+    return fn
+
+
+def run_worker_start_hooks():
+    for fn in _worker_start_hooks:
+        fn()
@@ -0,0 +1,517 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import jwt
+import psycopg2
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from psycopg2 import extensions
+from common.db_pool import ConnectionPool, PoolTimeout, ReplicaRouter
+from common.http_client import CircuitBreaker, ServiceClient, ServiceUnavailable
+try:
+    from common.async_http_client import AsyncServiceClient
+except ImportError:  # httpx is only in booking_service/requirements-async.txt
+    AsyncServiceClient = None
+from common.cache import AsyncSingleFlight, SingleFlight, TTLCache
+from common.room_catalog import RoomCatalog
+from common import tracing
+from common.db_pool import statement_label
+from common.jwt_auth import InvalidToken, KeySet, TokenVerifier
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = ConnectionPool(name='test', minconn=1, maxconn=2, timeout=0.2)
+        patcher = mock.patch.object(self.pool, '_connect', side_effect=FakeConnection)
+        self.connect = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_connections_are_reused(self):
+        """A returned connection is handed out again instead of reconnecting"""
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(self.connect.call_count, 1)
+
+    def test_pool_is_bounded(self):
+        """Checkouts beyond maxconn wait and then time out"""
+        self.pool.getconn()
+        self.pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            self.pool.getconn()
+        self.assertEqual(self.pool.stats()['timeouts'], 1)
+
+    def test_waiter_gets_returned_connection(self):
+        """A blocked checkout is woken up when a connection is returned"""
+        first = self.pool.getconn()
+        self.pool.getconn()
+        threading.Timer(0.05, self.pool.putconn, args=(first,)).start()
+        self.assertIs(self.pool.getconn(timeout=1), first)
+
+    def test_broken_connections_are_recycled(self):
+        """Closed connections are dropped on checkout and replaced"""
+        conn = self.pool.getconn()
+        self.pool.putconn(conn)
+        conn.closed = 1
+        replacement = self.pool.getconn()
+        self.assertIsNot(replacement, conn)
+        self.assertEqual(self.pool.stats()['recycled'], 1)
+
+    def test_open_transaction_is_rolled_back(self):
+        """Connections go back to the pool without a dangling transaction"""
+        conn = self.pool.getconn()
+        conn.status = extensions.TRANSACTION_STATUS_INTRANS
+        self.pool.putconn(conn)
+        self.assertEqual(conn.status, extensions.TRANSACTION_STATUS_IDLE)
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+
+class FakeReplicaConnection(FakeConnection):
+    """Answers the router's lag query with the state of its replica."""
+
+    def __init__(self, replica):
+        super().__init__()
+        self.replica = replica
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.replica.down:
+            raise psycopg2.OperationalError("could not connect to server")
+
+    def fetchone(self):
+        return (self.replica.streaming, self.replica.lag)
+
+
+class ReplicaRouterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.primary = self.fake_pool('primary')
+        self.replicas = [self.fake_pool('replica1'), self.fake_pool('replica2')]
+        self.router = ReplicaRouter(self.primary, self.replicas, max_lag=5, check_interval=60)
+
+    def fake_pool(self, name):
+        pool = ConnectionPool(name=name, maxconn=2, timeout=0.1)
+        pool.lag, pool.down, pool.streaming = 0.0, False, True
+        patcher = mock.patch.object(pool, '_connect', side_effect=lambda: FakeReplicaConnection(pool))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return pool
+
+    def read_pool(self, key=None):
+        with self.router.read_connection(key) as conn:
+            return conn.replica
+
+    def test_reads_stick_to_one_replica_per_key(self):
+        """The same key always reads from the same replica; writes stay on the primary"""
+        first = self.read_pool(key=7)
+        self.assertIn(first, self.replicas)
+        self.assertTrue(all(self.read_pool(key=7) is first for _ in range(5)))
+        with self.router.connection() as conn:
+            self.assertIs(conn.replica, self.primary)
+
+    def test_lagging_or_broken_replicas_fall_back_to_primary(self):
+        """Replicas over max_lag or failing the check are skipped until re-checked"""
+        self.replicas[0].lag = 30.0
+        self.replicas[1].down = True
+        self.assertIs(self.read_pool(key=7), self.primary)
+        self.assertEqual([r['healthy'] for r in self.router.stats()['replicas']], [False, False])
+
+        self.replicas[0].lag = 0.5
+        self.router.check_interval = 0
+        self.assertIs(self.read_pool(key=7), self.replicas[0])
+
+    def test_replica_without_wal_receiver_is_unhealthy(self):
+        """A replica that stopped streaming is skipped even though it reports no lag"""
+        self.replicas[0].streaming = False
+        self.replicas[1].down = True
+        self.assertIs(self.read_pool(key=7), self.primary)
+        self.assertEqual(self.router.stats()['replicas'][0]['error'], 'WAL receiver is not streaming')
+
+    def test_losing_a_replica_only_moves_its_keys(self):
+        """Keys served by a healthy replica stay there when another one drops out"""
+        before = {key: self.read_pool(key) for key in range(50)}
+        self.assertEqual(set(before.values()), set(self.replicas))
+        self.replicas[1].down = True
+        self.router.check_interval = 0
+        after = {key: self.read_pool(key) for key in range(50)}
+        for key, pool in before.items():
+            self.assertIs(after[key], self.replicas[0] if pool is self.replicas[1] else pool)
+
+    def test_writer_reads_from_primary_until_replicas_catch_up(self):
+        """After wrote(key) that key reads from the primary for read_your_writes seconds"""
+        self.router.wrote(7)
+        self.assertIs(self.read_pool(key=7), self.primary)
+        self.assertIn(self.read_pool(key=8), self.replicas)
+        self.router.read_your_writes = 0
+        self.assertIn(self.read_pool(key=7), self.replicas)
+
+    def test_client_write_time_pins_reads_to_primary(self):
+        """A write time carried by the client works in any process"""
+        with self.router.read_connection(7, wrote_at=time.time() - 1) as conn:
+            self.assertIs(conn.replica, self.primary)
+        with self.router.read_connection(7, wrote_at=time.time() - 600) as conn:
+            self.assertIn(conn.replica, self.replicas)
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def test_opens_after_threshold_and_recovers(self):
+        """The breaker fails fast once tripped and closes after a good trial call"""
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        threading.Event().wait(0.06)
+        self.assertTrue(breaker.allow())       # the single half-open trial
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_client_retries_then_trips_breaker(self):
+        """Connection errors are retried, then counted as one breaker failure"""
+        client = ServiceClient('weather', 'http://weather', retries=2, backoff=0,
+                               breaker=CircuitBreaker(failure_threshold=1))
+        with mock.patch.object(client.session, 'request',
+                               side_effect=requests.ConnectionError('down')) as send:
+            with self.assertRaises(ServiceUnavailable):
+                client.get('/weather')
+            self.assertEqual(send.call_count, 3)
+            with self.assertRaises(ServiceUnavailable):
+                client.get('/weather')
+            self.assertEqual(send.call_count, 3)
+        self.assertEqual(client.stats()['circuit_breaker']['state'], 'open')
+
+    def test_unexpected_errors_settle_the_trial(self):
+        """A non-network error fails the half-open trial instead of leaving it taken for good"""
+        client = ServiceClient('weather', 'http://weather', retries=0,
+                               breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0))
+        with mock.patch.object(client.session, 'request', side_effect=requests.ConnectionError('down')):
+            with self.assertRaises(ServiceUnavailable):
+                client.get('/weather')
+        with mock.patch.object(client.session, 'request', side_effect=TypeError('bad body')):
+            with self.assertRaises(TypeError):
+                client.get('/weather')
+        self.assertEqual(client.breaker.stats()['consecutive_failures'], 2)
+        with mock.patch.object(client.session, 'request', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                client.get('/weather')
+        self.assertEqual(client.breaker.stats()['consecutive_failures'], 2)
+        self.assertTrue(client.breaker.allow())    # the trial slot was given back
+
+    @unittest.skipIf(AsyncServiceClient is None, "httpx is not installed")
+    def test_cancelled_async_trial_is_released(self):
+        """Cancelling the half-open trial frees it without counting a failure"""
+        client = AsyncServiceClient('weather', 'http://weather', retries=0,
+                                    breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0))
+        client.breaker.record_failure()
+
+        async def run():
+            client.start()
+            started = asyncio.Event()
+
+            async def hang(*args, **kwargs):
+                started.set()
+                await asyncio.sleep(10)
+
+            with mock.patch.object(client.client, 'request', side_effect=hang):
+                trial = asyncio.ensure_future(client.get('/weather'))
+                await started.wait()
+                trial.cancel()
+                with self.assertRaises(asyncio.CancelledError):
+                    await trial
+            with mock.patch.object(client.client, 'request', side_effect=ValueError('bad')):
+                with self.assertRaises(ValueError):
+                    await client.get('/weather')
+            await client.close()
+
+        asyncio.run(run())
+        self.assertEqual(client.breaker.stats()['consecutive_failures'], 2)
+
+
+class FakeRoomsDatabase:
+    """Just enough of a pool/connection/cursor to serve the catalog queries."""
+
+    def __init__(self):
+        self.version = 1
+        self.rooms = [(1, 'Mitte Room', 50, 'Berlin', 100.0)]
+        self.queries = []
+        self._result = None
+
+    def connection(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=None):
+        self.queries.append(sql)
+        if sql.startswith('UPDATE room_catalog_version'):
+            self.version += 1
+        self._result = [(self.version,)] if 'room_catalog_version' in sql else list(self.rooms)
+
+    def commit(self):
+        pass
+
+    def fetchone(self):
+        return self._result[0]
+
+    def fetchall(self):
+        return self._result
+
+
+class RoomCatalogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeRoomsDatabase()
+        self.catalog = RoomCatalog(self.db, ttl=60, miss_recheck=0)
+
+    def test_rooms_are_served_from_memory(self):
+        """Repeated reads inside the TTL do not touch the database"""
+        self.assertEqual(self.catalog.get(1)['location'], 'Berlin')
+        self.catalog.all()
+        self.catalog.get('1')
+        self.assertEqual(len(self.db.queries), 2)   # version check + load
+
+    def test_reload_only_when_version_changes(self):
+        """An expired TTL re-checks the version and reloads only if it moved"""
+        first = self.catalog.snapshot()
+        self.catalog.invalidate()
+        self.assertIs(self.catalog.snapshot(), first)
+
+        self.db.version = 2
+        self.db.rooms.append((2, 'Louvre Room', 50, 'Paris', 200.0))
+        self.catalog.invalidate()
+        self.assertEqual(self.catalog.snapshot().etag, 'rooms-v2')
+        self.assertEqual(self.catalog.stats()['reloads'], 2)
+
+    def test_bump_moves_the_shared_version(self):
+        """bump() changes the counter other processes poll, and re-checks this one"""
+        other_worker = RoomCatalog(self.db, ttl=0)
+        self.catalog.snapshot()
+        other_worker.snapshot()
+
+        self.assertEqual(self.catalog.bump(self.db), 2)
+        self.assertEqual(self.catalog.snapshot().etag, 'rooms-v2')
+        self.assertEqual(other_worker.snapshot().etag, 'rooms-v2')
+
+    def test_unknown_room_rechecks_version(self):
+        """A miss re-checks the version so newly added rooms are found"""
+        self.catalog.snapshot()
+        self.db.version = 2
+        self.db.rooms.append((7, 'New Room', 10, 'Paris', 80.0))
+        self.assertEqual(self.catalog.get(7)['name'], 'New Room')
+        self.assertIsNone(self.catalog.get('not-a-number'))
+
+
+class TTLCacheTestCase(unittest.TestCase):
+    def test_lru_eviction_and_expiry(self):
+        """The least recently used entry is evicted and expired entries miss"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+        cache.set('short', 'x', ttl=0)
+        self.assertIsNone(cache.get('short'))
+
+
+class SingleFlightTestCase(unittest.TestCase):
+    def test_do_many_waits_only_for_keys_in_flight(self):
+        """A batch loads the keys nobody else is loading and shares the rest"""
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def slow_one():
+            started.set()
+            release.wait(2)
+            return 'a-from-single'
+
+        single = threading.Thread(target=flight.do, args=('a', slow_one))
+        single.start()
+        started.wait(2)
+        loaded = []
+        threading.Timer(0.05, release.set).start()
+        results = flight.do_many(['a', 'b'], lambda keys: loaded.extend(keys) or {k: f"{k}-from-batch" for k in keys})
+        single.join()
+
+        self.assertEqual(loaded, ['b'])
+        self.assertEqual(results, {'b': 'b-from-batch', 'a': 'a-from-single'})
+        self.assertEqual(flight.coalesced, 1)
+
+    def test_async_followers_share_the_first_result(self):
+        """Concurrent coroutines for one key run it once; a cancelled follower does not cancel it"""
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def load():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'loaded'
+
+        async def run():
+            impatient = asyncio.ensure_future(flight.do('k', load))
+            others = [flight.do('k', load) for _ in range(3)]
+            await asyncio.sleep(0)
+            impatient.cancel()
+            return await asyncio.gather(*others)
+
+        self.assertEqual(asyncio.run(run()), ['loaded'] * 3)
+        self.assertEqual(calls, [1])
+        self.assertEqual(flight.coalesced, 3)
+
+
+class TracingTestCase(unittest.TestCase):
+    def test_trace_id_is_forwarded_and_spans_recorded(self):
+        """Outbound calls carry the request's trace ID and show up as spans"""
+        trace = tracing.Trace('abc123', 'booking_service')
+        token = tracing._current.set(trace)
+        try:
+            client = ServiceClient('room_service', 'http://rooms')
+            response = mock.Mock(status_code=200)
+            with mock.patch.object(client.session, 'request', return_value=response) as send:
+                client.get('/rooms/1')
+            with tracing.span('pricing', 'quote'):
+                pass
+        finally:
+            tracing._current.reset(token)
+
+        self.assertEqual(send.call_args.kwargs['headers'][tracing.TRACE_HEADER], 'abc123')
+        self.assertEqual([(s['kind'], s['name']) for s in trace.spans],
+                         [('http', 'room_service GET'), ('pricing', 'quote')])
+
+    def test_metrics_render_cumulative_buckets(self):
+        """Histograms render in the Prometheus text format with cumulative buckets"""
+        histogram = tracing.Histogram('test_seconds', 'Test.', ('name',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, 'a')
+        histogram.observe(0.5, 'a')
+        lines = histogram.render({'service': 'svc'})
+        self.assertIn('test_seconds_bucket{name="a",service="svc",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{name="a",service="svc",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_count{name="a",service="svc"} 2', lines)
+
+    def test_worker_metrics_are_summed_through_metrics_dir(self):
+        """Every worker's file counts once, also while an exited worker is being retired"""
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.dict(os.environ, {'METRICS_DIR': tmp}):
+            for pid, jobs in ((101, 2), (102, 3)):
+                tracing._dump(os.path.join(tmp, f'svc.{pid}.json'), {pid}, {
+                    'jobs_total': {('a',): jobs},
+                    'test_seconds': {('a',): ([1, 0, 0], 0.05)},
+                })
+            merged = tracing.read_metrics('svc')
+            self.assertEqual(merged['jobs_total'], {('a',): 5})
+            self.assertEqual(merged['test_seconds'], {('a',): [[2, 0, 0], 0.1]})
+
+            tracing.retire_worker(101)
+            self.assertFalse(os.path.exists(os.path.join(tmp, 'svc.101.json')))
+            self.assertEqual(tracing.read_metrics('svc')['jobs_total'], {('a',): 5})
+            # A file already folded into the retired sum is not counted again
+            tracing._dump(os.path.join(tmp, 'svc.101.json'), {101}, {'jobs_total': {('a',): 2}})
+            self.assertEqual(tracing.read_metrics('svc')['jobs_total'], {('a',): 5})
+
+        counter = tracing.Counter('jobs_total', 'Jobs.', ('kind',))
+        self.assertIn('jobs_total{kind="a",service="svc"} 5', counter.render({'service': 'svc'}, merged['jobs_total']))
+
+    def test_statement_label(self):
+        """DB spans are named by statement type and table, not the full SQL"""
+        self.assertEqual(statement_label("INSERT INTO bookings (a) VALUES (%s)"), 'INSERT bookings')
+        self.assertEqual(statement_label("\n  select id from rooms where id = %s"), 'SELECT rooms')
+        self.assertEqual(statement_label("SELECT 1"), 'SELECT')
+
+
+class TokenVerifierTestCase(unittest.TestCase):
+    def token(self, secret, kid, **claims):
+        claims.setdefault('exp', int(time.time()) + 60)
+        return jwt.encode(dict(claims, user_id=7), secret, algorithm='HS256', headers={'kid': kid})
+
+    def test_claims_are_cached_until_expiry(self):
+        """A token is decoded once; later requests are served from the cache"""
+        verifier = TokenVerifier(KeySet({'k1': 'secret-one'}))
+        token = self.token('secret-one', 'k1')
+        with mock.patch('common.jwt_auth.jwt.decode', wraps=jwt.decode) as decode:
+            self.assertEqual(verifier.verify(token)['user_id'], 7)
+            self.assertEqual(verifier.verify(token)['user_id'], 7)
+        self.assertEqual(decode.call_count, 1)
+
+        with self.assertRaises(InvalidToken):
+            verifier.verify(self.token('secret-one', 'k1', exp=int(time.time()) - 5))
+        with self.assertRaises(InvalidToken):
+            verifier.verify(self.token('wrong-secret', 'k1'))
+
+    def test_rotated_key_is_picked_up_from_key_file(self):
+        """An unknown kid triggers a reload of the key file; withdrawn keys stop working"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'keys.json')
+            with open(path, 'w') as f:
+                json.dump({'k1': 'secret-one'}, f)
+            verifier = TokenVerifier(KeySet(path=path, refresh_every=3600))
+            old_token = self.token('secret-one', 'k1')
+            verifier.verify(old_token)
+
+            with open(path, 'w') as f:
+                json.dump({'k2': 'secret-two'}, f)
+            os.utime(path, (time.time() + 5, time.time() + 5))
+            self.assertEqual(verifier.verify(self.token('secret-two', 'k2'))['user_id'], 7)
+            with self.assertRaises(InvalidToken):
+                verifier.verify(old_token)
+
+    def test_withdrawn_key_invalidates_cached_tokens(self):
+        """A cached token stops working once its key is gone from the key file"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'keys.json')
+            with open(path, 'w') as f:
+                json.dump({'k1': 'secret-one', 'k2': 'secret-two'}, f)
+            verifier = TokenVerifier(KeySet(path=path, refresh_every=0))
+            token = self.token('secret-one', 'k1')
+            verifier.verify(token)
+
+            with open(path, 'w') as f:
+                json.dump({'k2': 'secret-two'}, f)
+            os.utime(path, (time.time() + 5, time.time() + 5))
+            with self.assertRaises(InvalidToken):
+                verifier.verify(token)
+
+if __name__ == '__main__':
+    unittest.main()
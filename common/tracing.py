@@ -0,0 +1,416 @@
+"""Request tracing, structured logs and Prometheus metrics for the Flask services.
+
+``init_app(app, service)`` gives every request a trace ID (taken from the
+incoming ``X-Request-ID`` header or generated), echoes it back in the response,
+logs one JSON line per request with its spans and exposes ``GET /metrics``.
+common/async_web.py does the same for Quart apps.
+
+Work done inside a request is timed with ``span(kind, name)``. ``ServiceClient``
+opens an ``http`` span per attempt and forwards the trace ID downstream, and
+pooled database connections open a ``db`` span per statement, so the request
+log shows where the time went without touching every call site.
+
+Metrics are counted in each process. Gunicorn workers share one port, so a
+scrape reaches whichever worker accepts it. With METRICS_DIR set, every
+worker writes its metrics to a file there (at most METRICS_FLUSH_SECONDS
+apart, and when it exits), and ``/metrics`` answers with the sum over all of
+them, dead workers included, so counters never go backwards when a worker
+is recycled. Each service needs its own directory; gunicorn.conf.py empties
+it when the master starts. Without METRICS_DIR a scrape only sees the worker
+that answered it, labelled ``worker`` (the pid): fine for a single process.
+"""
+import contextvars
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+TRACE_HEADER = 'X-Request-ID'
+
+# Histogram buckets in seconds
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+logger = logging.getLogger('trace')
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+
+
+class Trace:
+    """The spans collected while serving one request."""
+
+    def __init__(self, trace_id, service):
+        self.trace_id = trace_id
+        self.service = service
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, kind, name, seconds, error=None):
+        span = {"kind": kind, "name": name, "ms": round(seconds * 1000, 3)}
+        if error:
+            span["error"] = error
+        with self._lock:
+            self.spans.append(span)
+
+
+_current = contextvars.ContextVar('trace', default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+def current_trace_id():
+    trace = _current.get()
+    return trace.trace_id if trace is not None else None
+
+
+def wrap(fn):
+    """Run ``fn`` in a copy of the caller's context, e.g. on a thread pool."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+# --- METRICS ---
+class Histogram:
+    """A Prometheus histogram family keyed by label values."""
+
+    def __init__(self, name, help_text, label_names, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}          # label values -> [bucket counts..., +Inf], sum
+        self.updates = 0
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            self.updates += 1
+            counts, total = self._series.get(label_values, ([0] * (len(self.buckets) + 1), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._series[label_values] = (counts, total + seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+
+    def render(self, extra_labels, series=None):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        if series is None:
+            series = self.snapshot()
+        for label_values, (counts, total) in sorted(series.items()):
+            labels = dict(zip(self.label_names, label_values), **extra_labels)
+            running = 0
+            for bound, count in zip(self.buckets, counts):
+                running += count
+                lines.append(f"{self.name}_bucket{_labels(labels, le=bound)} {running}")
+            running += counts[-1]
+            lines.append(f"{self.name}_bucket{_labels(labels, le='+Inf')} {running}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {total:.6f}")
+            lines.append(f"{self.name}_count{_labels(labels)} {running}")
+        return lines
+
+
+class Counter:
+    """A Prometheus counter family keyed by label values."""
+
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._series = {}          # label values -> count
+        self.updates = 0
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.updates += 1
+            self._series[label_values] = self._series.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self._lock:
+            return self._series.get(label_values, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._series)
+
+    def render(self, extra_labels, series=None):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        if series is None:
+            series = self.snapshot()
+        for label_values, count in sorted(series.items()):
+            labels = dict(zip(self.label_names, label_values), **extra_labels)
+            lines.append(f"{self.name}{_labels(labels)} {count}")
+        return lines
+
+
+def _labels(labels, **extra):
+    merged = dict(labels, **extra)
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in merged.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(merged, escaped)) + '}'
+
+
+request_duration = Histogram(
+    'http_request_duration_seconds', 'Time spent serving HTTP requests.',
+    ('method', 'endpoint', 'status')
+)
+dependency_duration = Histogram(
+    'dependency_duration_seconds', 'Time spent in database queries, downstream calls and pricing.',
+    ('kind', 'name')
+)
+
+# Everything served by GET /metrics; services add their own with register()
+_registry = [request_duration, dependency_duration]
+
+
+def register(metric):
+    """Include ``metric`` (a Histogram or Counter) in GET /metrics."""
+    _registry.append(metric)
+    return metric
+
+
+def render_metrics(service):
+    if not metrics_dir():
+        extra = {"service": service, "worker": str(os.getpid())}
+        lines = []
+        for metric in _registry:
+            lines.extend(metric.render(extra))
+        return '\n'.join(lines) + '\n'
+
+    # Our own file first, so this worker's latest counts are in the sum
+    metrics_writer.start(service)
+    metrics_writer.flush()
+    merged = read_metrics(service)
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render({"service": service}, merged.get(metric.name, {})))
+    return '\n'.join(lines) + '\n'
+
+
+# --- METRICS SHARED BETWEEN WORKERS ---
+# METRICS_DIR/<service>.<pid>.json holds one live worker's metrics;
+# <service>.retired.json the sum of every worker that has exited, and their
+# pids. Files are replaced atomically. A worker's file is folded into the
+# retired one before it is removed, and readers take the retired file last
+# and skip the pids it lists, so a worker is never counted twice or missed.
+def metrics_dir():
+    """METRICS_DIR, read on every use: gunicorn.conf.py may set it after import."""
+    return os.getenv('METRICS_DIR')
+
+
+def _add(a, b):
+    """Counter values add; histogram values ([bucket counts], sum) add element by element."""
+    if isinstance(a, (list, tuple)):
+        return [_add(x, y) for x, y in zip(a, b)]
+    return a + b
+
+
+def _merge(merged, metrics):
+    for name, series in metrics.items():
+        target = merged.setdefault(name, {})
+        for labels, value in series.items():
+            target[labels] = _add(target[labels], value) if labels in target else value
+
+
+def _load(path):
+    """(pids, {metric name: {label values: value}}) from one file, or None if it is gone."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    metrics = {name: {tuple(labels): value for labels, value in series}
+               for name, series in data['metrics'].items()}
+    return set(data['pids']), metrics
+
+
+def _dump(path, pids, metrics):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump({"pids": sorted(pids), "metrics": {
+            name: [[list(labels), value] for labels, value in series.items()]
+            for name, series in metrics.items()
+        }}, f)
+    os.replace(tmp, path)
+
+
+def read_metrics(service):
+    """Every worker's metrics for ``service``, summed."""
+    directory = metrics_dir()
+    retired_path = os.path.join(directory, f"{service}.retired.json")
+    live = [_load(path) for path in glob.glob(os.path.join(directory, f"{service}.*.json"))
+            if path != retired_path]
+    retired_pids, merged = _load(retired_path) or (set(), {})
+    for loaded in live:
+        if loaded is not None and not loaded[0] <= retired_pids:
+            _merge(merged, loaded[1])
+    return merged
+
+
+class MetricsWriter:
+    """Writes this worker's metrics to METRICS_DIR/<service>.<pid>.json.
+
+    A daemon thread rewrites the file every METRICS_FLUSH_SECONDS while
+    anything changed; it is started by the first request a process serves,
+    so a forked worker gets its own.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval if interval is not None else float(os.getenv('METRICS_FLUSH_SECONDS', 1))
+        self.service = None
+        self._pid = None
+        self._written = None
+        self._lock = threading.Lock()
+
+    def start(self, service):
+        if self._pid == os.getpid() or not metrics_dir():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self.service, self._pid, self._written = service, os.getpid(), None
+            threading.Thread(target=self._run, name='metrics-writer', daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._pid == pid:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        if self._pid != os.getpid() or not metrics_dir():
+            return
+        with self._lock:
+            updates = sum(metric.updates for metric in _registry)
+            if updates == self._written:
+                return
+            _dump(os.path.join(metrics_dir(), f"{self.service}.{self._pid}.json"), {self._pid},
+                  {metric.name: metric.snapshot() for metric in _registry})
+            self._written = updates
+
+
+metrics_writer = MetricsWriter()
+
+
+def retire_worker(pid):
+    """Fold an exited worker's file into the retired sum (run by the gunicorn master)."""
+    directory = metrics_dir()
+    if not directory:
+        return
+    for path in glob.glob(os.path.join(directory, f"*.{pid}.json")):
+        loaded = _load(path)
+        if loaded is not None:
+            retired_path = os.path.join(directory, os.path.basename(path)[:-len(f"{pid}.json")] + "retired.json")
+            pids, merged = _load(retired_path) or (set(), {})
+            _merge(merged, loaded[1])
+            _dump(retired_path, pids | loaded[0], merged)
+        os.remove(path)
+
+
+# --- SPANS ---
+@contextmanager
+def span(kind, name):
+    """Time a block as a span of the current request and a dependency metric."""
+    started = time.perf_counter()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        dependency_duration.observe(elapsed, kind, name)
+        trace = _current.get()
+        if trace is not None:
+            trace.add(kind, name, elapsed, error)
+
+
+def log_event(event, level=logging.INFO, **fields):
+    """Write one structured (JSON) log line tagged with the current trace ID."""
+    if not logger.isEnabledFor(level):
+        return
+    trace = _current.get()
+    record = {"ts": round(time.time(), 3), "level": logging.getLevelName(level).lower(), "event": event}
+    if trace is not None:
+        record.update(service=trace.service, trace_id=trace.trace_id)
+    record.update(fields)
+    logger.log(level, json.dumps(record, default=str))
+
+
+# --- REQUEST LIFECYCLE (used by the Flask and Quart integrations) ---
+def start_request(trace_id, service):
+    """Make a new trace current; returns the token ``end_request`` needs."""
+    return _current.set(Trace((trace_id or uuid.uuid4().hex)[:128], service))
+
+
+def finish_request(service, method, endpoint, path, status, elapsed):
+    """Count and log a served request; returns its trace ID, or None outside a trace."""
+    trace = _current.get()
+    if trace is None:
+        return None
+    request_duration.observe(elapsed, method, endpoint, str(status))
+    metrics_writer.start(service)
+    if endpoint != '/metrics':
+        log_event(
+            'request', method=method, path=path, status=status,
+            duration_ms=round(elapsed * 1000, 3), spans=trace.spans
+        )
+    return trace.trace_id
+
+
+def end_request(token):
+    try:
+        _current.reset(token)
+    except ValueError:
+        # Torn down from a different context than it was set in
+        _current.set(None)
+
+
+# --- FLASK INTEGRATION ---
+def init_app(app, service):
+    """Trace every request of ``app`` and serve ``/metrics``."""
+    from flask import Response, g, request
+
+    @app.before_request
+    def start_trace():
+        g.trace_token = start_request(request.headers.get(TRACE_HEADER), service)
+        g.trace_started = time.perf_counter()
+
+    @app.after_request
+    def finish_trace(response):
+        if 'trace_started' not in g:
+            return response
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        trace_id = finish_request(service, request.method, endpoint, request.path,
+                                  response.status_code, time.perf_counter() - g.trace_started)
+        if trace_id is not None:
+            response.headers[TRACE_HEADER] = trace_id
+        return response
+
+    @app.teardown_request
+    def end_trace(exc):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            end_request(token)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        return Response(render_metrics(service), mimetype='text/plain; version=0.0.4')
+
+    return app
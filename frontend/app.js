@@ -109,6 +109,9 @@ async function submitBooking() {
         const result = await response.json();
 
         if (response.ok) {
+            // The dashboard sends this back so its first read sees the new booking
+            const readAfter = response.headers.get('X-Read-After');
+            if (readAfter) sessionStorage.setItem('readAfter', readAfter);
             alert(`✅ BOOKING CONFIRMED!\nReference: #${result.id}\nTotal: £${result.total_price.toFixed(2)}`);
             window.location.href = "dashboard.html";
         } else {
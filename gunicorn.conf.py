@@ -0,0 +1,67 @@
+# Production server settings shared by every service.
+#
+#   gunicorn -c gunicorn.conf.py --chdir booking_service --bind 0.0.0.0:5004 app:app
+#
+# Tune with environment variables:
+#   WEB_CONCURRENCY    worker processes (default: 2 x CPU cores + 1)
+#   GUNICORN_THREADS   threads per worker (default: 8)
+#   GUNICORN_PRELOAD   1 = import the app once in the master and fork workers
+#                      from it, sharing memory copy-on-write (default: 1)
+#   GUNICORN_MAX_REQUESTS  recycle a worker after this many requests (default: off)
+#   DB_POOL_WARM       1 = open DB_POOL_MIN connections as each worker starts
+#   METRICS_DIR        directory (one per service) where workers share their
+#                      metrics, so /metrics sums every worker (common/tracing.py)
+#
+# Reloading: `kill -HUP $(cat <service>.pid)` restarts workers gracefully.
+# With preload on, HUP reuses the already imported code; to roll out new code
+# without downtime send USR2 (starts a new master) and then WINCH + QUIT to the
+# old master.
+import glob
+import multiprocessing
+import os
+import sys
+
+# Make the shared `common` package importable even without preload
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Tell the app how many siblings it has (auth_service sizes its bcrypt pool by it)
+os.environ['WEB_CONCURRENCY'] = str(workers)
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    # Give this worker its own DB pool / HTTP sessions (see common/serving.py)
+    from common import serving
+    serving.run_worker_start_hooks()
+
+
+def on_starting(server):
+    # Metrics of a previous run would be added to this one's
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+            os.remove(path)
+
+
+def worker_exit(server, worker):
+    from common import tracing
+    tracing.metrics_writer.flush()
+
+
+def child_exit(server, worker):
+    # Keep an exited worker's counts in /metrics
+    from common import tracing
+    tracing.retire_worker(worker.pid)
@@ -0,0 +1,316 @@
+"""Bulk loader for realistic test volumes: rooms, users and bookings.
+
+Generates synthetic data (or reads CSV files) and streams it into Postgres
+with COPY FROM STDIN, hashing user passwords with bcrypt in parallel worker
+processes. Secondary indexes on bookings are dropped for the load and built
+afterwards, which is much faster than maintaining them row by row.
+
+Run the init scripts first so the tables exist, then e.g.
+
+    python load_data.py --reset --rooms 5000 --locations 200 --users 200000 --bookings 2000000
+    python load_data.py --rooms-csv rooms.csv --users-csv users.csv --bookings-csv bookings.csv
+
+CSV files need a header row naming their columns (see the *_COLUMNS below);
+users-csv holds `username` (auth_service's table) or `name` and `email`
+(setup_users.py's), and plaintext passwords in a `password` column, which are hashed,
+and bookings-csv a `slot` column with tstzrange literals such as
+"[2030-01-31 09:00+00,2030-01-31 12:00+00)".
+
+Users go into whichever users table the database has:
+
+* auth_service's (auth_service/init_db.py: username, password). These users
+  log in through auth_service POST /login with their username and password,
+  which it checks against the bcrypt hash.
+* setup_users.py's (name, email, password_hash). These users only own the
+  generated bookings. booking_service's /login compares the password with
+  password_hash as plain text, so their bcrypt hashes never match there.
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import secrets
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import bcrypt
+import psycopg2
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ROOM_COLUMNS = ('name', 'capacity', 'location', 'price_per_hour')
+# By the users table found: (identity columns, password hash column)
+USER_SCHEMAS = {
+    'auth': (('username',), 'password'),
+    'booking': (('name', 'email'), 'password_hash'),
+}
+BOOKING_COLUMNS = ('user_id', 'room_id', 'room_name', 'date', 'slot', 'total_price')
+
+# Rebuilt after bookings are loaded: (name, DROP statement, CREATE statement)
+BOOKING_INDEXES = [
+    ('bookings_no_overlap',
+     "ALTER TABLE bookings DROP CONSTRAINT IF EXISTS bookings_no_overlap",
+     "ALTER TABLE bookings ADD CONSTRAINT bookings_no_overlap "
+     "EXCLUDE USING gist (int4range(room_id, room_id, '[]') WITH =, slot WITH &&)"),
+    ('bookings_user_date_idx',
+     "DROP INDEX IF EXISTS bookings_user_date_idx",
+     "CREATE INDEX bookings_user_date_idx ON bookings (user_id, date DESC, id DESC)"),
+]
+
+# Bookings written here bypass the booking_changes log, so change-feed cursors
+# and booking list ETags taken before the load must not be trusted after it
+EXPIRE_CHANGE_FEED = (
+    "INSERT INTO booking_changes_purged (id, tx) VALUES (1, pg_current_xact_id()::text::bigint) "
+    "ON CONFLICT (id) DO UPDATE SET tx = EXCLUDED.tx"
+)
+
+ROOM_KINDS = [('Room', 20, 100), ('Suite', 40, 150), ('Hall', 80, 225), ('Studio', 10, 80)]
+FIRST_NAMES = ['Ada', 'Ben', 'Chloe', 'Dev', 'Elif', 'Farah', 'Gus', 'Hana', 'Ivan', 'Jo', 'Kai', 'Lena']
+LAST_NAMES = ['Smith', 'Okafor', 'Novak', 'Garcia', 'Chen', 'Müller', 'Rossi', 'Dubois', 'Khan', 'Silva']
+SURCHARGE_RATES = [0.0, 0.10, 0.20, 0.30, 0.50]
+
+
+# --- COPY PLUMBING ---
+class LineStream(io.RawIOBase):
+    """Read-only file over an iterator of text lines, so COPY can stream it."""
+
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = b''
+        self._offset = 0
+        self.rows = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, target):
+        if self._offset >= len(self._buffer):
+            # Refill with about one target's worth of lines, joined once
+            chunk, size = [], 0
+            for line in self._lines:
+                data = line.encode('utf-8')
+                chunk.append(data)
+                size += len(data)
+                if size >= len(target):
+                    break
+            self.rows += len(chunk)
+            self._buffer, self._offset = b''.join(chunk), 0
+        size = min(len(target), len(self._buffer) - self._offset)
+        target[:size] = self._buffer[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+
+def copy_rows(cur, table, columns, lines):
+    """COPY ``lines`` (tab-separated text format) into ``table``; returns the row count."""
+    stream = LineStream(lines)
+    cur.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN",
+        io.BufferedReader(stream, buffer_size=1 << 20)
+    )
+    return stream.rows
+
+
+def copy_csv(cur, table, path):
+    with open(path, newline='') as f:
+        header = next(csv.reader(f))
+        f.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(header)}) FROM STDIN WITH (FORMAT csv, HEADER true)", f)
+    return cur.rowcount
+
+
+def text_field(value):
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def text_line(values):
+    return '\t'.join(text_field(v) for v in values) + '\n'
+
+
+# --- GENERATORS ---
+def generate_rooms(count, locations):
+    cities = [f"City {i + 1}" for i in range(locations)]
+    for i in range(count):
+        kind, capacity, price = ROOM_KINDS[i % len(ROOM_KINDS)]
+        city = cities[i % locations]
+        yield text_line((f"{city} {kind} {i // locations + 1}", capacity, city,
+                         f"{price * random.choice((1, 1.5, 2)):.2f}"))
+
+
+def hash_passwords(passwords, rounds):
+    """Runs in a worker process: bcrypt-hash one chunk of passwords."""
+    return [bcrypt.hashpw(p.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8') for p in passwords]
+
+
+def hashed_chunks(passwords, rounds, workers, chunk_size=500):
+    """Yield password hashes in input order, hashing chunks in parallel."""
+    chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for hashes in pool.map(hash_passwords, chunks, [rounds] * len(chunks)):
+            yield from hashes
+
+
+def user_schema(cur):
+    """'auth' or 'booking': which of the two users tables this database has."""
+    cur.execute("SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = 'users'")
+    columns = {row[0] for row in cur.fetchall()}
+    for schema, (identity, password) in USER_SCHEMAS.items():
+        if columns >= set(identity) | {password}:
+            return schema
+    raise SystemExit("❌ No users table to load into; run auth_service/init_db.py first")
+
+
+def user_columns(schema):
+    identity, password = USER_SCHEMAS[schema]
+    return identity + (password,)
+
+
+def generate_users(count, password, rounds, workers, schema):
+    tag = secrets.token_hex(3)
+    if schema == 'auth':
+        people = [(f"user{i}.{tag}",) for i in range(count)]
+    else:
+        people = [(f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}",
+                   f"user{i}.{tag}@loadtest.nexus") for i in range(count)]
+    for person, hashed in zip(people, hashed_chunks([password] * count, rounds, workers)):
+        yield text_line(person + (hashed,))
+
+
+def generate_bookings(count, rooms, user_ids, start, days):
+    """Exactly ``count`` distinct (room, day) cells, uniformly chosen in one pass.
+
+    Selection sampling (Knuth's Algorithm S) keeps memory flat however many
+    cells there are.
+    """
+    total = len(rooms) * days
+    if count > total:
+        raise ValueError(f"Only {total} room-days available for {count} bookings")
+    needed = count
+    for index, (room_id, room_name, price) in enumerate(rooms):
+        for day in range(days):
+            remaining = total - (index * days + day)
+            if random.random() * remaining < needed:
+                needed -= 1
+                total_price = float(price) * (1 + random.choice(SURCHARGE_RATES))
+                first = start + timedelta(days=day)
+                slot = f"[{first.isoformat()} 00:00+00,{(first + timedelta(days=1)).isoformat()} 00:00+00)"
+                yield text_line((random.choice(user_ids), room_id, room_name,
+                                 first.isoformat(), slot, f"{total_price:.2f}"))
+                if needed == 0:
+                    return
+
+
+# --- LOADING ---
+def report(label, rows, seconds):
+    rate = rows / seconds if seconds else float('inf')
+    print(f"  {label:<24} {rows:>10,} rows in {seconds:7.2f}s  ({rate:,.0f} rows/s)")
+
+
+def timed(label, fn, *args):
+    started = time.perf_counter()
+    rows = fn(*args)
+    report(label, rows, time.perf_counter() - started)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=0)
+    parser.add_argument('--locations', type=int, default=50)
+    parser.add_argument('--users', type=int, default=0)
+    parser.add_argument('--bookings', type=int, default=0)
+    parser.add_argument('--days', type=int, default=730, help="booking dates span this many days")
+    parser.add_argument('--start', type=date.fromisoformat, default=date.today() - timedelta(days=365),
+                        help="first booking date (YYYY-MM-DD)")
+    parser.add_argument('--rooms-csv')
+    parser.add_argument('--users-csv')
+    parser.add_argument('--bookings-csv')
+    parser.add_argument('--password', default='password123', help="password for generated users")
+    parser.add_argument('--bcrypt-rounds', type=int, default=int(os.getenv('BCRYPT_ROUNDS', 12)),
+                        help="cost factor; use 4 for quick synthetic loads")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="bcrypt processes")
+    parser.add_argument('--reset', action='store_true', help="empty rooms, users and bookings first")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(
+        host=os.getenv('DB_HOST', 'localhost'),
+        database=os.getenv('DB_NAME', 'postgres'),
+        user=os.getenv('DB_USER', 'postgres'),
+        password=os.getenv('DB_PASS', 'postgres')
+    )
+    cur = conn.cursor()
+    print("🔌 Connected to Database...")
+
+    if args.reset:
+        print("🗑️  Emptying rooms, users and bookings...")
+        cur.execute("TRUNCATE bookings, users, rooms RESTART IDENTITY CASCADE;")
+        cur.execute(EXPIRE_CHANGE_FEED)
+        conn.commit()
+
+    print("🚚 Loading...")
+    started = time.perf_counter()
+    total_rows = 0
+
+    if args.rooms_csv:
+        total_rows += timed('rooms (csv)', copy_csv, cur, 'rooms', args.rooms_csv)
+    elif args.rooms:
+        total_rows += timed('rooms', copy_rows, cur, 'rooms', ROOM_COLUMNS,
+                            generate_rooms(args.rooms, args.locations))
+    conn.commit()
+
+    if args.users_csv or args.users:
+        schema = user_schema(cur)
+        print(f"  users table columns: {', '.join(user_columns(schema))}")
+    if args.users_csv:
+        identity, _ = USER_SCHEMAS[schema]
+        with open(args.users_csv, newline='') as f:
+            people = list(csv.DictReader(f))
+        lines = (text_line(tuple(p[c] for c in identity) + (h,)) for p, h in zip(
+            people, hashed_chunks([p['password'] for p in people], args.bcrypt_rounds, args.workers)))
+        total_rows += timed('users (csv, bcrypt)', copy_rows, cur, 'users', user_columns(schema), lines)
+    elif args.users:
+        total_rows += timed('users (bcrypt)', copy_rows, cur, 'users', user_columns(schema),
+                            generate_users(args.users, args.password, args.bcrypt_rounds, args.workers, schema))
+    conn.commit()
+
+    if args.bookings_csv or args.bookings:
+        for _, drop, _ in BOOKING_INDEXES:
+            cur.execute(drop)
+        # Seeded rows are not changes: keep them out of the booking_changes feed
+        cur.execute("ALTER TABLE bookings DISABLE TRIGGER USER")
+        if args.bookings_csv:
+            total_rows += timed('bookings (csv)', copy_csv, cur, 'bookings', args.bookings_csv)
+        else:
+            cur.execute("SELECT id, name, price_per_hour FROM rooms ORDER BY id")
+            rooms = cur.fetchall()
+            cur.execute("SELECT id FROM users")
+            user_ids = [row[0] for row in cur.fetchall()]
+            if not rooms or not user_ids:
+                raise SystemExit("❌ Bookings need rooms and users; load those first")
+            total_rows += timed('bookings', copy_rows, cur, 'bookings', BOOKING_COLUMNS,
+                                generate_bookings(args.bookings, rooms, user_ids, args.start, args.days))
+
+        cur.execute("ALTER TABLE bookings ENABLE TRIGGER USER")
+        cur.execute(EXPIRE_CHANGE_FEED)
+        print("🔨 Building indexes...")
+        for name, _, create in BOOKING_INDEXES:
+            index_started = time.perf_counter()
+            cur.execute(create)
+            print(f"  {name:<24} {time.perf_counter() - index_started:7.2f}s")
+        conn.commit()
+
+    cur.execute("ANALYZE rooms; ANALYZE users; ANALYZE bookings;")
+    conn.commit()
+    cur.close()
+    conn.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ Loaded {total_rows:,} rows in {elapsed:.2f}s ({total_rows / elapsed:,.0f} rows/s overall)")
+
+
+if __name__ == '__main__':
+    main()
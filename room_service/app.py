@@ -1,49 +1,70 @@
 import os
-import psycopg2
+import sys
 from flask import Flask, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import jwt_auth, responses, serving, tracing
+from common.cache import TTLCache
+from common.db_pool import ConnectionPool, ReplicaRouter
+from common.room_catalog import RoomCatalog
+
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
+tracing.init_app(app, 'room_service')
+# gzip/brotli and bytes-on-wire metrics for every response
+responses.init_app(app)
+# Room reads stay public (booking_service calls them server to server);
+# with JWT_REQUIRED=1 everything else needs a token from auth_service
+token_verifier = jwt_auth.TokenVerifier.from_env()
+jwt_auth.init_app(app, token_verifier, is_public=lambda req: req.method in ('GET', 'HEAD'))
+
+# Database Connection (pooled, shared between requests)
+db_pool = ConnectionPool.from_env('room')
+# Reads may go to the replicas listed in DB_REPLICAS (see common/db_pool.py)
+db_router = ReplicaRouter.from_env(db_pool)
 
-# Database Connection
 def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv('DB_HOST'),
-        database='postgres',
-        user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASS')
-    )
+    return db_pool.connection()
+
+# Each gunicorn worker gets its own connections (see gunicorn.conf.py)
+serving.on_worker_start(db_router.after_fork)
+
+# The rooms table barely changes, so both room endpoints read from memory,
+# reloading from a replica when the catalog version moves
+room_catalog = RoomCatalog(db_router.reads(), ttl=float(os.getenv('ROOM_CATALOG_TTL', 60)))
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "service": "Room Service"}), 200
+    return jsonify({
+        "status": "healthy",
+        "service": "Room Service",
+        "db_pool": db_pool.stats(),
+        "db_replicas": db_router.stats(),
+        "room_catalog": room_catalog.stats(),
+        "catalog_bodies": catalog_bodies.stats(),
+        "auth": token_verifier.stats()
+    }), 200
+
+# Browsers may reuse the room list for as long as the catalog itself may be stale
+ROOMS_CACHE_CONTROL = f"public, max-age={int(os.getenv('ROOMS_MAX_AGE', 60))}"
+# Serialized (and compressed) bodies per catalog version
+catalog_bodies = TTLCache(maxsize=int(os.getenv('ROOM_BODY_CACHE_SIZE', 256)), ttl=3600)
+
+def catalog_response(build, etag):
+    """The catalog as JSON under its version ETag; If-None-Match gets a 304."""
+    return responses.cached_json(etag, build, ROOMS_CACHE_CONTROL, bodies=catalog_bodies)
 
 # 1. Get ALL Rooms (For the 'Three Boxes' selection screen)
 @app.route('/rooms', methods=['GET'])
 def get_rooms():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        # Order by location so they are grouped nicely (Berlin, London, Paris)
-        cur.execute('SELECT * FROM rooms ORDER BY location, price_per_hour;')
-        rooms = cur.fetchall()
-        cur.close()
-        conn.close()
-
-        rooms_list = []
-        for r in rooms:
-            rooms_list.append({
-                "id": r[0],
-                "name": r[1],
-                "capacity": r[2],
-                "location": r[3],
-                "price_per_hour": float(r[4])
-            })
-        return jsonify(rooms_list), 200
+        # Served from memory, already ordered by location (Berlin, London, Paris)
+        snapshot = room_catalog.snapshot()
+        return catalog_response(lambda: snapshot.rooms, snapshot.etag)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -52,27 +73,30 @@ def get_rooms():
 @app.route('/rooms/<int:room_id>', methods=['GET'])
 def get_room(room_id):
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute('SELECT * FROM rooms WHERE id = %s', (room_id,))
-        r = cur.fetchone()
-        cur.close()
-        conn.close()
-
-        if r:
-            return jsonify({
-                "id": r[0],
-                "name": r[1],
-                "capacity": r[2],
-                "location": r[3],
-                "price_per_hour": float(r[4])
-            }), 200
+        room = room_catalog.get(room_id)
+        if room:
+            return catalog_response(lambda: room, f"{room_catalog.snapshot().etag}-{room_id}")
         else:
             return jsonify({"error": "Room not found"}), 404
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# 3. Force a catalog reload everywhere (e.g. after editing rooms with the
+# version trigger disabled). This bumps the shared version counter; this
+# worker re-checks on its next read, every other process (the other gunicorn
+# workers, booking_service) within ROOM_CATALOG_TTL.
+@app.route('/rooms/cache/invalidate', methods=['POST'])
+def invalidate_rooms():
+    try:
+        version = room_catalog.bump(db_pool)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({
+        "message": f"Room catalog version bumped; every worker reloads within {room_catalog.ttl:g}s",
+        "version": version
+    }), 200
+
 if __name__ == '__main__':
     # Run on port 5002
     app.run(host='0.0.0.0', port=5002)
\ No newline at end of file
@@ -52,6 +52,31 @@ def init_db():
                 room
             )
 
+        # 4. Catalog Version Counter
+        # Services cache the room list in memory; any change to `rooms` bumps
+        # this counter so their caches know to reload.
+        print("Setting up room catalog versioning...")
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS room_catalog_version (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            version BIGINT NOT NULL DEFAULT 1
+        );
+        INSERT INTO room_catalog_version (id, version) VALUES (TRUE, 1)
+        ON CONFLICT (id) DO UPDATE SET version = room_catalog_version.version + 1;
+
+        CREATE OR REPLACE FUNCTION bump_room_catalog_version() RETURNS trigger AS $$
+        BEGIN
+            UPDATE room_catalog_version SET version = version + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS rooms_catalog_version ON rooms;
+        CREATE TRIGGER rooms_catalog_version
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON rooms
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_room_catalog_version();
+        """)
+
         conn.commit()
         cur.close()
         conn.close()
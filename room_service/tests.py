@@ -0,0 +1,72 @@
+import gzip
+import json
+import unittest
+from unittest import mock
+import app as room_app
+from app import app, room_catalog
+from common.room_catalog import CatalogSnapshot
+
+ROOMS = [{"id": 1, "name": "Mitte Room", "capacity": 50, "location": "Berlin", "price_per_hour": 100.0}]
+SNAPSHOT = CatalogSnapshot(version=3, rooms=ROOMS, by_id={1: ROOMS[0]}, etag='rooms-v3', loaded_at=0)
+MANY_ROOMS = [dict(ROOMS[0], id=i, name=f"Room {i}") for i in range(1, 101)]
+BIG_SNAPSHOT = CatalogSnapshot(version=4, rooms=MANY_ROOMS, by_id={r["id"]: r for r in MANY_ROOMS},
+                               etag='rooms-v4', loaded_at=0)
+
+class RoomServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        patcher = mock.patch.object(room_catalog, 'snapshot', return_value=SNAPSHOT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_rooms_carry_etag(self):
+        """The room list is served with a version-based ETag"""
+        response = self.app.get('/rooms')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(), ROOMS)
+        self.assertEqual(response.headers['ETag'], '"rooms-v3"')
+
+    def test_if_none_match_returns_304(self):
+        """A client holding the current version gets an empty 304"""
+        response = self.app.get('/rooms', headers={'If-None-Match': '"rooms-v3"'})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_room_list_is_compressed_once_per_version(self):
+        """A large list is gzipped once and served as-is to every later request for that version"""
+        room_app.catalog_bodies.clear()
+        with mock.patch.object(room_catalog, 'snapshot', return_value=BIG_SNAPSHOT), \
+             mock.patch('common.responses.compress', wraps=room_app.responses.compress) as compress:
+            first = self.app.get('/rooms', headers={'Accept-Encoding': 'gzip'})
+            second = self.app.get('/rooms', headers={'Accept-Encoding': 'gzip, deflate'})
+            plain = self.app.get('/rooms')
+            cached = self.app.get('/rooms', headers={'If-None-Match': first.headers['ETag'],
+                                                     'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(first.headers['ETag'], '"rooms-v4-gzip"')
+        self.assertEqual(first.headers['Cache-Control'], 'public, max-age=60')
+        self.assertIn('Accept-Encoding', first.headers['Vary'])
+        self.assertEqual(second.get_data(), first.get_data())
+        self.assertEqual(json.loads(gzip.decompress(first.get_data())), MANY_ROOMS)
+        self.assertEqual(plain.headers['ETag'], '"rooms-v4"')
+        self.assertLess(len(first.get_data()), len(plain.get_data()) / 5)
+        self.assertEqual(cached.status_code, 304)
+
+    def test_invalidate_bumps_the_shared_version(self):
+        """Invalidation goes through the database so every worker sees it, not just this one"""
+        with mock.patch.object(room_catalog, 'bump', return_value=4) as bump:
+            response = self.app.post('/rooms/cache/invalidate')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['version'], 4)
+        bump.assert_called_once_with(room_app.db_pool)
+
+    def test_single_room(self):
+        """Single rooms come from the catalog and unknown ids are 404"""
+        self.assertEqual(self.app.get('/rooms/1').get_json()['location'], 'Berlin')
+        self.assertEqual(self.app.get('/rooms/99').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
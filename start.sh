@@ -20,10 +20,16 @@ sed -i "s|const API_WEATHER = \".*\";|const API_WEATHER = \"${WEATHER_URL}\";|g"
 echo "✅ Frontend updated."
 
 # --- 3. START SERVICES ---
+# Each service runs under gunicorn with several workers and threads
+# (see gunicorn.conf.py). Reload one gracefully with: kill -HUP $(cat booking.pid)
 echo "🚀 Launching Microservices..."
-python weather_service/app.py > weather.log 2>&1 &
-python room_service/app.py > room.log 2>&1 &
-python booking_service/app.py > booking.log 2>&1 &
+# Workers of a service sum their /metrics through their own METRICS_DIR
+start_service() {
+    METRICS_DIR="$PWD/metrics/$3" gunicorn -c gunicorn.conf.py --chdir "$1" --bind "0.0.0.0:$2" --pid "$3.pid" app:app > "$3.log" 2>&1 &
+}
+start_service weather_service 5000 weather
+start_service room_service 5002 room
+start_service booking_service 5004 booking
 
 cd frontend
 python -m http.server 8000 > ../frontend.log 2>&1 &
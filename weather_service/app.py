@@ -1,4 +1,7 @@
+import logging
 import random
+import sys
+import threading
 import time
 import os
 import boto3
@@ -6,91 +9,405 @@ from flask import Flask, jsonify, request
 from flask_cors import CORS
 from dotenv import load_dotenv
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import responses, serving, tracing
+from common.cache import SingleFlight, TTLCache
+from fake_dynamo import InMemoryDynamoDB
+import materialize
+
 # Load environment variables
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app)
+tracing.init_app(app, 'weather_service')
+# Batch forecast responses get gzip/brotli above the size threshold
+responses.init_app(app)
 
 # --- CONFIGURATION ---
+# Forecasts never change once written, so each process keeps a bounded
+# LRU+TTL cache in front of DynamoDB. Fallbacks produced while DynamoDB is
+# failing are cached for a much shorter time (negative caching).
+WEATHER_CACHE_SIZE = int(os.getenv('WEATHER_CACHE_SIZE', 10000))
+WEATHER_CACHE_TTL = float(os.getenv('WEATHER_CACHE_TTL', 3600))
+WEATHER_NEGATIVE_TTL = float(os.getenv('WEATHER_NEGATIVE_TTL', 30))
+
+weather_cache = TTLCache(maxsize=WEATHER_CACHE_SIZE, ttl=WEATHER_CACHE_TTL)
+# Concurrent misses for the same (location, date) share one DynamoDB lookup
+weather_lookups = SingleFlight()
+
+TABLE_NAME = 'WeatherForecast'
+# DynamoDB limit for keys in a single BatchGetItem call
+BATCH_GET_LIMIT = 100
+MAX_BATCH_ITEMS = int(os.getenv('WEATHER_MAX_BATCH', 1000))
+
+# Where /weather answers came from: the process cache, DynamoDB, generated on
+# the spot, or a fallback (DynamoDB could not say whether the forecast exists,
+# so one is made up, cached briefly and never written). With the
+# materialization job running, "generated" stays at 0.
+forecast_lookups = tracing.register(tracing.Counter(
+    'weather_forecast_lookups_total', 'Forecast lookups by where the answer came from.', ('result',)
+))
+
+# Background pre-generation (see materialize.py); 0 disables it
+MATERIALIZE_INTERVAL = float(os.getenv('WEATHER_MATERIALIZE_INTERVAL', 0))
+MATERIALIZE_DAYS = int(os.getenv('WEATHER_MATERIALIZE_DAYS', 30))
+
+_dynamodb = None
+_table = None
+_table_lock = threading.Lock()
+
+def get_dynamodb():
+    """Return the DynamoDB resource, creating the client once per process.
+
+    WEATHER_BACKEND=memory swaps DynamoDB for an in-process stand-in.
+    """
+    global _dynamodb
+    if _dynamodb is None:
+        with _table_lock:
+            if _dynamodb is None:
+                if os.getenv('WEATHER_BACKEND', 'dynamodb') == 'memory':
+                    _dynamodb = InMemoryDynamoDB()
+                else:
+                    _dynamodb = boto3.resource(
+                        'dynamodb',
+                        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
+                        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
+                        aws_session_token=os.getenv('AWS_SESSION_TOKEN'),
+                        region_name=os.getenv('AWS_REGION', 'us-east-1')
+                    )
+    return _dynamodb
+
 def get_dynamo_table():
-    dynamodb = boto3.resource(
-        'dynamodb',
-        aws_access_key_id=os.getenv('AWS_ACCESS_KEY_ID'),
-        aws_secret_access_key=os.getenv('AWS_SECRET_ACCESS_KEY'),
-        aws_session_token=os.getenv('AWS_SESSION_TOKEN'), 
-        region_name=os.getenv('AWS_REGION', 'us-east-1')
-    )
-    return dynamodb.Table('WeatherForecast')
+    global _table
+    if _table is None:
+        _table = get_dynamodb().Table(TABLE_NAME)
+    return _table
+
+@serving.on_worker_start
+def init_worker():
+    # boto3 clients are not fork-safe: each worker creates its own on first use
+    global _dynamodb, _table
+    _dynamodb = None
+    _table = None
+
+def lookup_stats():
+    counts = {result: forecast_lookups.value(result) for result in ('cache', 'stored', 'generated', 'fallback')}
+    total = sum(counts.values())
+    counts["hit_ratio"] = round(1 - (counts['generated'] + counts['fallback']) / total, 4) if total else 0.0
+    return counts
 
 @app.route('/health', methods=['GET'])
 def health():
-    return jsonify({"status": "healthy", "service": "Weather Service (AWS DynamoDB)"}), 200
+    return jsonify({
+        "status": "healthy",
+        "service": "Weather Service (AWS DynamoDB)",
+        "cache": weather_cache.stats(),
+        "coalesced_lookups": weather_lookups.coalesced,
+        "lookups": lookup_stats(),
+        "materializer": materializer.stats()
+    }), 200
+
+def generate_forecast(city_id, date_str):
+    # Seeded by the key, so every process (and the materialization job)
+    # generates the same forecast for a location and date even if they race
+    rng = random.Random(f"{city_id}|{date_str}")
+    if 'london' in city_id:
+        return rng.randint(9, 14), "Rainy"
+    elif 'berlin' in city_id:
+        return rng.randint(14, 19), "Cloudy"
+    elif 'paris' in city_id:
+        return rng.randint(24, 29), "Sunny"
+    else:
+        return 20, "Clear"
+
+def item_to_forecast(item, city):
+    return {
+        "location": item.get('display_name', city),
+        "temperature": float(item['temperature']),
+        "condition": item['condition'],
+        "source": "AWS DynamoDB"
+    }
+
+def new_forecast_record(city, city_id, date_str):
+    temp, condition = generate_forecast(city_id, date_str)
+    return {
+        'location_id': city_id,
+        'date': date_str,
+        'display_name': city.title(),
+        'temperature': int(temp),
+        'condition': condition,
+        'created_at': str(time.time())
+    }
+
+def record_to_forecast(record, source="Generated (Saved to DB)"):
+    return {
+        "location": record['display_name'],
+        "temperature": record['temperature'],
+        "condition": record['condition'],
+        "source": source
+    }
+
+def fallback_forecast(city, city_id, date_str):
+    """A forecast for a key DynamoDB could not confirm either way.
+
+    It is never written: a stored forecast may exist, and overwriting it
+    would change a value clients have already seen.
+    """
+    forecast_lookups.inc('fallback')
+    record = new_forecast_record(city, city_id, date_str)
+    return record_to_forecast(record, source="Generated (DynamoDB unavailable, not saved)")
+
+def lookup_forecast(city, city_id, date_str):
+    """Read the forecast from DynamoDB, generating and saving it if missing.
+
+    Returns (forecast, ttl) where ttl is how long the result may be cached.
+    Only a read that found nothing leads to a write; a failed read gets a
+    fallback that is cached briefly and not saved.
+    """
+    # --- 1. TRY TO READ FROM DYNAMODB ---
+    try:
+        table = get_dynamo_table()
+        with tracing.span('dynamodb', 'GetItem'):
+            response = table.get_item(
+                Key={
+                    'location_id': city_id,
+                    'date': date_str
+                }
+            )
+    except Exception as e:
+        tracing.log_event('dynamodb_read_error', logging.WARNING, error=str(e))
+        return fallback_forecast(city, city_id, date_str), WEATHER_NEGATIVE_TTL
+
+    if 'Item' in response:
+        tracing.log_event('forecast_found', logging.DEBUG, location=city, date=date_str)
+        forecast_lookups.inc('stored')
+        return item_to_forecast(response['Item'], city), WEATHER_CACHE_TTL
+
+    # --- 2. GENERATE: DYNAMODB CONFIRMED IT IS NOT THERE ---
+    tracing.log_event('forecast_generated', location=city, date=date_str)
+    forecast_lookups.inc('generated')
+    new_record = new_forecast_record(city, city_id, date_str)
+
+    # --- 3. WRITE TO DYNAMODB ---
+    ttl = WEATHER_CACHE_TTL
+    try:
+        with tracing.span('dynamodb', 'PutItem'):
+            table.put_item(Item=new_record)
+        tracing.log_event('forecast_saved', location_id=city_id, date=date_str)
+    except Exception as e:
+        tracing.log_event('dynamodb_write_error', logging.ERROR, error=str(e))
+        # Not persisted: only cache briefly so DynamoDB is retried soon
+        ttl = WEATHER_NEGATIVE_TTL
+
+    return record_to_forecast(new_record), ttl
+
+def resolve_forecast(city, date_str):
+    """Cached, single-flight forecast lookup for one (location, date)."""
+    city_id = city.lower()
+    key = (city_id, date_str)
+
+    forecast = weather_cache.get(key)
+    if forecast is not None:
+        forecast_lookups.inc('cache')
+        return forecast
+
+    def load():
+        # Re-check: a concurrent leader may have filled the cache already
+        cached = weather_cache.get(key)
+        if cached is not None:
+            forecast_lookups.inc('cache')
+            return cached
+        forecast, ttl = lookup_forecast(city, city_id, date_str)
+        weather_cache.set(key, forecast, ttl=ttl)
+        return forecast
+
+    return weather_lookups.do(key, load)
 
 @app.route('/weather', methods=['GET'])
 def get_weather():
     # 1. Get Query Params
     city = request.args.get('location', 'Unknown')
     date_str = request.args.get('date', '2025-01-01') 
-    city_id = city.lower()
 
-    # --- 2. TRY TO READ FROM DYNAMODB ---
+    return jsonify(resolve_forecast(city, date_str)), 200
+
+def batch_read(keys):
+    """BatchGetItem for many (location_id, date) keys, 100 at a time.
+
+    Returns (found, unresolved): the items DynamoDB returned, and the keys it
+    never answered for (still unprocessed after the retries, or in a request
+    that failed). Every other key is confirmed absent.
+    """
+    found, unresolved = {}, []
     try:
-        table = get_dynamo_table()
-        response = table.get_item(
-            Key={
-                'location_id': city_id,
-                'date': date_str
-            }
-        )
-        
-        if 'Item' in response:
-            # flush=True ensures this shows up instantly on your screen during the video!
-            print(f"✅ FOUND in AWS DynamoDB: {city} on {date_str}", flush=True)
-            item = response['Item']
-            return jsonify({
-                "location": item.get('display_name', city),
-                "temperature": float(item['temperature']),
-                "condition": item['condition'],
-                "source": "AWS DynamoDB"
-            }), 200
-            
+        dynamodb = get_dynamodb()
     except Exception as e:
-        print(f"⚠️ DynamoDB Read Error (Using fallback): {str(e)}", flush=True)
+        tracing.log_event('dynamodb_read_error', logging.WARNING, error=str(e))
+        return found, list(keys)
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request_keys = [
+            {'location_id': city_id, 'date': date_str}
+            for city_id, date_str in keys[start:start + BATCH_GET_LIMIT]
+        ]
+        # DynamoDB may hand back part of a batch as unprocessed; retry those
+        try:
+            for attempt in range(4):
+                if attempt:
+                    time.sleep(0.05 * 2 ** attempt)
+                with tracing.span('dynamodb', 'BatchGetItem'):
+                    response = dynamodb.batch_get_item(
+                        RequestItems={TABLE_NAME: {'Keys': request_keys}}
+                    )
+                for item in response.get('Responses', {}).get(TABLE_NAME, []):
+                    found[(item['location_id'], item['date'])] = item
+                request_keys = response.get('UnprocessedKeys', {}).get(TABLE_NAME, {}).get('Keys')
+                if not request_keys:
+                    break
+        except Exception as e:
+            tracing.log_event('dynamodb_read_error', logging.WARNING, error=str(e))
+            # Give up on the rest too: DynamoDB is probably down
+            unresolved += [(k['location_id'], k['date']) for k in request_keys]
+            unresolved += keys[start + BATCH_GET_LIMIT:]
+            break
+        unresolved += [(k['location_id'], k['date']) for k in request_keys or ()]
+    return found, unresolved
 
-    # --- 3. GENERATE IF NOT FOUND ---
-    print(f"⚠️ NOT FOUND. Generating new data for {city}...", flush=True)
+def batch_write(records):
+    # batch_writer groups puts into BatchWriteItem calls of 25
+    # and resends anything DynamoDB reports as unprocessed
+    with tracing.span('dynamodb', 'BatchWriteItem'), get_dynamo_table().batch_writer() as batch:
+        for record in records:
+            batch.put_item(Item=record)
 
-    if 'london' in city_id:
-        temp, condition = random.randint(9, 14), "Rainy"
-    elif 'berlin' in city_id:
-        temp, condition = random.randint(14, 19), "Cloudy"
-    elif 'paris' in city_id:
-        temp, condition = random.randint(24, 29), "Sunny"
-    else:
-        temp, condition = 20, "Clear"
+def resolve_many(pairs):
+    """Resolve a list of (location, date) pairs with as few DynamoDB calls as possible.
+
+    Cache hits are served from memory, the rest are read with BatchGetItem and
+    keys DynamoDB confirmed absent are generated and saved with one
+    BatchWriteItem. Keys it could not answer for get a fallback that is cached
+    briefly and not saved. Misses are coalesced with concurrent /weather and
+    batch lookups of the same keys. Results come back in input order.
+    """
+    wanted = {}
+    for city, date_str in pairs:
+        wanted.setdefault((city.lower(), date_str), city)
 
-    # --- 4. WRITE TO DYNAMODB ---
+    forecasts = {}
+    for key in wanted:
+        cached = weather_cache.get(key)
+        if cached is not None:
+            forecasts[key] = cached
+
+    missing = [key for key in wanted if key not in forecasts]
+    forecast_lookups.inc('cache', amount=len(forecasts))
+    if missing:
+        forecasts.update(weather_lookups.do_many(missing, lambda keys: load_many(keys, wanted)))
+
+    return [forecasts[(city.lower(), date_str)] for city, date_str in pairs]
+
+def load_many(keys, cities):
+    """Leader side of resolve_many: fetch, generate and cache ``keys``."""
+    forecasts = {}
+    # Re-check: a concurrent leader may have filled the cache already
+    for key in keys:
+        cached = weather_cache.get(key)
+        if cached is not None:
+            forecasts[key] = cached
+    forecast_lookups.inc('cache', amount=len(forecasts))
+    keys = [key for key in keys if key not in forecasts]
+    if not keys:
+        return forecasts
+
+    found, unresolved = batch_read(keys)
+    for key, item in found.items():
+        forecasts[key] = item_to_forecast(item, cities[key])
+        weather_cache.set(key, forecasts[key])
+    forecast_lookups.inc('stored', amount=len(found))
+
+    for key in unresolved:
+        forecasts[key] = fallback_forecast(cities[key], key[0], key[1])
+        weather_cache.set(key, forecasts[key], ttl=WEATHER_NEGATIVE_TTL)
+
+    new_records = [new_forecast_record(cities[key], key[0], key[1])
+                   for key in keys if key not in forecasts]
+    forecast_lookups.inc('generated', amount=len(new_records))
+    ttl = WEATHER_CACHE_TTL
+    if new_records:
+        try:
+            batch_write(new_records)
+            tracing.log_event('forecasts_saved', count=len(new_records))
+        except Exception as e:
+            tracing.log_event('dynamodb_write_error', logging.ERROR, error=str(e))
+            ttl = WEATHER_NEGATIVE_TTL
+    for record in new_records:
+        key = (record['location_id'], record['date'])
+        forecasts[key] = record_to_forecast(record)
+        weather_cache.set(key, forecasts[key], ttl=ttl)
+    return forecasts
+
+@app.route('/weather/batch', methods=['POST'])
+def get_weather_batch():
+    # Body: {"items": [{"location": "Paris", "date": "2025-03-01"}, ...]}
+    data = request.get_json(silent=True) or {}
+    items = data.get('items')
+
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Provide a non-empty 'items' list of {location, date}"}), 400
+    if len(items) > MAX_BATCH_ITEMS:
+        return jsonify({"error": f"At most {MAX_BATCH_ITEMS} items per batch"}), 400
     try:
-        new_record = {
-            'location_id': city_id,
-            'date': date_str,
-            'display_name': city.title(),
-            'temperature': int(temp),
-            'condition': condition,
-            'created_at': str(time.time())
-        }
-        table.put_item(Item=new_record)
-        print(f"✅ SAVED to AWS DynamoDB: {city_id}", flush=True)
-    except Exception as e:
-        print(f"❌ DynamoDB Write Error: {str(e)}", flush=True)
+        pairs = [(str(item['location']), str(item['date'])) for item in items]
+    except (KeyError, TypeError):
+        return jsonify({"error": "Every item needs a location and a date"}), 400
 
-    return jsonify({
-        "location": city.title(),
-        "temperature": temp,
-        "condition": condition,
-        "source": "Generated (Saved to DB)"
-    }), 200
+    results = []
+    for (city, date_str), forecast in zip(pairs, resolve_many(pairs)):
+        results.append({**forecast, "date": date_str})
+    return jsonify({"results": results}), 200
+
+def materialize_forecasts(locations, dates):
+    """Generate and save every missing forecast for ``locations`` x ``dates``.
+
+    Existing forecasts are kept. Both kinds end up in this process's cache,
+    so requests for the horizon are served from memory. Keys DynamoDB did not
+    answer for are skipped (and counted) rather than written: they may hold
+    forecasts from before generation was seeded, which must not change.
+    The next run picks them up.
+    """
+    wanted = {(city.lower(), date_str): city for city in locations for date_str in dates}
+    existing, unresolved = batch_read(list(wanted))
+    skipped = set(unresolved)
+    new_records = [
+        new_forecast_record(city, key[0], key[1])
+        for key, city in wanted.items() if key not in existing and key not in skipped
+    ]
+    if new_records:
+        batch_write(new_records)
+    for key, item in existing.items():
+        weather_cache.set(key, item_to_forecast(item, wanted[key]))
+    for record in new_records:
+        weather_cache.set((record['location_id'], record['date']), record_to_forecast(record))
+    tracing.log_event('forecasts_materialized', locations=len(locations), dates=len(dates),
+                      existing=len(existing), written=len(new_records), skipped=len(skipped))
+    return {"locations": len(locations), "existing": len(existing), "written": len(new_records),
+            "skipped": len(skipped)}
+
+materializer = materialize.Scheduler(
+    materialize.run_exclusively(
+        lambda: materialize_forecasts(materialize.room_locations(), materialize.horizon(MATERIALIZE_DAYS))
+    ),
+    MATERIALIZE_INTERVAL
+)
+serving.on_worker_start(materialize.db_pool.after_fork)
+# Started in each worker after the fork (threads do not survive it), and
+# otherwise by the first request, whatever server runs the app
+serving.on_worker_start(materializer.start)
+
+@app.before_request
+def start_materializer():
+    materializer.start()
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
+    materializer.start()
+    app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,78 @@
+import threading
+
+
+class InMemoryTable:
+    """Stand-in for the boto3 `WeatherForecast` Table resource.
+
+    Implements the subset of the Table API the weather service uses, keyed on
+    (location_id, date) like the real table. Enable it with
+    WEATHER_BACKEND=memory for local runs, tests and benchmarks.
+    """
+
+    key_names = ('location_id', 'date')
+
+    def __init__(self, name='WeatherForecast'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._items = {}
+        self.reads = 0
+        self.writes = 0
+
+    def _key(self, key):
+        return tuple(key[name] for name in self.key_names)
+
+    def get_item(self, Key, **kwargs):
+        with self._lock:
+            self.reads += 1
+            item = self._items.get(self._key(Key))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        with self._lock:
+            self.writes += 1
+            self._items[self._key(Item)] = dict(Item)
+        return {}
+
+    def batch_writer(self, **kwargs):
+        return _BatchWriter(self)
+
+
+class _BatchWriter:
+    def __init__(self, table):
+        self.table = table
+        self._items = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for item in self._items:
+            self.table.put_item(Item=item)
+        return False
+
+    def put_item(self, Item):
+        self._items.append(Item)
+
+
+class InMemoryDynamoDB:
+    """Stand-in for the boto3 DynamoDB service resource (Table + BatchGetItem)."""
+
+    def __init__(self):
+        self.tables = {}
+        self.batch_gets = 0
+
+    def Table(self, name):
+        return self.tables.setdefault(name, InMemoryTable(name))
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self.batch_gets += 1
+        responses = {}
+        for name, request in RequestItems.items():
+            if len(request['Keys']) > 100:
+                raise ValueError("BatchGetItem accepts at most 100 keys")
+            table = self.Table(name)
+            responses[name] = [
+                found['Item'] for found in (table.get_item(Key=key) for key in request['Keys'])
+                if 'Item' in found
+            ]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
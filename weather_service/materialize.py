@@ -0,0 +1,192 @@
+"""Pre-generate forecasts so /weather never has to create one inside a request.
+
+Every location that has a room (read from the ``rooms`` table) gets a forecast
+for each day of a rolling horizon, written with BatchWriteItem. Keys that
+already exist are left alone, so the job is safe to re-run at any time.
+
+Run it once, or keep it going on a timer:
+
+    python materialize.py --days 30
+    python materialize.py --days 30 --interval 3600
+
+or let weather_service run it in the background by setting
+WEATHER_MATERIALIZE_INTERVAL (seconds) and WEATHER_MATERIALIZE_DAYS. Every
+process then keeps a timer, but a run only goes ahead in the one holding a
+Postgres advisory lock; the others skip it, so each interval the horizon is
+read and written once, not once per worker.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+from dotenv import load_dotenv
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common import tracing
+from common.db_pool import ConnectionPool
+
+load_dotenv()
+
+# Same DB_* settings (host, port, ...) as every other service
+db_pool = ConnectionPool.from_env(
+    'weather-materialize', host='localhost', database='postgres', user='postgres', password='postgres'
+)
+
+# pg_try_advisory_lock key held by whichever process is materializing
+LOCK_KEY = zlib.crc32(b'weather_service.materialize')
+
+
+def room_locations():
+    """Distinct room locations from the shared Postgres database."""
+    with db_pool.connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT DISTINCT location FROM rooms WHERE location IS NOT NULL ORDER BY location")
+        locations = [row[0] for row in cur.fetchall()]
+        conn.commit()
+    return locations
+
+
+@contextmanager
+def exclusive(pool=None):
+    """Yield True while holding the materializer's advisory lock, False if
+    another process has it. The lock is a session lock, held on a pooled
+    connection for the whole block; if that session dies, Postgres drops it.
+    """
+    pool = pool or db_pool
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_KEY,))
+            held = cur.fetchone()[0]
+        conn.commit()
+        try:
+            yield held
+        finally:
+            if held:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+                conn.commit()
+
+
+def run_exclusively(job):
+    """``job`` wrapped to run only while holding the advisory lock; elsewhere it returns None."""
+    def locked_job():
+        with exclusive() as held:
+            return job() if held else None
+    return locked_job
+
+
+def horizon(days, start=None):
+    """ISO dates from ``start`` (default today) for ``days`` days."""
+    start = start or date.today()
+    return [(start + timedelta(days=offset)).isoformat() for offset in range(days)]
+
+
+class Scheduler:
+    """Runs ``job`` every ``interval`` seconds on a daemon thread.
+
+    A job returning None did not run here (another process holds the lock)
+    and is counted under ``skipped``.
+    """
+
+    def __init__(self, job, interval):
+        self.job = job
+        self.interval = interval
+        self.runs = 0
+        self.skipped = 0
+        self.last_run = None
+        self.last_result = None
+        self.last_error = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Start the timer in this process, if it is not running yet. Cheap
+        enough to call on every request."""
+        if self.interval <= 0 or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._lock:
+            # A thread started before a fork does not exist in the child
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='materializer', daemon=True)
+            self._pid = os.getpid()
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def run_once(self):
+        started = time.monotonic()
+        try:
+            result = self.job()
+            self.last_error = None
+            if result is None:
+                self.skipped += 1
+            else:
+                self.last_result = result
+        except Exception as e:
+            self.last_error = str(e)
+            tracing.log_event('materialize_error', logging.ERROR, error=str(e))
+        self.runs += 1
+        self.last_run = time.time()
+        return time.monotonic() - started
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "last_run": self.last_run,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=int(os.getenv('WEATHER_MATERIALIZE_DAYS', 30)))
+    parser.add_argument('--start', type=date.fromisoformat, help="first date (default: today)")
+    parser.add_argument('--locations', help="comma-separated list instead of the rooms table")
+    parser.add_argument('--interval', type=float, default=0, help="repeat every N seconds")
+    args = parser.parse_args()
+
+    import app as weather_app
+
+    def job():
+        locations = args.locations.split(',') if args.locations else room_locations()
+        dates = horizon(args.days, args.start)
+        return weather_app.materialize_forecasts(locations, dates)
+
+    scheduler = Scheduler(job, args.interval)
+    while True:
+        seconds = scheduler.run_once()
+        if scheduler.last_error:
+            print(f"❌ {scheduler.last_error}")
+        else:
+            result = scheduler.last_result
+            print(f"✅ {result['locations']} locations x {args.days} days: "
+                  f"{result['existing']} already stored, {result['written']} written in {seconds:.2f}s")
+            if result['skipped']:
+                print(f"⚠️ {result['skipped']} keys could not be read and were left for the next run")
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+    if scheduler.last_error:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
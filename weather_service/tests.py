@@ -0,0 +1,251 @@
+import os
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from datetime import date
+from unittest import mock
+
+os.environ['WEATHER_BACKEND'] = 'memory'
+import app as weather_app
+from app import app, weather_cache
+from fake_dynamo import InMemoryDynamoDB
+import materialize
+
+class FakeLockConnection:
+    """A pooled connection whose pg_try_advisory_lock answers ``granted``."""
+
+    def __init__(self, granted):
+        self.granted = granted
+        self.executed = []
+
+    @contextmanager
+    def connection(self, timeout=None):
+        yield self
+
+    @contextmanager
+    def cursor(self):
+        yield self
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+
+    def fetchone(self):
+        return (self.granted,)
+
+    def commit(self):
+        pass
+
+class WeatherServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.app.testing = True
+        self.dynamodb = InMemoryDynamoDB()
+        self.table = self.dynamodb.Table('WeatherForecast')
+        for name, value in (('_dynamodb', self.dynamodb), ('_table', self.table)):
+            patcher = mock.patch.object(weather_app, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        weather_cache.clear()
+
+    def test_miss_is_generated_saved_and_cached(self):
+        """A new date is generated once, written back and then served from memory"""
+        first = self.app.get('/weather?location=Paris&date=2030-06-01').get_json()
+        second = self.app.get('/weather?location=Paris&date=2030-06-01').get_json()
+        self.assertEqual(first, second)
+        self.assertEqual((self.table.reads, self.table.writes), (1, 1))
+
+    def test_concurrent_misses_are_coalesced(self):
+        """Simultaneous requests for one key trigger a single DynamoDB read"""
+        original_get = self.table.get_item
+
+        def slow_get(**kwargs):
+            time.sleep(0.05)
+            return original_get(**kwargs)
+
+        results = []
+        with mock.patch.object(self.table, 'get_item', side_effect=slow_get) as get_item:
+            threads = [
+                threading.Thread(target=lambda: results.append(weather_app.resolve_forecast('Berlin', '2030-06-02')))
+                for _ in range(8)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(get_item.call_count, 1)
+        self.assertEqual(len({r['temperature'] for r in results}), 1)
+
+    def test_backend_failure_is_cached_briefly(self):
+        """Fallbacks produced while DynamoDB fails use the short negative TTL"""
+        with mock.patch.object(self.table, 'get_item', side_effect=RuntimeError('down')), \
+             mock.patch.object(self.table, 'put_item', side_effect=RuntimeError('down')), \
+             mock.patch.object(weather_cache, 'set', wraps=weather_cache.set) as cache_set:
+            self.app.get('/weather?location=London&date=2030-06-03')
+        self.assertEqual(cache_set.call_args.kwargs['ttl'], weather_app.WEATHER_NEGATIVE_TTL)
+
+    def test_failed_read_never_overwrites(self):
+        """A read error is not a miss: the fallback is served but not written over a stored forecast"""
+        with mock.patch.object(self.table, 'get_item', side_effect=RuntimeError('throttled')), \
+             mock.patch.object(self.table, 'put_item') as put_item:
+            forecast = self.app.get('/weather?location=London&date=2030-06-04').get_json()
+        put_item.assert_not_called()
+        self.assertIn('not saved', forecast['source'])
+
+    def seed(self, city_id, date_str, temperature):
+        self.table.put_item(Item={
+            'location_id': city_id, 'date': date_str, 'display_name': city_id.title(),
+            'temperature': temperature, 'condition': 'Stored'
+        })
+
+    def test_batch_only_generates_confirmed_misses(self):
+        """Keys DynamoDB keeps returning as unprocessed get a brief fallback and are never written"""
+        self.seed('paris', '2030-07-03', 99)
+        stuck = {'location_id': 'paris', 'date': '2030-07-03'}
+
+        def partial(RequestItems):
+            keys = [k for k in RequestItems['WeatherForecast']['Keys'] if k != stuck]
+            response = InMemoryDynamoDB.batch_get_item(self.dynamodb, {'WeatherForecast': {'Keys': keys}})
+            response['UnprocessedKeys'] = {'WeatherForecast': {'Keys': [stuck]}}
+            return response
+
+        items = [{"location": "Paris", "date": "2030-07-03"}, {"location": "Berlin", "date": "2030-07-04"}]
+        with mock.patch.object(self.dynamodb, 'batch_get_item', side_effect=partial), \
+             mock.patch.object(weather_app.time, 'sleep'), \
+             mock.patch.object(weather_cache, 'set', wraps=weather_cache.set) as cache_set:
+            results = self.app.post('/weather/batch', json={"items": items}).get_json()['results']
+
+        self.assertEqual(self.table._items[('paris', '2030-07-03')]['temperature'], 99)
+        self.assertEqual(self.table.writes, 2)      # the seed row + Berlin, which was confirmed absent
+        self.assertIn('not saved', results[0]['source'])
+        ttls = {call.args[0]: call.kwargs.get('ttl') for call in cache_set.call_args_list}
+        self.assertEqual(ttls[('paris', '2030-07-03')], weather_app.WEATHER_NEGATIVE_TTL)
+
+    def test_batch_read_error_keeps_what_was_found(self):
+        """A failing BatchGetItem call leaves earlier chunks' items intact and writes nothing for the rest"""
+        self.seed('paris', '2030-01-01', 99)
+        calls = []
+
+        def second_call_fails(RequestItems):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('throttled')
+            return InMemoryDynamoDB.batch_get_item(self.dynamodb, RequestItems)
+
+        keys = [('paris', '2030-01-01')] + [('paris', f"2031-{m:02d}-{d:02d}") for m in range(1, 8) for d in range(1, 29)]
+        with mock.patch.object(self.dynamodb, 'batch_get_item', side_effect=second_call_fails):
+            found, unresolved = weather_app.batch_read(keys)
+        self.assertEqual(list(found), [('paris', '2030-01-01')])
+        self.assertEqual(unresolved, keys[weather_app.BATCH_GET_LIMIT:])
+
+    def test_batch_misses_are_coalesced_with_single_lookups(self):
+        """A batch and a /weather request for the same new key share one read and one write"""
+        original = self.dynamodb.batch_get_item
+
+        def slow_batch(**kwargs):
+            time.sleep(0.05)
+            return original(**kwargs)
+
+        results = []
+        with mock.patch.object(self.dynamodb, 'batch_get_item', side_effect=slow_batch):
+            batch = threading.Thread(target=lambda: results.append(
+                weather_app.resolve_many([('Berlin', '2030-07-05')])[0]))
+            batch.start()
+            time.sleep(0.01)
+            results.append(weather_app.resolve_forecast('Berlin', '2030-07-05'))
+            batch.join()
+        self.assertEqual((self.table.reads, self.table.writes), (1, 1))
+        self.assertEqual(results[0], results[1])
+
+    def test_batch_reads_once_and_writes_only_missing(self):
+        """The batch endpoint keeps input order and only generates unknown keys"""
+        self.table.put_item(Item={
+            'location_id': 'paris', 'date': '2030-07-01', 'display_name': 'Paris',
+            'temperature': 27, 'condition': 'Sunny'
+        })
+        items = [
+            {"location": "Berlin", "date": "2030-07-02"},
+            {"location": "Paris", "date": "2030-07-01"},
+            {"location": "berlin", "date": "2030-07-02"},
+        ]
+        response = self.app.post('/weather/batch', json={"items": items})
+        results = response.get_json()['results']
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['date'] for r in results], ['2030-07-02', '2030-07-01', '2030-07-02'])
+        self.assertEqual(results[1]['temperature'], 27.0)
+        self.assertEqual(results[0]['temperature'], results[2]['temperature'])
+        self.assertEqual(self.dynamodb.batch_gets, 1)
+        self.assertEqual(self.table.writes, 2)      # the seed row + one generated
+
+        # Everything is cached now
+        self.app.post('/weather/batch', json={"items": items})
+        self.assertEqual(self.dynamodb.batch_gets, 1)
+
+    def test_materialized_horizon_is_served_without_generating(self):
+        """Pre-generated forecasts are stored once and requests only read them"""
+        dates = materialize.horizon(3, date(2030, 8, 1))
+        result = weather_app.materialize_forecasts(['Paris', 'Berlin'], dates)
+        self.assertEqual(result, {"locations": 2, "existing": 0, "written": 6, "skipped": 0})
+        self.assertEqual(self.table.writes, 6)
+
+        # Re-running keeps what is there, even with a cold process cache
+        weather_cache.clear()
+        self.assertEqual(weather_app.materialize_forecasts(['Paris', 'Berlin'], dates)['written'], 0)
+
+        generated = weather_app.forecast_lookups.value('generated')
+        reads = self.table.reads
+        self.app.get('/weather?location=Paris&date=2030-08-02')
+        self.assertEqual(self.table.reads, reads)
+        self.assertEqual(weather_app.forecast_lookups.value('generated'), generated)
+        self.assertIn('weather_forecast_lookups_total{result="cache"',
+                      self.app.get('/metrics').get_data(as_text=True))
+
+    def test_materialize_skips_unreadable_keys(self):
+        """An incomplete read leaves those keys alone instead of overwriting older forecasts"""
+        self.seed('paris', '2030-08-10', 99)
+
+        def unprocessed(RequestItems):
+            return {'Responses': {}, 'UnprocessedKeys': RequestItems}
+
+        with mock.patch.object(self.dynamodb, 'batch_get_item', side_effect=unprocessed), \
+             mock.patch.object(weather_app.time, 'sleep'):
+            result = weather_app.materialize_forecasts(['Paris'], ['2030-08-10', '2030-08-11'])
+        self.assertEqual(result, {"locations": 1, "existing": 0, "written": 0, "skipped": 2})
+        self.assertEqual(self.table._items[('paris', '2030-08-10')]['temperature'], 99)
+
+    def test_generated_forecasts_agree_across_processes(self):
+        """Two processes generating the same key independently save the same value"""
+        self.assertEqual(weather_app.generate_forecast('paris', '2030-09-01'),
+                         weather_app.generate_forecast('paris', '2030-09-01'))
+
+    def test_batch_rejects_bad_items(self):
+        """Malformed batches are a 400"""
+        self.assertEqual(self.app.post('/weather/batch', json={"items": []}).status_code, 400)
+        self.assertEqual(self.app.post('/weather/batch', json={"items": [{"date": "x"}]}).status_code, 400)
+
+    def test_only_the_lock_holder_materializes(self):
+        """Every worker keeps a timer, but a run only happens where the advisory lock was granted"""
+        job = mock.Mock(return_value={"written": 0})
+        scheduler = materialize.Scheduler(materialize.run_exclusively(job), 60)
+
+        with mock.patch.object(materialize, 'db_pool', FakeLockConnection(False)):
+            scheduler.run_once()
+        job.assert_not_called()
+        self.assertEqual((scheduler.runs, scheduler.skipped), (1, 1))
+
+        lock = FakeLockConnection(True)
+        with mock.patch.object(materialize, 'db_pool', lock):
+            scheduler.run_once()
+        job.assert_called_once_with()
+        self.assertEqual(scheduler.last_result, {"written": 0})
+        self.assertIn('pg_advisory_unlock', lock.executed[-1])
+
+    def test_first_request_starts_the_materializer(self):
+        """Without gunicorn's post_fork hook the scheduler starts with the first request"""
+        with mock.patch.object(weather_app.materializer, 'start') as start:
+            self.app.get('/health')
+        start.assert_called_once_with()
+
+if __name__ == '__main__':
+    unittest.main()